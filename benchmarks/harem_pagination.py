@@ -0,0 +1,135 @@
+"""In-process vs server-side /harem pagination on synthetic harems.
+
+Seeds a scratch database (dropped afterwards) with a catalogue and one user
+owning --harem distinct characters, then renders --pages page requests per
+mode and reports latency and the peak Python memory of one request:
+
+    memory-cold  HaremView built from the whole harem (a page after any harem change)
+    memory-warm  the cached HaremView (a page click with nothing changed)
+    server       HAREM_PAGINATION=server: MongoDB groups, sorts and pages
+
+Needs a MongoDB server; nothing outside --db is touched.
+
+    python benchmarks/harem_pagination.py [--mongo mongodb://localhost:27017] [--harem 10000]
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+
+# shivu reads these at import time
+os.environ.setdefault('TELEGRAM_BOT_TOKEN', '123:bench')
+os.environ.setdefault('TELEGRAM_API_ID', '1')
+os.environ.setdefault('TELEGRAM_API_HASH', 'bench')
+os.environ.setdefault('MONGODB_URL', 'mongodb://localhost:1')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from motor.motor_asyncio import AsyncIOMotorClient  # noqa: E402
+
+from shivu import catalogue, harem_store, harem_views, spawn_pool, users  # noqa: E402
+from shivu.harem_views import harem_views as views, server_page  # noqa: E402
+from shivu.modules.harem import render_harem_page  # noqa: E402
+
+USER_ID = 1
+RARITIES = ['Common', 'Uncommon', 'Rare', 'Epic', 'Legendary', 'Mythic', 'Retro', 'Zenith', 'Limited Edition']
+SORTS = [None, 'rarity', 'name', 'limited_time']
+
+
+def use_database(db):
+    """Point every module on the harem path at the scratch database"""
+    for module in (catalogue, harem_views, spawn_pool):
+        module.collection = db['characters']
+    for module in (harem_store, harem_views, users):
+        module.user_collection = db['users']
+    spawn_pool.locked_spawns_collection = db['locked_spawns']
+
+
+async def seed(db, catalogue_size, harem_size):
+    characters = [{
+        'id': str(i),
+        'name': f'Character {random.randrange(10 ** 6)}',
+        'anime': f'Anime {i % 400}',
+        'rarity': random.choice(RARITIES),
+        'img_url': f'https://example.com/{i}.jpg',
+    } for i in range(catalogue_size)]
+    await db['characters'].insert_many(characters)
+    await db['characters'].create_index('id', unique=True)
+
+    owned = random.sample(range(catalogue_size), harem_size)
+    await db['users'].insert_one({
+        'id': USER_ID,
+        'first_name': 'Bench',
+        harem_store.COUNTS_FIELD: {str(i): random.randint(1, 3) for i in owned},
+        'favorites': [str(owned[0])],
+    })
+    await db['users'].create_index('id', unique=True)
+
+
+async def measure(name, request, pages, total_pages):
+    latencies = []
+    peaks = []
+    for _ in range(pages):
+        page = random.randrange(max(total_pages, 1))
+        tracemalloc.start()
+        start = time.perf_counter()
+        view = await request(page)
+        view.rendered(page, render_harem_page)
+        latencies.append(time.perf_counter() - start)
+        peaks.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+
+    latencies.sort()
+    pct = lambda p: latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000
+    print(f"{name:<12} p50={pct(0.50):8.2f}ms  p95={pct(0.95):8.2f}ms  "
+          f"mean={statistics.fmean(latencies) * 1000:8.2f}ms  "
+          f"peak mem/request={statistics.median(peaks) / 1024:9.1f} KiB")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--mongo', default='mongodb://localhost:27017', help='MongoDB URL')
+    parser.add_argument('--db', default='harem_pagination_bench', help='scratch database (dropped)')
+    parser.add_argument('--catalogue', type=int, default=12000, help='catalogue size')
+    parser.add_argument('--harem', type=int, default=10000, help='distinct characters owned')
+    parser.add_argument('--pages', type=int, default=50, help='page requests per mode')
+    args = parser.parse_args()
+
+    client = AsyncIOMotorClient(args.mongo)
+    await client.drop_database(args.db)
+    db = client[args.db]
+    try:
+        use_database(db)
+        await seed(db, args.catalogue, args.harem)
+        await spawn_pool.spawn_pool.load()
+        print(f"catalogue {args.catalogue}, harem {args.harem} distinct characters, {args.pages} pages per mode\n")
+
+        for sort in SORTS:
+            await db['users'].update_one({'id': USER_ID}, {'$set': {'sort_preference': sort}})
+            views.invalidate(USER_ID)
+            total_pages = (await views.get(USER_ID)).total_pages
+            print(f"sort: {sort or 'anime (default)'}")
+
+            async def cold(page):
+                views.invalidate(USER_ID)
+                return await views.get(USER_ID)
+
+            async def warm(page):
+                return await views.get(USER_ID)
+
+            async def server(page):
+                return await server_page(USER_ID, page)
+
+            await measure('memory-cold', cold, args.pages, total_pages)
+            await measure('memory-warm', warm, args.pages, total_pages)
+            await measure('server', server, args.pages, total_pages)
+            print()
+    finally:
+        await client.drop_database(args.db)
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,111 @@
+"""Drive a million synthetic messages through the old and the ring-buffer spam detector.
+
+The old detector appended a timestamp and rebuilt the user's list on every
+message; the ring buffer does one lookup and one store. Both see the same
+message stream (a mix of normal chatter and bursty spammers) and the script
+checks they block the same messages.
+
+    python benchmarks/spam_detector.py [--messages 1000000] [--users 5000] [--limit 7 --window 10]
+
+The old cost grows with how many messages a user has inside the window, so
+try a looser policy (e.g. --limit 30 --window 60) to see the difference widen.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+# shivu reads these at import time; nothing here connects anywhere
+os.environ.setdefault('TELEGRAM_BOT_TOKEN', '123:bench')
+os.environ.setdefault('TELEGRAM_API_ID', '1')
+os.environ.setdefault('TELEGRAM_API_HASH', 'bench')
+os.environ.setdefault('MONGODB_URL', 'mongodb://localhost:1')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from shivu.chat_state import ChatStateStore  # noqa: E402
+from shivu.spam_guard import SpamPolicy, SPAM_MESSAGE_LIMIT, SPAM_TIME_WINDOW, record_message  # noqa: E402
+
+
+def legacy_detector(policy):
+    """The previous list-rebuilding implementation"""
+    user_message_times = {}
+    blocked_users = {}
+
+    def detect_spam(user_id, current_time):
+        if user_id not in user_message_times:
+            user_message_times[user_id] = []
+        user_message_times[user_id].append(current_time)
+        user_message_times[user_id] = [
+            msg_time for msg_time in user_message_times[user_id]
+            if current_time - msg_time <= policy.window
+        ]
+        if len(user_message_times[user_id]) > policy.limit:
+            blocked_users[user_id] = current_time + policy.block_duration
+            user_message_times[user_id] = []
+            return True
+        return False
+
+    return detect_spam, user_message_times
+
+
+def ring_detector(policy):
+    store = ChatStateStore(max_users=10 ** 9)
+
+    def detect_spam(user_id, current_time):
+        return record_message(store.user(user_id), current_time, policy)
+
+    return detect_spam, store
+
+
+def synthetic_stream(messages, users, rate=1000, seed=1):
+    """(user_id, timestamp) pairs at `rate` msg/s; ~5% of users are spammers sending bursts"""
+    rng = random.Random(seed)
+    spammers = list(rng.sample(range(users), max(1, users // 20)))
+    now = 0.0
+    stream = []
+    while len(stream) < messages:
+        now += rng.expovariate(rate)
+        if rng.random() < 0.02:
+            # a burst of 5-15 messages, a few hundred ms apart
+            user_id = rng.choice(spammers)
+            for _ in range(rng.randint(5, 15)):
+                stream.append((user_id, now))
+                now += rng.random() * 0.4
+        else:
+            stream.append((rng.randrange(users), now))
+    return stream[:messages]
+
+
+def run(name, detect_spam, stream):
+    start = time.perf_counter()
+    decisions = [detect_spam(user_id, ts) for user_id, ts in stream]
+    elapsed = time.perf_counter() - start
+    print(f"{name:<8} {elapsed:7.3f}s  {elapsed / len(stream) * 1e9:7.1f} ns/msg  blocks={sum(decisions)}")
+    return decisions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--messages', type=int, default=1_000_000)
+    parser.add_argument('--users', type=int, default=5000)
+    parser.add_argument('--limit', type=int, default=SPAM_MESSAGE_LIMIT)
+    parser.add_argument('--window', type=float, default=SPAM_TIME_WINDOW)
+    args = parser.parse_args()
+
+    policy = SpamPolicy(args.limit, args.window)
+    print(f"{args.messages} messages, {args.users} users, policy {policy}\n")
+    stream = synthetic_stream(args.messages, args.users)
+
+    legacy, _ = legacy_detector(policy)
+    ring, store = ring_detector(policy)
+    before = run('before', legacy, stream)
+    after = run('after', ring, stream)
+
+    mismatches = sum(1 for a, b in zip(before, after) if a != b)
+    print(f"\ndecision mismatches: {mismatches}")
+    print(f"ring state: {store.stats()['users']} users, ~{store.stats()['approx_bytes'] / 1024:.0f} KiB")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+"""Queueing latency of message_counter under a 1,000 msg/s burst in one chat.
+
+Compares the old pipeline (spawn awaited while holding the chat lock) with the
+current one (synchronous count + detached spawn task). The spawn itself is
+simulated with a sleep standing in for the Bot API media upload, so no Mongo
+or Telegram connection is needed.
+
+    python benchmarks/spawn_pipeline_latency.py [--rate 1000] [--seconds 5] [--upload 2.0]
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+from types import SimpleNamespace
+
+# shivu reads these at import time; nothing here connects anywhere
+os.environ.setdefault('TELEGRAM_BOT_TOKEN', '123:bench')
+os.environ.setdefault('TELEGRAM_API_ID', '1')
+os.environ.setdefault('TELEGRAM_API_HASH', 'bench')
+os.environ.setdefault('MONGODB_URL', 'mongodb://localhost:1')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import shivu.__main__ as bot  # noqa: E402
+from shivu.chat_settings import chat_settings  # noqa: E402
+from shivu.spawn_counters import spawn_counters  # noqa: E402
+
+CHAT_ID = -100123
+
+
+def fake_update(user_id):
+    async def reply_text(*args, **kwargs):
+        pass
+    return SimpleNamespace(
+        effective_chat=SimpleNamespace(id=CHAT_ID),
+        effective_user=SimpleNamespace(id=user_id),
+        message=SimpleNamespace(reply_text=reply_text),
+    )
+
+
+def make_spawn(upload_seconds, fired):
+    async def spawn(update, context):
+        fired.append(time.perf_counter())
+        await asyncio.sleep(upload_seconds)
+    return spawn
+
+
+async def legacy_message_counter(update, context, state, frequency, spawn):
+    """The previous shape: spawn awaited inside the per-chat lock"""
+    chat_id = update.effective_chat.id
+    lock = state['locks'].setdefault(chat_id, asyncio.Lock())
+    async with lock:
+        await asyncio.sleep(0)  # the per-message settings read
+        state['count'] += 1
+        if state['count'] % frequency == 0:
+            await spawn(update, context)
+            state['count'] = 0
+
+
+async def drive(handler, rate, seconds):
+    """Fire `rate` messages per second as independent tasks (PTB block=False)"""
+    total = int(rate * seconds)
+    latencies = []
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+
+    async def one(i, due):
+        await handler(fake_update(1000 + i % 200), None)
+        latencies.append(loop.time() - due)
+
+    tasks = []
+    for i in range(total):
+        due = start + i / rate
+        delay = due - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(one(i, due)))
+    await asyncio.gather(*tasks)
+    return latencies
+
+
+def report(name, latencies, fired):
+    latencies = sorted(latencies)
+    pct = lambda p: latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000
+    print(f"{name:<8} n={len(latencies):<6} spawns={len(fired):<4} "
+          f"p50={pct(0.50):9.2f}ms  p99={pct(0.99):9.2f}ms  "
+          f"max={latencies[-1] * 1000:9.2f}ms  mean={statistics.fmean(latencies) * 1000:9.2f}ms")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rate', type=int, default=1000, help='messages per second')
+    parser.add_argument('--seconds', type=float, default=5.0, help='burst length')
+    parser.add_argument('--upload', type=float, default=2.0, help='simulated media upload time (s)')
+    parser.add_argument('--frequency', type=int, default=100, help='messages per spawn')
+    args = parser.parse_args()
+
+    # Keep the real handler off the network and out of the spam filter
+    bot.detect_spam = lambda user_id, policy=None: False
+    chat_settings.loaded = True
+    chat_settings.frequencies[CHAT_ID] = args.frequency
+    spawn_counters._counts[CHAT_ID] = {'normal': 0, 'star': 0, 'zenith_event': 0}
+
+    print(f"{args.rate} msg/s for {args.seconds}s, spawn every {args.frequency}, upload {args.upload}s\n")
+
+    fired = []
+    spawn = make_spawn(args.upload, fired)
+    state = {'locks': {}, 'count': 0}
+    latencies = await drive(
+        lambda u, c: legacy_message_counter(u, c, state, args.frequency, spawn),
+        args.rate, args.seconds)
+    report('before', latencies, fired)
+
+    fired = []
+    bot.send_image = make_spawn(args.upload, fired)
+    latencies = await drive(bot.message_counter, args.rate, args.seconds)
+    # Let detached spawns finish before the loop closes
+    while bot.spawns_in_flight:
+        await asyncio.sleep(0.05)
+    report('after', latencies, fired)
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
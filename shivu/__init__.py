@@ -34,6 +34,9 @@ BOT_USERNAME = Config.BOT_USERNAME
 sudo_users = Config.sudo_users
 uploading_users = Config.uploading_users
 OWNER_ID = Config.OWNER_ID 
+HAREM_PAGINATION = Config.HAREM_PAGINATION
+WARM_MEMBERSHIP = Config.WARM_MEMBERSHIP
+STRICT_QUERY_PLANS = Config.STRICT_QUERY_PLANS
 
 # Validate required environment variables
 if not TOKEN:
@@ -44,6 +47,8 @@ if not mongo_url:
     raise ValueError("MONGODB_URL is required but not provided")
 if api_id == 0:
     raise ValueError("TELEGRAM_API_ID is required but not provided")
+if HAREM_PAGINATION not in ("memory", "server"):
+    raise ValueError("HAREM_PAGINATION must be 'memory' or 'server'")
 
 # Clean and validate MongoDB URL
 mongo_url = mongo_url.strip()
@@ -65,6 +70,11 @@ pm_users = db['total_pm_users']
 locked_spawns_collection = db['locked_spawns']
 banned_users_collection = db['banned_users']
 event_settings_collection = db['event_settings']
+spawn_counters_collection = db['spawn_counters']
+migration_state_collection = db['migration_state']
+character_owners_collection = db['character_owners']
+character_stats_collection = db['character_stats']
+propagation_jobs_collection = db['propagation_jobs']
 
 # Helper function to handle JFIF and other image formats
 async def process_image_url(url):
@@ -1,102 +1,39 @@
 import importlib
-import random
 import asyncio
-import time
 import os
+import signal
 from aiohttp import web
 
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import CommandHandler, CallbackContext, MessageHandler, filters
 from html import escape
 
-from shivu import collection, top_global_groups_collection, group_user_totals_collection, user_collection, user_totals_collection, locked_spawns_collection, shivuu, banned_users_collection, event_settings_collection
-from shivu import application, SUPPORT_CHAT, UPDATE_CHAT, db, LOGGER, OWNER_ID, sudo_users
-from datetime import datetime, timezone
+from shivu import shivuu
+from shivu import application, SUPPORT_CHAT, UPDATE_CHAT, db, LOGGER, OWNER_ID, sudo_users, WARM_MEMBERSHIP, STRICT_QUERY_PLANS
+from shivu.spawn_pool import spawn_pool, weight_profile_for
+from shivu.chat_settings import chat_settings
+from shivu.spawn_counters import spawn_counters
+from shivu.chat_state import chat_state, CLAIM_WON, CLAIM_TAKEN
+from shivu.spam_guard import detect_spam, is_user_blocked, blocked_for, unblock
+from shivu.claims import record_claim, LIMIT_REACHED, DAILY_MARRIAGE_LIMIT
+from shivu.leaderboard_buffer import leaderboard_buffer
+from shivu.ban_registry import ban_registry
+from shivu import media, migrations
+from shivu.membership import main_group_members
+from shivu.catalogue import catalogue
+from shivu.url_validator import url_validator
+from shivu.propagation import propagation
+from shivu.owner_index import owner_index
+from shivu import schema
 from shivu.modules import ALL_MODULES
 
 
-locks = {}
-last_characters = {}
-sent_characters = {}
-first_correct_guesses = {}
-message_counts = {}
-retro_message_counts = {}  # Track messages for Retro spawns (every 4k messages)
-star_message_counts = {}  # Track messages for Star spawns (every 350 messages)
-zenith_event_message_counts = {}  # Track messages for Zenith spawns during Christmas event (every 3015 messages)
-manually_summoned = {}  # Track manually summoned characters to allow multiple marriages
-
-# Spam detection system
-user_message_times = {}  # Track message timestamps per user {user_id: [timestamp1, timestamp2, ...]}
-blocked_users = {}  # Track blocked users {user_id: block_end_time}
-SPAM_MESSAGE_LIMIT = 7  # Max messages allowed
-SPAM_TIME_WINDOW = 10  # Time window in seconds to check for spam
-BLOCK_DURATION = 720  # Block duration in seconds (12 minutes)
-
+spawns_in_flight = {}  # (chat_id, kind) -> running spawn task
 
 for module_name in ALL_MODULES:
     imported_module = importlib.import_module("shivu.modules." + module_name)
 
 
-def is_user_blocked(user_id: int) -> bool:
-    """Check if user is currently blocked"""
-    current_time = time.time()
-    if user_id in blocked_users:
-        if current_time < blocked_users[user_id]:
-            return True
-        else:
-            # Block expired, remove from blocked list
-            del blocked_users[user_id]
-    return False
-
-
-def detect_spam(user_id: int) -> bool:
-    """Detect if user is sending messages too quickly"""
-    current_time = time.time()
-    
-    # Initialize user message times if not exists
-    if user_id not in user_message_times:
-        user_message_times[user_id] = []
-    
-    # Add current message time
-    user_message_times[user_id].append(current_time)
-    
-    # Remove old messages outside the time window
-    user_message_times[user_id] = [
-        msg_time for msg_time in user_message_times[user_id] 
-        if current_time - msg_time <= SPAM_TIME_WINDOW
-    ]
-    
-    # Check if user exceeded message limit
-    if len(user_message_times[user_id]) > SPAM_MESSAGE_LIMIT:
-        # Block the user
-        blocked_users[user_id] = current_time + BLOCK_DURATION
-        user_message_times[user_id] = []  # Clear message history
-        LOGGER.warning(f"User {user_id} blocked for spam (sent {len(user_message_times[user_id])} messages in {SPAM_TIME_WINDOW}s)")
-        return True
-    
-    return False
-
-def is_video_url(url):
-    """Check if a URL points to a video file"""
-    if not url:
-        return False
-    return any(ext in url.lower() for ext in ['.mp4', '.mov', '.avi', '.mkv', '.webm', '.flv'])
-
-def is_video_character(character):
-    """Check if a character is a video by URL extension or name marker"""
-    if not character:
-        return False
-    
-    url = character.get('img_url', '')
-    if is_video_url(url):
-        return True
-    
-    name = character.get('name', '')
-    if '🎬' in name:
-        return True
-    
-    return False
-
 async def message_counter(update: Update, context: CallbackContext) -> None:
     chat_id = update.effective_chat.id
     user_id = update.effective_user.id if update.effective_user else None
@@ -105,15 +42,18 @@ async def message_counter(update: Update, context: CallbackContext) -> None:
     if user_id is None:
         return
     
+    await chat_settings.ensure_loaded()
+
     # Skip spam detection for owner and sudo users
     is_privileged = str(user_id) == str(OWNER_ID) or str(user_id) in sudo_users
     
     # Check for spam and block user if necessary (skip for privileged users)
-    if not is_privileged and detect_spam(user_id):
+    spam_policy = chat_settings.spam_policy(chat_id)
+    if not is_privileged and detect_spam(user_id, spam_policy):
         await update.message.reply_text(
             "<tg-emoji emoji-id='5102920111178647010'>⚠️</tg-emoji> <b>Spam Detected!</b> <tg-emoji emoji-id='5102920111178647010'>⚠️</tg-emoji>\n\n"
             "You've been temporarily blocked for sending too many messages quickly.\n"
-            "<tg-emoji emoji-id='5102920111178647010'>🚫</tg-emoji> <b>Block Duration:</b> 12 minutes\n\n"
+            f"<tg-emoji emoji-id='5102920111178647010'>🚫</tg-emoji> <b>Block Duration:</b> {round(spam_policy.block_duration / 60)} minutes\n\n"
             "During this time, you cannot:\n"
             "• Claim characters (/marry)\n"
             "• Contribute to character spawns\n\n"
@@ -126,165 +66,76 @@ async def message_counter(update: Update, context: CallbackContext) -> None:
     if not is_privileged and is_user_blocked(user_id):
         return
 
-    if chat_id not in locks:
-        locks[chat_id] = asyncio.Lock()
-    lock = locks[chat_id]
+    await spawn_counters.ensure_chat(chat_id)
 
-    async with lock:
-        
-        chat_frequency = await user_totals_collection.find_one({'chat_id': str(chat_id)})
-        if chat_frequency:
-            message_frequency = chat_frequency.get('message_frequency', 100)
-        else:
-            message_frequency = 100
+    # Counting and the spawn decision never await, so concurrent messages of a
+    # chat can't interleave here and no per-chat lock is needed
+    message_frequency = chat_settings.frequency(chat_id)
+
+    if spawn_counters.increment(chat_id, 'normal') % message_frequency == 0:
+        spawn_counters.reset(chat_id, 'normal')
+        dispatch_spawn(chat_id, 'normal', send_image, update, context)
+    
+    # Check for Star spawn (every 350 messages in specific chat only)
+    if chat_id == -1002961536913:
+        if spawn_counters.increment(chat_id, 'star') % 350 == 0:
+            spawn_counters.reset(chat_id, 'star')
+            dispatch_spawn(chat_id, 'star', send_star_character, update, context)
+    
+    # Check for Zenith spawn during Christmas event (every 3015 messages)
+    if chat_settings.event_type() == 'christmas':
+        if spawn_counters.increment(chat_id, 'zenith_event') % 3015 == 0:
+            spawn_counters.reset(chat_id, 'zenith_event')
+            dispatch_spawn(chat_id, 'zenith_event', send_zenith_event_character, update, context)
+
+
+def dispatch_spawn(chat_id, kind, spawn, update, context) -> bool:
+    """Run a spawn as its own task so the media upload doesn't hold up message counting.
+
+    At most one spawn of each kind runs per chat; a trigger that lands while the
+    previous one is still uploading is dropped.
+    """
+    key = (chat_id, kind)
+    if key in spawns_in_flight:
+        LOGGER.info(f"Skipping {kind} spawn in chat {chat_id}: previous one still in flight")
+        return False
+
+    task = asyncio.create_task(spawn(update, context))
+    spawns_in_flight[key] = task
+
+    def _done(finished):
+        spawns_in_flight.pop(key, None)
+        if not finished.cancelled() and finished.exception() is not None:
+            LOGGER.error(f"{kind} spawn failed in chat {chat_id}", exc_info=finished.exception())
+
+    task.add_done_callback(_done)
+    return True
 
-        
-        if chat_id in message_counts:
-            message_counts[chat_id] += 1
-        else:
-            message_counts[chat_id] = 1
 
-        
-        if message_counts[chat_id] % message_frequency == 0:
-            await send_image(update, context)
-            
-            message_counts[chat_id] = 0
-        
-        # Check for Star spawn (every 350 messages in specific chat only)
-        if chat_id == -1002961536913:
-            if chat_id in star_message_counts:
-                star_message_counts[chat_id] += 1
-            else:
-                star_message_counts[chat_id] = 1
-                
-            if star_message_counts[chat_id] % 350 == 0:
-                await send_star_character(update, context)
-                star_message_counts[chat_id] = 0
-        
-        # Check for Zenith spawn during Christmas event (every 3015 messages)
-        active_event = await event_settings_collection.find_one({'active': True})
-        if active_event and active_event.get('event_type') == 'christmas':
-            if chat_id in zenith_event_message_counts:
-                zenith_event_message_counts[chat_id] += 1
-            else:
-                zenith_event_message_counts[chat_id] = 1
-            
-            if zenith_event_message_counts[chat_id] % 3015 == 0:
-                await send_zenith_event_character(update, context)
-                zenith_event_message_counts[chat_id] = 0
-            
 async def send_image(update: Update, context: CallbackContext) -> None:
     chat_id = update.effective_chat.id
 
-    # Get locked character IDs
-    locked_character_ids = [doc['character_id'] for doc in await locked_spawns_collection.find().to_list(length=None)]
-    
-    # Check for active event
-    active_event = await event_settings_collection.find_one({'active': True})
-    
-    # Get spawnable characters (exclude Star as it has its own spawn function, and Custom which never spawns)
-    filter_criteria = {
-        'rarity': {'$nin': ['Star', 'Custom']},
-        'id': {'$nin': locked_character_ids}
-    }
-    
+    await spawn_pool.ensure_loaded()
+
     # If Christmas event is active, only spawn characters with 🎄 in name
-    if active_event and active_event.get('event_type') == 'christmas':
-        filter_criteria['name'] = {'$regex': '🎄'}
+    event = 'christmas' if chat_settings.event_type() == 'christmas' else None
     
-    all_characters = list(await collection.find(filter_criteria).to_list(length=None))
+    # Track sent characters to avoid immediate repeats
+    chat = chat_state.chat(chat_id)
+
+    # Weighted rarity (alias table) then a character of that rarity, skipping recent ones
+    character = spawn_pool.pick(weight_profile_for(chat_id), event, set(chat.recent))
     
     # Check if there are any spawnable characters
-    if not all_characters:
+    if not character:
         LOGGER.warning("No spawnable characters available")
         return
     
-    # Define rarity weights for weighted random selection
-    # Higher weight = more likely to spawn
-    # Check if we're in main GC for boosted Retro/Zenith rates
-    if chat_id == -1002961536913:
-        # Main GC: Significantly higher Retro and Zenith rates
-        rarity_weights = {
-            "Common": 100,
-            "Uncommon": 80,
-            "Rare": 50,
-            "Epic": 30,
-            "Legendary": 10,
-            "Mythic": 5,
-            "Retro": 20,
-            "Zenith": 10,
-            "Limited Edition": 0.25,
-            "Custom": 0
-        }
-    else:
-        # Other chats: Normal rates
-        rarity_weights = {
-            "Common": 100,
-            "Uncommon": 80,
-            "Rare": 50,
-            "Epic": 30,
-            "Legendary": 10,
-            "Mythic": 5,
-            "Retro": 5,
-            "Zenith": 1,
-            "Limited Edition": 0.25,
-            "Custom": 0
-        }
-    
-    # Group characters by rarity
-    characters_by_rarity = {}
-    for char in all_characters:
-        rarity = char.get('rarity', 'Common')
-        if rarity not in characters_by_rarity:
-            characters_by_rarity[rarity] = []
-        characters_by_rarity[rarity].append(char)
-    
-    # Filter out rarities with no characters or zero weight
-    available_rarities = []
-    available_weights = []
-    for rarity, chars in characters_by_rarity.items():
-        weight = rarity_weights.get(rarity, 0)
-        if chars and weight > 0:
-            available_rarities.append(rarity)
-            available_weights.append(weight)
-    
-    if not available_rarities:
-        LOGGER.warning("No spawnable rarities available with valid weights")
-        return
-    
-    # Use weighted random selection to choose a rarity first
-    selected_rarity = random.choices(available_rarities, weights=available_weights, k=1)[0]
-    
-    # Get characters of the selected rarity
-    rarity_characters = characters_by_rarity[selected_rarity]
-    
-    # Track sent characters to avoid immediate repeats
-    if chat_id not in sent_characters:
-        sent_characters[chat_id] = []
+    # Keep track of sent characters (the deque keeps only the last 50)
+    chat.recent.append(character['id'])
 
-    # Filter out recently sent characters from this rarity
-    available_characters = [c for c in rarity_characters if c['id'] not in sent_characters[chat_id]]
-    
-    if not available_characters:
-        # If all characters of this rarity have been sent, reset and use all
-        available_characters = rarity_characters
-    
-    # Randomly select a character from the chosen rarity
-    character = random.choice(available_characters)
-    
-    # Keep track of sent characters (limit to last 50 to prevent memory issues)
-    sent_characters[chat_id].append(character['id'])
-    if len(sent_characters[chat_id]) > 50:
-        sent_characters[chat_id] = sent_characters[chat_id][-50:]
-
-    last_characters[chat_id] = character
-
-    if chat_id in first_correct_guesses:
-        del first_correct_guesses[chat_id]
-    
-    # Clear manually summoned flag for automatic spawns
-    if chat_id in manually_summoned:
-        del manually_summoned[chat_id]
+    # Automatic spawn: clears the previous winner and the manual-summon flag
+    chat.spawn(character)
 
     # Rarity emoji mapping
     rarity_emojis = {
@@ -308,13 +159,16 @@ async def send_image(update: Update, context: CallbackContext) -> None:
         
         caption_text = f"""{rarity_emoji} A beauty has been summoned! Use /marry to add them to your harem!"""
         
-        if is_video_character(character):
+        if media.is_video(character):
             try:
-                await context.bot.send_video(
-                    chat_id=chat_id,
-                    video=processed_url,
-                    caption=caption_text,
-                    parse_mode='HTML')
+                await catalogue.send_media(
+                    character,
+                    lambda file: context.bot.send_video(
+                        chat_id=chat_id,
+                        video=file,
+                        caption=caption_text,
+                        parse_mode='HTML'),
+                    processed_url)
             except Exception as video_error:
                 LOGGER.warning(f"Failed to send as video, trying as photo: {str(video_error)}")
                 await context.bot.send_photo(
@@ -323,11 +177,14 @@ async def send_image(update: Update, context: CallbackContext) -> None:
                     caption=f"<tg-emoji emoji-id='5103000796434270751'>🎬</tg-emoji> {caption_text}",
                     parse_mode='HTML')
         else:
-            await context.bot.send_photo(
-                chat_id=chat_id,
-                photo=processed_url,
-                caption=caption_text,
-                parse_mode='HTML')
+            await catalogue.send_media(
+                character,
+                lambda file: context.bot.send_photo(
+                    chat_id=chat_id,
+                    photo=file,
+                    caption=caption_text,
+                    parse_mode='HTML'),
+                processed_url)
     except Exception as e:
         LOGGER.error(f"Error sending character image: {str(e)}")
         await context.bot.send_message(
@@ -340,55 +197,30 @@ async def send_star_character(update: Update, context: CallbackContext) -> None:
     """Send a Star character every 200 messages in the main GC"""
     chat_id = update.effective_chat.id
     
-    # Check for active event
-    active_event = await event_settings_collection.find_one({'active': True})
-    
-    # Build filter criteria for Star characters
-    star_filter = {'rarity': 'Star'}
-    
+    await spawn_pool.ensure_loaded()
+
     # If Christmas event is active, only spawn Star characters with 🎄 in name
-    if active_event and active_event.get('event_type') == 'christmas':
-        star_filter['name'] = {'$regex': '🎄'}
+    event = 'christmas' if chat_settings.event_type() == 'christmas' else None
     
-    # Get Star characters (respecting event filter)
-    star_characters = list(await collection.find(star_filter).to_list(length=None))
+    # Unlocked Star characters (respecting event filter)
+    star_count = spawn_pool.count('Star', event)
     
-    if not star_characters:
-        LOGGER.warning("No Star characters available to spawn (event filter may be active)")
-        return
-    
-    # Filter out locked characters
-    locked_character_ids = await locked_spawns_collection.distinct('character_id')
-    star_characters = [char for char in star_characters if char['id'] not in locked_character_ids]
-    
-    if not star_characters:
-        LOGGER.info("No unlocked Star characters available to spawn")
+    if not star_count:
+        LOGGER.warning("No unlocked Star characters available to spawn (event filter may be active)")
         return
     
     # Track sent Star characters separately to avoid repeats
-    star_sent_key = f"{chat_id}_star"
-    
-    if star_sent_key not in sent_characters:
-        sent_characters[star_sent_key] = []
+    chat = chat_state.chat(chat_id)
+    star_sent = chat.recent_special('star')
 
-    if len(sent_characters[star_sent_key]) == len(star_characters):
-        sent_characters[star_sent_key] = []
+    if len(star_sent) >= star_count:
+        star_sent.clear()
 
-    available_star = [c for c in star_characters if c['id'] not in sent_characters[star_sent_key]]
-    if not available_star:
-        available_star = star_characters
-        sent_characters[star_sent_key] = []
-    
-    character = random.choice(available_star)
-    sent_characters[star_sent_key].append(character['id'])
-    last_characters[chat_id] = character
+    character = spawn_pool.pick_from('Star', event, star_sent)
+    star_sent.add(character['id'])
 
-    if chat_id in first_correct_guesses:
-        del first_correct_guesses[chat_id]
-    
-    # Clear manually summoned flag for automatic spawns
-    if chat_id in manually_summoned:
-        del manually_summoned[chat_id]
+    # Automatic spawn: clears the previous winner and the manual-summon flag
+    chat.spawn(character)
 
     try:
         from shivu import process_image_url
@@ -396,13 +228,16 @@ async def send_star_character(update: Update, context: CallbackContext) -> None:
         
         caption_text = f"<tg-emoji emoji-id='5102825501639050967'>⭐</tg-emoji> A shining STAR beauty has appeared! Use /marry to add them to your harem!"
         
-        if is_video_character(character):
+        if media.is_video(character):
             try:
-                await context.bot.send_video(
-                    chat_id=chat_id,
-                    video=processed_url,
-                    caption=caption_text,
-                    parse_mode='HTML')
+                await catalogue.send_media(
+                    character,
+                    lambda file: context.bot.send_video(
+                        chat_id=chat_id,
+                        video=file,
+                        caption=caption_text,
+                        parse_mode='HTML'),
+                    processed_url)
             except Exception as video_error:
                 LOGGER.warning(f"Failed to send star video, trying as photo: {str(video_error)}")
                 await context.bot.send_photo(
@@ -411,11 +246,14 @@ async def send_star_character(update: Update, context: CallbackContext) -> None:
                     caption=f"<tg-emoji emoji-id='5103000796434270751'>🎬</tg-emoji> {caption_text}",
                     parse_mode='HTML')
         else:
-            await context.bot.send_photo(
-                chat_id=chat_id,
-                photo=processed_url,
-                caption=caption_text,
-                parse_mode='HTML')
+            await catalogue.send_media(
+                character,
+                lambda file: context.bot.send_photo(
+                    chat_id=chat_id,
+                    photo=file,
+                    caption=caption_text,
+                    parse_mode='HTML'),
+                processed_url)
     except Exception as e:
         LOGGER.error(f"Error sending star character image: {str(e)}")
         await context.bot.send_message(
@@ -428,50 +266,27 @@ async def send_zenith_event_character(update: Update, context: CallbackContext)
     """Send a Zenith character with <tg-emoji emoji-id="5103065598900831870">🎄</tg-emoji> every 3015 messages during Christmas event"""
     chat_id = update.effective_chat.id
     
-    # Get Zenith characters with 🎄 in name for Christmas event
-    zenith_filter = {
-        'rarity': 'Zenith',
-        'name': {'$regex': '🎄'}
-    }
-    
-    zenith_characters = list(await collection.find(zenith_filter).to_list(length=None))
-    
-    if not zenith_characters:
-        LOGGER.warning("No Zenith Christmas characters available to spawn")
-        return
-    
-    # Filter out locked characters
-    locked_character_ids = await locked_spawns_collection.distinct('character_id')
-    zenith_characters = [char for char in zenith_characters if char['id'] not in locked_character_ids]
+    await spawn_pool.ensure_loaded()
+
+    # Unlocked Zenith characters with 🎄 in name for Christmas event
+    zenith_count = spawn_pool.count('Zenith', 'christmas')
     
-    if not zenith_characters:
-        LOGGER.info("No unlocked Zenith Christmas characters available to spawn")
+    if not zenith_count:
+        LOGGER.warning("No unlocked Zenith Christmas characters available to spawn")
         return
     
     # Track sent Zenith event characters separately to avoid repeats
-    zenith_sent_key = f"{chat_id}_zenith_event"
-    
-    if zenith_sent_key not in sent_characters:
-        sent_characters[zenith_sent_key] = []
+    chat = chat_state.chat(chat_id)
+    zenith_sent = chat.recent_special('zenith_event')
 
-    if len(sent_characters[zenith_sent_key]) == len(zenith_characters):
-        sent_characters[zenith_sent_key] = []
+    if len(zenith_sent) >= zenith_count:
+        zenith_sent.clear()
 
-    available_zenith = [c for c in zenith_characters if c['id'] not in sent_characters[zenith_sent_key]]
-    if not available_zenith:
-        available_zenith = zenith_characters
-        sent_characters[zenith_sent_key] = []
-    
-    character = random.choice(available_zenith)
-    sent_characters[zenith_sent_key].append(character['id'])
-    last_characters[chat_id] = character
+    character = spawn_pool.pick_from('Zenith', 'christmas', zenith_sent)
+    zenith_sent.add(character['id'])
 
-    if chat_id in first_correct_guesses:
-        del first_correct_guesses[chat_id]
-    
-    # Clear manually summoned flag for automatic spawns
-    if chat_id in manually_summoned:
-        del manually_summoned[chat_id]
+    # Automatic spawn: clears the previous winner and the manual-summon flag
+    chat.spawn(character)
 
     try:
         from shivu import process_image_url
@@ -479,13 +294,16 @@ async def send_zenith_event_character(update: Update, context: CallbackContext)
         
         caption_text = f"<tg-emoji emoji-id='5103065238123578838'>🪩</tg-emoji><tg-emoji emoji-id='5103065598900831870'>🎄</tg-emoji> A rare ZENITH Christmas beauty has appeared! Use /marry to add them to your harem!"
         
-        if is_video_character(character):
+        if media.is_video(character):
             try:
-                await context.bot.send_video(
-                    chat_id=chat_id,
-                    video=processed_url,
-                    caption=caption_text,
-                    parse_mode='HTML')
+                await catalogue.send_media(
+                    character,
+                    lambda file: context.bot.send_video(
+                        chat_id=chat_id,
+                        video=file,
+                        caption=caption_text,
+                        parse_mode='HTML'),
+                    processed_url)
             except Exception as video_error:
                 LOGGER.warning(f"Failed to send zenith video, trying as photo: {str(video_error)}")
                 await context.bot.send_photo(
@@ -494,11 +312,14 @@ async def send_zenith_event_character(update: Update, context: CallbackContext)
                     caption=f"<tg-emoji emoji-id='5103000796434270751'>🎬</tg-emoji> {caption_text}",
                     parse_mode='HTML')
         else:
-            await context.bot.send_photo(
-                chat_id=chat_id,
-                photo=processed_url,
-                caption=caption_text,
-                parse_mode='HTML')
+            await catalogue.send_media(
+                character,
+                lambda file: context.bot.send_photo(
+                    chat_id=chat_id,
+                    photo=file,
+                    caption=caption_text,
+                    parse_mode='HTML'),
+                processed_url)
     except Exception as e:
         LOGGER.error(f"Error sending zenith event character image: {str(e)}")
         await context.bot.send_message(
@@ -516,24 +337,20 @@ async def guess(update: Update, context: CallbackContext) -> None:
     user_id = update.effective_user.id
     
     # Check if user is bonked (banned)
-    ban = await banned_users_collection.find_one({'user_id': user_id})
-    if ban:
-        unban_date = ban.get('unban_date')
-        if datetime.now(timezone.utc) >= unban_date:
-            await banned_users_collection.delete_one({'user_id': user_id})
-        else:
-            remaining = unban_date - datetime.now(timezone.utc)
-            days = remaining.days
-            hours = remaining.seconds // 3600
-            time_str = f"{days} days" if days > 0 else f"{hours} hours"
-            await update.message.reply_text(
-                f"🔨 You've been bonked for spamming too much.. please wait for {time_str}"
-            )
-            return
+    await ban_registry.ensure_loaded()
+    remaining = ban_registry.remaining(user_id)
+    if remaining is not None:
+        days = remaining.days
+        hours = remaining.seconds // 3600
+        time_str = f"{days} days" if days > 0 else f"{hours} hours"
+        await update.message.reply_text(
+            f"🔨 You've been bonked for spamming too much.. please wait for {time_str}"
+        )
+        return
     
     # Check if user is blocked from spam
     if is_user_blocked(user_id):
-        remaining_time = int(blocked_users[user_id] - time.time())
+        remaining_time = int(blocked_for(user_id))
         minutes = remaining_time // 60
         seconds = remaining_time % 60
         await update.message.reply_text(
@@ -545,36 +362,13 @@ async def guess(update: Update, context: CallbackContext) -> None:
         )
         return
 
-    # Check daily marriage limit (30 per day)
-    today = datetime.now(timezone.utc).strftime('%Y-%m-%d')
-    
-    user_data = await user_collection.find_one({'id': user_id})
-    if user_data:
-        daily_marriages = user_data.get('daily_marriages', {})
-        today_count = daily_marriages.get(today, 0)
-        
-        if today_count >= 30:
-            await update.message.reply_text(
-                f"<tg-emoji emoji-id='5102621864354645825'>💒</tg-emoji> <b>Daily Marriage Limit Reached!</b>\n\n"
-                f"<tg-emoji emoji-id='5102962128843704400'>❌</tg-emoji> You've already married <b>{today_count}/30</b> characters today.\n\n"
-                f"⏰ <b>Reset time:</b> Tomorrow at 00:00 UTC\n\n"
-                f"Come back tomorrow to continue building your harem!",
-                parse_mode='HTML'
-            )
-            return
-
-    if chat_id not in last_characters:
+    chat = chat_state.get_chat(chat_id)
+    character = chat.character if chat else None
+    if character is None:
         await update.message.reply_text('<tg-emoji emoji-id="5102920111178647010">🚫</tg-emoji> No character has been summoned yet!\n\nCharacters appear automatically every 100 messages, or admins can use /summon to spawn one manually.',
                 parse_mode='HTML')
         return
 
-    # Only prevent multiple guesses for automatically spawned characters
-    # Allow multiple marriages for manually summoned characters
-    if chat_id in first_correct_guesses and chat_id not in manually_summoned:
-        await update.message.reply_text(f'<tg-emoji emoji-id="5102962128843704400">❌</tg-emoji>️ Already Guessed By Someone.. Try Next Time Bruhh ',
-                parse_mode='HTML')
-        return
-
     guess = ' '.join(context.args).lower() if context.args else ''
     
     if "()" in guess or "&" in guess.lower():
@@ -582,124 +376,38 @@ async def guess(update: Update, context: CallbackContext) -> None:
                 parse_mode='HTML')
         return
 
+    # Decided in memory against name tokens precomputed at spawn; only the winner goes on to the database.
+    # Only prevent multiple guesses for automatically spawned characters,
+    # manually summoned characters can be married multiple times
+    outcome = chat.try_claim(user_id, guess)
+    if outcome == CLAIM_TAKEN:
+        await update.message.reply_text(f'<tg-emoji emoji-id="5102962128843704400">❌</tg-emoji>️ Already Guessed By Someone.. Try Next Time Bruhh ',
+                parse_mode='HTML')
+        return
 
-    name_parts = last_characters[chat_id]['name'].lower().split()
-
-    # Smart matching: exact parts, partial matches, or fuzzy matches
-    def smart_name_match(guess, name_parts):
-        guess = guess.strip()
-        if not guess:
-            return False
-            
-        # 1. Exact full name match (any word order)
-        if sorted(name_parts) == sorted(guess.split()):
-            return True
-            
-        # 2. Exact single part match 
-        if any(part == guess for part in name_parts):
-            return True
-            
-        # 3. Partial match - guess is start of any name part (min 3 chars)
-        if len(guess) >= 3:
-            if any(part.startswith(guess) for part in name_parts):
-                return True
-                
-        # 4. Stricter fuzzy match - only allow if guess is contained in part AND is at least half the length
-        if len(guess) >= 4:
-            for part in name_parts:
-                if guess in part and len(guess) >= len(part) * 0.7:
-                    return True
-                
-        return False
-
-    if smart_name_match(guess, name_parts):
-        # For manually summoned characters, don't prevent multiple marriages
-        if chat_id not in manually_summoned:
-            first_correct_guesses[chat_id] = user_id
-        
-        # Update daily marriage counter
-        today = datetime.now(timezone.utc).strftime('%Y-%m-%d')
-        
-        user = await user_collection.find_one({'id': user_id})
-        if user:
-            update_fields = {}
-            if hasattr(update.effective_user, 'username') and update.effective_user.username != user.get('username'):
-                update_fields['username'] = update.effective_user.username
-            if update.effective_user.first_name != user.get('first_name'):
-                update_fields['first_name'] = update.effective_user.first_name
-            
-            # Ensure characters field exists as a list
-            if 'characters' not in user or user['characters'] is None:
-                update_fields['characters'] = []
-                
-            # Update daily marriage counter
-            daily_marriages = user.get('daily_marriages', {})
-            daily_marriages[today] = daily_marriages.get(today, 0) + 1
-            update_fields[f'daily_marriages.{today}'] = daily_marriages[today]
-                
-            if update_fields:
-                await user_collection.update_one({'id': user_id}, {'$set': update_fields})
-            
-            await user_collection.update_one({'id': user_id}, {'$push': {'characters': last_characters[chat_id]}})
-      
-        elif hasattr(update.effective_user, 'username'):
-            # For new users, also initialize daily marriage counter
-            daily_marriages = {today: 1}
-            await user_collection.insert_one({
-                'id': user_id,
-                'username': update.effective_user.username,
-                'first_name': update.effective_user.first_name,
-                'characters': [last_characters[chat_id]],
-                'daily_marriages': daily_marriages
-            })
-
-        
-        group_user_total = await group_user_totals_collection.find_one({'user_id': user_id, 'group_id': chat_id})
-        if group_user_total:
-            update_fields = {}
-            if hasattr(update.effective_user, 'username') and update.effective_user.username != group_user_total.get('username'):
-                update_fields['username'] = update.effective_user.username
-            if update.effective_user.first_name != group_user_total.get('first_name'):
-                update_fields['first_name'] = update.effective_user.first_name
-            if update_fields:
-                await group_user_totals_collection.update_one({'user_id': user_id, 'group_id': chat_id}, {'$set': update_fields})
-            
-            await group_user_totals_collection.update_one({'user_id': user_id, 'group_id': chat_id}, {'$inc': {'count': 1}})
-      
-        else:
-            await group_user_totals_collection.insert_one({
-                'user_id': user_id,
-                'group_id': chat_id,
-                'username': update.effective_user.username,
-                'first_name': update.effective_user.first_name,
-                'count': 1,
-            })
-
-
-    
-        group_info = await top_global_groups_collection.find_one({'group_id': chat_id})
-        if group_info:
-            update_fields = {}
-            if update.effective_chat.title != group_info.get('group_name'):
-                update_fields['group_name'] = update.effective_chat.title
-            if update_fields:
-                await top_global_groups_collection.update_one({'group_id': chat_id}, {'$set': update_fields})
-            
-            await top_global_groups_collection.update_one({'group_id': chat_id}, {'$inc': {'count': 1}})
-      
-        else:
-            await top_global_groups_collection.insert_one({
-                'group_id': chat_id,
-                'group_name': update.effective_chat.title,
-                'count': 1,
-            })
-
+    if outcome == CLAIM_WON:
+        # Harem and daily counter (limit checked atomically) in one round trip; leaderboards are write-behind
+        try:
+            claim = await record_claim(update.effective_user, update.effective_chat, character)
+        except Exception:
+            chat.release(user_id)
+            raise
+        if claim == LIMIT_REACHED:
+            # Give the spawn back to the rest of the chat
+            chat.release(user_id)
+            await update.message.reply_text(
+                f"<tg-emoji emoji-id='5102621864354645825'>💒</tg-emoji> <b>Daily Marriage Limit Reached!</b>\n\n"
+                f"<tg-emoji emoji-id='5102962128843704400'>❌</tg-emoji> You've already married <b>{DAILY_MARRIAGE_LIMIT}/{DAILY_MARRIAGE_LIMIT}</b> characters today.\n\n"
+                f"⏰ <b>Reset time:</b> Tomorrow at 00:00 UTC\n\n"
+                f"Come back tomorrow to continue building your harem!",
+                parse_mode='HTML'
+            )
+            return
 
-        
         keyboard = [[InlineKeyboardButton(f"See Harem", switch_inline_query_current_chat=f"collection.{user_id}")]]
 
 
-        await update.message.reply_text(f'<b><a href="tg://user?id={user_id}">{escape(update.effective_user.first_name)}</a></b> You Guessed a New Character <tg-emoji emoji-id="5103087490349139576">✅</tg-emoji>️ \n\n𝗡𝗔𝗠𝗘: <b>{last_characters[chat_id]["name"]}</b> \n𝗔𝗡𝗜𝗠𝗘: <b>{last_characters[chat_id]["anime"]}</b> \n𝗥𝗔𝗥𝗜𝗧𝗬: <b>{last_characters[chat_id]["rarity"]}</b>\n\nThis Character added in Your harem.. use /harem To see your harem', parse_mode='HTML', reply_markup=InlineKeyboardMarkup(keyboard))
+        await update.message.reply_text(f'<b><a href="tg://user?id={user_id}">{escape(update.effective_user.first_name)}</a></b> You Guessed a New Character <tg-emoji emoji-id="5103087490349139576">✅</tg-emoji>️ \n\n𝗡𝗔𝗠𝗘: <b>{character["name"]}</b> \n𝗔𝗡𝗜𝗠𝗘: <b>{character["anime"]}</b> \n𝗥𝗔𝗥𝗜𝗧𝗬: <b>{character["rarity"]}</b>\n\nThis Character added in Your harem.. use /harem To see your harem', parse_mode='HTML', reply_markup=InlineKeyboardMarkup(keyboard))
 
     else:
         await update.message.reply_text('Please Write Correct Character Name... <tg-emoji emoji-id="5102962128843704400">❌</tg-emoji>️',
@@ -786,11 +494,8 @@ async def unmute(update: Update, context: CallbackContext) -> None:
         await update.message.reply_text("<tg-emoji emoji-id='5102962128843704400'>❌</tg-emoji> Reply to a user's message or provide their user ID.\n\nUsage: <code>/unmute &lt;user_id&gt;</code>", parse_mode='HTML')
         return
 
-    if target_id in blocked_users:
-        del blocked_users[target_id]
-        # Also clear their message history so they don't get re-blocked immediately
-        if target_id in user_message_times:
-            del user_message_times[target_id]
+    # Also clears their message history so they don't get re-blocked immediately
+    if unblock(target_id):
         await update.message.reply_text(f"<tg-emoji emoji-id='5103087490349139576'>✅</tg-emoji> User <code>{target_id}</code> has been unmuted and can send messages again.", parse_mode='HTML')
     else:
         await update.message.reply_text(f"<tg-emoji emoji-id='5102581715000362771'>ℹ️</tg-emoji> User <code>{target_id}</code> is not currently muted.", parse_mode='HTML')
@@ -808,6 +513,75 @@ async def error_handler(update: object, context: CallbackContext) -> None:
             pass
 
 
+async def warm_up():
+    """Load in-memory state before updates start flowing"""
+    # Indexes first, so the loads below and every hot query can use them
+    try:
+        await schema.ensure_indexes()
+    except Exception as e:
+        LOGGER.error(f"Failed to ensure indexes: {e}")
+
+    # A hot query planned as a COLLSCAN is a regression: the owner hears about
+    # it, and with STRICT_QUERY_PLANS set the bot doesn't start on it
+    scans = await schema.check_query_plans()
+    if scans:
+        report = f"{len(scans)} hot queries scan their collection: {', '.join(scans)}"
+        try:
+            await application.bot.send_message(
+                chat_id=OWNER_ID,
+                text=f"<tg-emoji emoji-id='5102920111178647010'>⚠️</tg-emoji> <b>Query plan check failed</b>\n\n{escape(report)}",
+                parse_mode='HTML')
+        except Exception as e:
+            LOGGER.error(f"Failed to report query plans to the owner: {e}")
+        if STRICT_QUERY_PLANS:
+            raise schema.CollectionScanError(report)
+
+    # Resident spawn pool, so the first spawn doesn't pay for a full catalogue read
+    try:
+        await spawn_pool.load()
+    except Exception as e:
+        LOGGER.error(f"Failed to preload spawn pool: {e}")
+
+    # Spawn frequencies and the running event, read by every group message
+    try:
+        await chat_settings.load()
+    except Exception as e:
+        LOGGER.error(f"Failed to preload chat settings: {e}")
+
+    # Active /bonk bans, checked before every /marry
+    try:
+        await ban_registry.load()
+    except Exception as e:
+        LOGGER.error(f"Failed to preload ban registry: {e}")
+
+    # Pending automatic migrations (embedded harem copies -> id counts), in the
+    # background and resuming from their checkpoints
+    migrations.start_auto()
+
+    # Harem fan-outs of catalogue edits/deletions queued before the last stop
+    propagation.start()
+
+    # /harem membership gate; chat_member updates keep it current afterwards
+    if WARM_MEMBERSHIP:
+        asyncio.create_task(main_group_members.warm())
+
+    spawn_counters.start()
+    chat_state.start()
+    leaderboard_buffer.start()
+    owner_index.start()
+    ban_registry.start()
+
+
+async def shut_down():
+    """Flush write-behind state before the process exits"""
+    await spawn_counters.stop()
+    await leaderboard_buffer.stop()
+    await owner_index.stop()
+    await chat_state.stop()
+    await ban_registry.stop()
+    await url_validator.close()
+
+
 async def run_bot():
     """Run the Telegram bot with webhooks or polling"""
     application.add_handler(CommandHandler(["marry"], guess, block=False))
@@ -818,26 +592,38 @@ async def run_bot():
     
     await application.initialize()
     await application.start()
+    await warm_up()
     
-    webhook_url = os.environ.get('WEBHOOK_URL')
-    # On Replit, always use polling — the Replit dev domain is ephemeral and
-    # WEBHOOK_URL may still point to a previous deployment (e.g. Render).
-    on_replit = bool(os.environ.get('REPLIT_DEV_DOMAIN'))
-    if webhook_url and not on_replit:
-        await application.bot.set_webhook(url=f"{webhook_url}/webhook")
-        LOGGER.info(f"Webhook set to {webhook_url}/webhook")
-        await asyncio.Event().wait()
-    else:
-        LOGGER.info("Using polling mode")
-        await application.bot.delete_webhook()
-        await application.updater.start_polling(drop_pending_updates=True)
-        await asyncio.Event().wait()
+    try:
+        webhook_url = os.environ.get('WEBHOOK_URL')
+        # On Replit, always use polling — the Replit dev domain is ephemeral and
+        # WEBHOOK_URL may still point to a previous deployment (e.g. Render).
+        on_replit = bool(os.environ.get('REPLIT_DEV_DOMAIN'))
+        if webhook_url and not on_replit:
+            # chat_member updates (for the membership cache) are only sent when asked for
+            await application.bot.set_webhook(url=f"{webhook_url}/webhook", allowed_updates=Update.ALL_TYPES)
+            LOGGER.info(f"Webhook set to {webhook_url}/webhook")
+            await asyncio.Event().wait()
+        else:
+            LOGGER.info("Using polling mode")
+            await application.bot.delete_webhook()
+            await application.updater.start_polling(drop_pending_updates=True, allowed_updates=Update.ALL_TYPES)
+            await asyncio.Event().wait()
+    finally:
+        await shut_down()
 
 async def main_async():
     """Run both web server and bot"""
     await shivuu.start()
     LOGGER.info("Pyrogram client started")
     
+    # Hosts stop us with SIGTERM; turn it into a cancellation so run_bot's
+    # shutdown flush still runs
+    try:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+    except NotImplementedError:
+        pass
+    
     await asyncio.gather(
         run_web_server(),
         run_bot()
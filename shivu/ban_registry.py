@@ -0,0 +1,121 @@
+import asyncio
+import heapq
+from datetime import datetime, timezone
+
+from shivu import banned_users_collection, LOGGER
+
+
+SWEEP_INTERVAL = 60  # seconds
+
+
+def _as_utc(value):
+    # Motor hands back naive datetimes unless the client is tz_aware
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value
+
+
+class BanRegistry:
+    """Active /bonk bans held in memory.
+
+    Lookups are a dict check; a min-heap of unban times lets a background
+    sweep expire bans (and delete their documents) as they run out instead of
+    waiting for the banned user to come back.
+    """
+
+    def __init__(self):
+        self._bans = {}  # user_id -> unban datetime (UTC)
+        self._heap = []  # (unban datetime, user_id); may hold stale entries
+        self.loaded = False
+        self._load_lock = asyncio.Lock()
+        self._task = None
+
+    async def load(self):
+        async with self._load_lock:
+            bans = {}
+            cursor = banned_users_collection.find({}, {'_id': 0, 'user_id': 1, 'unban_date': 1})
+            async for doc in cursor:
+                if doc.get('unban_date') is None:
+                    continue
+                unban_date = _as_utc(doc['unban_date'])
+                # A user can have an old, expired ban document next to a newer one
+                current = bans.get(doc['user_id'])
+                if current is None or unban_date > current:
+                    bans[doc['user_id']] = unban_date
+
+            self._bans = bans
+            self._heap = [(unban_date, user_id) for user_id, unban_date in bans.items()]
+            heapq.heapify(self._heap)
+            self.loaded = True
+            LOGGER.info(f"Ban registry loaded: {len(bans)} bans")
+        # Bans that ran out while we were down, including stale duplicates
+        await self.sweep()
+        try:
+            await banned_users_collection.delete_many({'unban_date': {'$lte': datetime.now(timezone.utc)}})
+        except Exception as e:
+            LOGGER.error(f"Failed to delete expired bans: {e}")
+
+    async def ensure_loaded(self):
+        if not self.loaded:
+            await self.load()
+
+    def ban(self, user_id, unban_date):
+        unban_date = _as_utc(unban_date)
+        self._bans[user_id] = unban_date
+        heapq.heappush(self._heap, (unban_date, user_id))
+
+    def unban(self, user_id):
+        # The heap entry goes stale and is skipped by the sweep
+        self._bans.pop(user_id, None)
+
+    def unban_date(self, user_id):
+        """When the user's ban ends, or None if they aren't banned"""
+        unban_date = self._bans.get(user_id)
+        if unban_date is None or unban_date <= datetime.now(timezone.utc):
+            return None
+        return unban_date
+
+    def remaining(self, user_id):
+        """Time left on the user's ban as a timedelta, or None"""
+        unban_date = self.unban_date(user_id)
+        if unban_date is None:
+            return None
+        return unban_date - datetime.now(timezone.utc)
+
+    async def sweep(self):
+        """Expire every ban whose time is up"""
+        now = datetime.now(timezone.utc)
+        expired = []
+        while self._heap and self._heap[0][0] <= now:
+            unban_date, user_id = heapq.heappop(self._heap)
+            if self._bans.get(user_id) == unban_date:
+                del self._bans[user_id]
+                expired.append(user_id)
+
+        if expired:
+            try:
+                await banned_users_collection.delete_many({'user_id': {'$in': expired}, 'unban_date': {'$lte': now}})
+            except Exception as e:
+                LOGGER.error(f"Failed to delete {len(expired)} expired bans: {e}")
+        return expired
+
+    async def _run(self, interval):
+        while True:
+            await asyncio.sleep(interval)
+            await self.sweep()
+
+    def start(self, interval=SWEEP_INTERVAL):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run(interval))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+ban_registry = BanRegistry()
@@ -0,0 +1,168 @@
+import time
+
+from pyrogram.errors import BadRequest as PyrogramBadRequest
+from telegram.error import BadRequest
+
+from shivu import collection, media, LOGGER
+from shivu.spawn_pool import spawn_pool
+
+
+MISSING_TTL = 300  # seconds an id found nowhere is remembered as missing
+
+
+class Catalogue:
+    """Catalogue documents by id.
+
+    Backed by the spawn pool, which holds the whole catalogue. An id the pool
+    doesn't hold (it isn't loaded yet, or the id was written by something that
+    didn't tell it) is read through from the database once; ids the database
+    doesn't have either are remembered as missing for MISSING_TTL.
+
+    Whatever edits a catalogue document calls invalidate() (or forget() when
+    it's deleted), which also tells the on_change() listeners.
+    """
+
+    def __init__(self):
+        self._missing = {}  # id -> time the miss expires
+        self._listeners = []
+
+    def _known_missing(self, character_id):
+        expires = self._missing.get(character_id)
+        if expires is None:
+            return False
+        if expires < time.monotonic():
+            del self._missing[character_id]
+            return False
+        return True
+
+    async def get(self, character_id):
+        """The catalogue document, or None"""
+        return (await self.get_many([character_id])).get(character_id)
+
+    async def get_many(self, character_ids) -> dict:
+        """id -> catalogue document for the ids that exist"""
+        await spawn_pool.ensure_loaded()
+        found = {}
+        wanted = []
+        for character_id in character_ids:
+            character = spawn_pool.characters.get(character_id)
+            if character is not None:
+                found[character_id] = character
+            elif not self._known_missing(character_id):
+                wanted.append(character_id)
+
+        if wanted:
+            async for character in collection.find({'id': {'$in': wanted}}):
+                found[character['id']] = character
+                spawn_pool.add_character(character)
+            expires = time.monotonic() + MISSING_TTL
+            for character_id in wanted:
+                if character_id not in found:
+                    self._missing[character_id] = expires
+        return found
+
+    # ----- invalidation -----
+
+    def on_change(self, listener):
+        """Call `listener(character_id)` whenever a catalogue document changes or goes"""
+        self._listeners.append(listener)
+        return listener
+
+    def _changed(self, character_id):
+        for listener in self._listeners:
+            try:
+                listener(character_id)
+            except Exception as e:
+                LOGGER.error(f"Catalogue change listener failed for {character_id}: {e}")
+
+    async def invalidate(self, character_id):
+        """Re-read a character after it was inserted or edited"""
+        self._missing.pop(character_id, None)
+        await spawn_pool.refresh_character(character_id)
+        self._changed(character_id)
+
+    def add(self, character):
+        """A character that was just inserted, as written"""
+        self._missing.pop(character['id'], None)
+        spawn_pool.add_character(character)
+        self._changed(character['id'])
+
+    # Telegram refuses a stored file_id once the bot token changed or the file
+    # expired, or when it is of the other kind (a photo's sent as a video);
+    # Pyrogram notices a wrong kind itself and raises ValueError
+    REJECTED_FILE_ID = (BadRequest, PyrogramBadRequest, ValueError)
+
+    async def send_media(self, character, send, url, user_id=None):
+        """`send(file)` for what a character shows, PTB or Pyrogram alike.
+
+        Sends the stored file_id when there is one; if Telegram rejects it, it
+        is dropped and the same send goes out with `url`, whose file_id is then
+        kept for next time. Returns what `send` returned.
+        """
+        file_id = media.file_id(character, user_id)
+        if file_id:
+            try:
+                return await send(file_id)
+            except self.REJECTED_FILE_ID as e:
+                LOGGER.warning(f"Stored file_id of character {character.get('id')} rejected, sending the URL: {e}")
+                await self.forget_file_id(character, user_id)
+        message = await send(url)
+        await self.remember_file_id(character, message, user_id)
+        return message
+
+    async def remember_file_id(self, character, message, user_id=None):
+        """Keep the file_id of the first accepted send of what a character shows.
+
+        `message` is what send_photo/send_video returned. Stored only while the
+        URL it came from is still the current one, and patched into the cached
+        document in place: nothing a listener or a harem view cares about changed.
+        """
+        if not character or not message or media.file_id(character, user_id):
+            return
+        file_id = media.sent_file_id(message, media.is_video(character, user_id))
+        path, match = media.file_id_ref(character, user_id)
+        if not file_id or path is None:
+            return
+        try:
+            result = await collection.update_one({'id': character['id'], **match}, {'$set': {path: file_id}})
+        except Exception as e:
+            LOGGER.warning(f"Couldn't store the file_id of character {character['id']}: {e}")
+            return
+        if result.modified_count:
+            self._patch(character, path, file_id)
+
+    async def forget_file_id(self, character, user_id=None):
+        """Drop a stored file_id Telegram no longer accepts"""
+        path, match = media.file_id_ref(character, user_id)
+        if path is None:
+            return
+        try:
+            await collection.update_one({'id': character['id'], **match}, {'$unset': {path: ''}})
+        except Exception as e:
+            LOGGER.warning(f"Couldn't drop the file_id of character {character['id']}: {e}")
+        # Dropped from the cached copies either way, so the URL is sent from now on
+        self._patch(character, path, None)
+
+    @staticmethod
+    def _patch(character, path, file_id):
+        """Set (or with None, remove) the file_id at `path` in the cached documents"""
+        for document in (character, spawn_pool.characters.get(character['id'])):
+            if document is None:
+                continue
+            *parents, field = path.split('.')
+            for key in parents:
+                document = document.get(key) if isinstance(document, dict) else None
+            if not isinstance(document, dict):
+                continue
+            if file_id is None:
+                document.pop(field, None)
+            else:
+                document[field] = file_id
+
+    def forget(self, character_id):
+        """A character that was deleted"""
+        spawn_pool.remove_character(character_id)
+        self._changed(character_id)
+
+
+catalogue = Catalogue()
@@ -0,0 +1,75 @@
+import asyncio
+
+from telegram.error import RetryAfter
+
+from shivu import application, CHARA_CHANNEL_ID, LOGGER
+
+
+POST_INTERVAL = 3.0  # Telegram allows about 20 posts a minute into one chat
+MAX_ATTEMPTS = 5
+
+
+class ChannelPosts:
+    """Character posts to CHARA_CHANNEL_ID, sent one at a time POST_INTERVAL apart.
+
+    Bulk imports queue every card here, so two imports running at once still
+    stay under Telegram's per-chat limit. A flood wait (RetryAfter) is slept
+    off and the same post retried.
+    """
+
+    def __init__(self, interval=POST_INTERVAL):
+        self.interval = interval
+        self._queue = None
+        self._worker = None
+
+    def post(self, is_video, media, caption) -> asyncio.Future:
+        """Queue a photo/video post; the future resolves to the sent Message"""
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.create_task(self._run())
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((is_video, media, caption, future))
+        return future
+
+    def pending(self):
+        return self._queue.qsize() if self._queue else 0
+
+    async def _send(self, is_video, media, caption):
+        if is_video:
+            return await application.bot.send_video(
+                chat_id=CHARA_CHANNEL_ID, video=media, caption=caption, parse_mode='HTML'
+            )
+        return await application.bot.send_photo(
+            chat_id=CHARA_CHANNEL_ID, photo=media, caption=caption, parse_mode='HTML'
+        )
+
+    async def _run(self):
+        while True:
+            is_video, media, caption, future = await self._queue.get()
+            if future.cancelled():
+                continue
+            result = error = None
+            for attempt in range(MAX_ATTEMPTS):
+                try:
+                    result = await self._send(is_video, media, caption)
+                    break
+                except RetryAfter as e:
+                    delay = e.retry_after
+                    delay = delay.total_seconds() if hasattr(delay, 'total_seconds') else delay
+                    LOGGER.warning(f"Channel post flood wait, retrying in {delay}s")
+                    await asyncio.sleep(delay)
+                except Exception as e:
+                    error = e
+                    break
+            else:
+                error = RuntimeError("Telegram kept asking to wait")
+            if not future.done():
+                if error is not None:
+                    future.set_exception(error)
+                else:
+                    future.set_result(result)
+            await asyncio.sleep(self.interval)
+
+
+channel_posts = ChannelPosts()
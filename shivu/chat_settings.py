@@ -0,0 +1,80 @@
+import asyncio
+
+from shivu import user_totals_collection, event_settings_collection, LOGGER
+from shivu.spam_guard import SpamPolicy, DEFAULT_POLICY
+
+
+DEFAULT_MESSAGE_FREQUENCY = 100
+
+
+class ChatSettings:
+    """Per-chat spawn frequency, spam policy and the active event, kept in memory.
+
+    Loaded once at startup; /changetime, /spamconfig and /startevent /endevent
+    write through so the message hot path never has to ask Mongo.
+    """
+
+    def __init__(self):
+        self.frequencies = {}  # chat_id (int) -> message_frequency
+        self.spam_policies = {}  # chat_id (int) -> SpamPolicy, only for chats that override it
+        self.active_event = None
+        self.loaded = False
+        self._load_lock = asyncio.Lock()
+
+    async def load(self):
+        async with self._load_lock:
+            frequencies = {}
+            spam_policies = {}
+            cursor = user_totals_collection.find(
+                {'$or': [{'message_frequency': {'$exists': True}}, {'spam_limit': {'$exists': True}}]},
+                {'_id': 0, 'chat_id': 1, 'message_frequency': 1, 'spam_limit': 1, 'spam_window': 1, 'spam_block': 1}
+            )
+            async for doc in cursor:
+                try:
+                    chat_id = int(doc['chat_id'])
+                    if 'message_frequency' in doc:
+                        frequencies[chat_id] = int(doc['message_frequency'])
+                    if 'spam_limit' in doc:
+                        spam_policies[chat_id] = SpamPolicy(doc['spam_limit'], doc['spam_window'], doc['spam_block'])
+                except (KeyError, TypeError, ValueError):
+                    continue
+
+            self.frequencies = frequencies
+            self.spam_policies = spam_policies
+            self.active_event = await event_settings_collection.find_one({'active': True})
+            self.loaded = True
+            LOGGER.info(f"Chat settings loaded: {len(frequencies)} custom frequencies, "
+                        f"event={self.event_type()}")
+
+    async def ensure_loaded(self):
+        if not self.loaded:
+            await self.load()
+
+    def frequency(self, chat_id) -> int:
+        return self.frequencies.get(chat_id, DEFAULT_MESSAGE_FREQUENCY)
+
+    def set_frequency(self, chat_id, frequency):
+        self.frequencies[int(chat_id)] = int(frequency)
+
+    def spam_policy(self, chat_id) -> SpamPolicy:
+        return self.spam_policies.get(chat_id, DEFAULT_POLICY)
+
+    def set_spam_policy(self, chat_id, policy):
+        """Override a chat's spam policy; None goes back to the default"""
+        if policy is None:
+            self.spam_policies.pop(int(chat_id), None)
+        else:
+            self.spam_policies[int(chat_id)] = policy
+
+    def event_type(self):
+        """Type of the running event (e.g. 'christmas'), or None"""
+        if self.active_event:
+            return self.active_event.get('event_type')
+        return None
+
+    def set_event(self, event):
+        """Record the event document that just started, or None when it ended"""
+        self.active_event = event
+
+
+chat_settings = ChatSettings()
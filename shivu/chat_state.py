@@ -0,0 +1,270 @@
+import asyncio
+import sys
+import time
+from collections import OrderedDict, deque
+
+from shivu import LOGGER
+from shivu.spawn_pool import spawn_pool
+
+
+RECENT_SPAWNS = 50  # normal spawns remembered per chat to avoid repeats
+
+MAX_CHATS = 20000
+CHAT_TTL = 2 * 24 * 3600  # idle chats are forgotten after two days
+MAX_USERS = 100000
+USER_TTL = 900  # spam state of idle (and unblocked) users
+
+SWEEP_INTERVAL = 300  # seconds
+
+# try_claim outcomes
+CLAIM_WON = 'won'
+CLAIM_TAKEN = 'taken'
+CLAIM_WRONG = 'wrong'
+CLAIM_NOTHING = 'nothing'
+
+
+def name_tokens(name):
+    """Normalised name parts, and the same parts sorted, for match_name"""
+    parts = tuple(name.lower().split())
+    return parts, tuple(sorted(parts))
+
+
+def match_name(guess, name_parts, sorted_parts) -> bool:
+    """Smart matching: exact parts, partial matches, or fuzzy matches"""
+    guess = guess.strip()
+    if not guess:
+        return False
+
+    # 1. Exact full name match (any word order)
+    if sorted_parts == tuple(sorted(guess.split())):
+        return True
+
+    # 2. Exact single part match
+    if guess in name_parts:
+        return True
+
+    # 3. Partial match - guess is start of any name part (min 3 chars)
+    if len(guess) >= 3:
+        if any(part.startswith(guess) for part in name_parts):
+            return True
+
+    # 4. Stricter fuzzy match - only allow if guess is contained in part AND is at least 70% of its length
+    if len(guess) >= 4:
+        for part in name_parts:
+            if guess in part and len(guess) >= len(part) * 0.7:
+                return True
+
+    return False
+
+
+class ChatRecord:
+    """Spawn/claim state of one chat"""
+
+    __slots__ = ('character_id', '_detached', 'name_parts', 'sorted_parts', 'first_guesser',
+                 'manually_summoned', 'recent', '_recent_special', 'last_seen')
+
+    def __init__(self):
+        self.character_id = None
+        self._detached = None  # only set when the spawn pool doesn't hold the document
+        self.name_parts = ()
+        self.sorted_parts = ()
+        self.first_guesser = None
+        self.manually_summoned = False
+        self.recent = deque(maxlen=RECENT_SPAWNS)
+        self._recent_special = None  # kind -> set of ids, for Star/Zenith rotations
+        self.last_seen = 0.0
+
+    @property
+    def character(self):
+        """The character currently up for grabs, or None"""
+        if self.character_id is None:
+            return None
+        if self._detached is not None:
+            return self._detached
+        return spawn_pool.characters.get(self.character_id)
+
+    def spawn(self, character, manual=False):
+        """Put `character` up for grabs, clearing any previous winner"""
+        self.character_id = character['id']
+        # Share the pool's copy instead of holding one per chat
+        self._detached = None if self.character_id in spawn_pool.characters else character
+        self.name_parts, self.sorted_parts = name_tokens(character.get('name', ''))
+        self.first_guesser = None
+        self.manually_summoned = manual
+
+    @property
+    def taken(self) -> bool:
+        """An automatic spawn that someone already won (manual summons can be married repeatedly)"""
+        return self.first_guesser is not None and not self.manually_summoned
+
+    def try_claim(self, user_id, guess) -> str:
+        """Decide a /marry guess in memory.
+
+        Never awaits, so among concurrent guesses exactly one wins an automatic
+        spawn; only that one needs to touch the database.
+        """
+        if self.character_id is None:
+            return CLAIM_NOTHING
+        if self.taken:
+            return CLAIM_TAKEN
+        if not match_name(guess, self.name_parts, self.sorted_parts):
+            return CLAIM_WRONG
+        if not self.manually_summoned:
+            self.first_guesser = user_id
+        return CLAIM_WON
+
+    def release(self, user_id):
+        """Hand a won spawn back, e.g. when the winner turns out to be over their daily limit"""
+        if self.first_guesser == user_id:
+            self.first_guesser = None
+
+    def recent_special(self, kind):
+        if self._recent_special is None:
+            self._recent_special = {}
+        return self._recent_special.setdefault(kind, set())
+
+
+class UserRecord:
+    """Spam-detection state of one user"""
+
+    __slots__ = ('ring', 'head', 'count', 'blocked_until', 'last_seen')
+
+    def __init__(self):
+        self.ring = None  # fixed-size timestamp ring, see shivu.spam_guard
+        self.head = 0
+        self.count = 0
+        self.blocked_until = 0.0
+        self.last_seen = 0.0
+
+
+class ChatStateStore:
+    """LRU/TTL-bounded in-memory state for chats and users"""
+
+    def __init__(self, max_chats=MAX_CHATS, chat_ttl=CHAT_TTL, max_users=MAX_USERS, user_ttl=USER_TTL):
+        self.max_chats = max_chats
+        self.chat_ttl = chat_ttl
+        self.max_users = max_users
+        self.user_ttl = user_ttl
+        self._chats = OrderedDict()
+        self._users = OrderedDict()
+        self.evicted_chats = 0
+        self.evicted_users = 0
+        self._task = None
+
+    # ----- chats -----
+
+    def chat(self, chat_id) -> ChatRecord:
+        """Get (creating if needed) a chat's record and mark it as recently used"""
+        record = self._chats.get(chat_id)
+        if record is None:
+            record = self._chats[chat_id] = ChatRecord()
+            if len(self._chats) > self.max_chats:
+                self._chats.popitem(last=False)
+                self.evicted_chats += 1
+        else:
+            self._chats.move_to_end(chat_id)
+        record.last_seen = time.monotonic()
+        return record
+
+    def get_chat(self, chat_id):
+        return self._chats.get(chat_id)
+
+    # ----- users -----
+
+    def user(self, user_id) -> UserRecord:
+        record = self._users.get(user_id)
+        if record is None:
+            record = self._users[user_id] = UserRecord()
+            if len(self._users) > self.max_users:
+                self._evict_oldest_user()
+        else:
+            self._users.move_to_end(user_id)
+        record.last_seen = time.monotonic()
+        return record
+
+    def get_user(self, user_id):
+        return self._users.get(user_id)
+
+    def drop_user(self, user_id):
+        return self._users.pop(user_id, None)
+
+    def _evict_oldest_user(self):
+        # Never evict an active block - that would unmute a spammer early
+        now = time.time()
+        for _ in range(len(self._users)):
+            user_id, record = self._users.popitem(last=False)
+            if record.blocked_until > now:
+                self._users[user_id] = record
+                continue
+            self.evicted_users += 1
+            return
+
+    # ----- maintenance -----
+
+    def sweep(self):
+        """Drop chats and users idle for longer than their TTL"""
+        mono = time.monotonic()
+        now = time.time()
+
+        while self._chats:
+            chat_id, record = next(iter(self._chats.items()))
+            if mono - record.last_seen < self.chat_ttl:
+                break
+            del self._chats[chat_id]
+            self.evicted_chats += 1
+
+        kept_blocked = []
+        while self._users:
+            user_id, record = next(iter(self._users.items()))
+            if mono - record.last_seen < self.user_ttl:
+                break
+            del self._users[user_id]
+            if record.blocked_until > now:
+                kept_blocked.append((user_id, record))
+            else:
+                self.evicted_users += 1
+        for user_id, record in kept_blocked:
+            self._users[user_id] = record
+
+    def stats(self) -> dict:
+        now = time.time()
+        pending = sum(1 for r in self._chats.values() if r.character_id is not None and r.first_guesser is None)
+        blocked = sum(1 for r in self._users.values() if r.blocked_until > now)
+        approx_bytes = (
+            sys.getsizeof(self._chats) + sys.getsizeof(self._users)
+            + sum(sys.getsizeof(r) + sys.getsizeof(r.recent) for r in self._chats.values())
+            + sum(sys.getsizeof(r) + (sys.getsizeof(r.ring) if r.ring is not None else 0) for r in self._users.values())
+        )
+        return {
+            'chats': len(self._chats),
+            'pending_spawns': pending,
+            'users': len(self._users),
+            'blocked_users': blocked,
+            'evicted_chats': self.evicted_chats,
+            'evicted_users': self.evicted_users,
+            'approx_bytes': approx_bytes,
+        }
+
+    async def _run(self, interval):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                self.sweep()
+            except Exception as e:
+                LOGGER.error(f"Chat state sweep failed: {e}")
+
+    def start(self, interval=SWEEP_INTERVAL):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run(interval))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+chat_state = ChatStateStore()
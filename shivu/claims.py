@@ -0,0 +1,71 @@
+from datetime import datetime, timezone
+
+from pymongo.errors import DuplicateKeyError
+
+from shivu import user_collection
+from shivu.harem_store import COUNTS_FIELD, counts_field
+from shivu.leaderboard_buffer import leaderboard_buffer
+from shivu.owner_index import owner_index
+from shivu.harem_views import harem_views
+
+
+DAILY_MARRIAGE_LIMIT = 30
+
+CLAIMED = 'claimed'
+LIMIT_REACHED = 'limit_reached'
+
+
+def today_key() -> str:
+    return datetime.now(timezone.utc).strftime('%Y-%m-%d')
+
+
+async def _claim_for_user(user_id, username, first_name, character, today) -> bool:
+    """Give `character` to the user if they are under today's limit, creating them if new"""
+    day_field = f'daily_marriages.{today}'
+    claim_filter = {'id': user_id, day_field: {'$not': {'$gte': DAILY_MARRIAGE_LIMIT}}}
+    claim_update = {
+        '$inc': {day_field: 1, counts_field(character['id']): 1},
+        '$set': {'username': username, 'first_name': first_name},
+    }
+
+    result = await user_collection.update_one(claim_filter, claim_update)
+    if result.matched_count:
+        return True
+
+    # No match: either the user is at the limit or doesn't exist yet
+    if await user_collection.find_one({'id': user_id}, {'_id': 1}):
+        return False
+
+    try:
+        await user_collection.insert_one({
+            'id': user_id,
+            'username': username,
+            'first_name': first_name,
+            COUNTS_FIELD: {character['id']: 1},
+            'daily_marriages': {today: 1}
+        })
+        return True
+    except DuplicateKeyError:
+        # Created by a concurrent claim in the meantime
+        result = await user_collection.update_one(claim_filter, claim_update)
+        return bool(result.matched_count)
+
+
+async def record_claim(user, chat, character) -> str:
+    """Persist a won /marry: the user's harem and daily counter, both group leaderboards
+    and the character's owner index.
+
+    The user document is one conditional update with the daily limit in its
+    filter; the leaderboards and owner index are counted in write-behind buffers,
+    and the user's cached harem view is retired.
+    Returns LIMIT_REACHED (and counts nothing) if the limit filter rejects it.
+    """
+    username = getattr(user, 'username', None)
+
+    if not await _claim_for_user(user.id, username, user.first_name, character, today_key()):
+        return LIMIT_REACHED
+
+    leaderboard_buffer.add_claim(user.id, username, user.first_name, chat.id, chat.title)
+    owner_index.record(character['id'], user.id, 1, user.first_name)
+    harem_views.invalidate(user.id)
+    return CLAIMED
@@ -18,6 +18,13 @@ class Config(object):
     api_id_str = os.environ.get("TELEGRAM_API_ID", "0")
     api_id = int(api_id_str) if api_id_str and api_id_str.strip() else 0
     api_hash = os.environ.get("TELEGRAM_API_HASH")
+    # "memory" pages harems from cached views, "server" has MongoDB page them
+    HAREM_PAGINATION = os.environ.get("HAREM_PAGINATION", "memory")
+    # List the main group's members into the /harem membership cache at startup
+    WARM_MEMBERSHIP = os.environ.get("WARM_MEMBERSHIP", "").lower() in ("1", "true", "yes")
+    # Refuse to start when a hot query would scan its collection (the owner is told either way).
+    # Off by default: a unique index blocked by old duplicates would otherwise keep the bot down
+    STRICT_QUERY_PLANS = os.environ.get("STRICT_QUERY_PLANS", "").lower() in ("1", "true", "yes")
 
     
 class Production(Config):
@@ -0,0 +1,254 @@
+import asyncio
+from collections import Counter
+
+from pymongo import UpdateOne
+
+from shivu import user_collection
+from shivu.catalogue import catalogue
+from shivu.owner_index import owner_index
+from shivu.harem_views import harem_views
+
+
+# A harem is {character id: copies} under COUNTS_FIELD; catalogue documents are
+# looked up at read time. Users that haven't been migrated yet still carry full
+# character copies in LEGACY_FIELD, and every reader here merges the two.
+# Every ownership change made here is also recorded in the owner index and
+# retires the user's cached harem view.
+COUNTS_FIELD = 'char_counts'
+LEGACY_FIELD = 'characters'
+
+
+def counts_field(character_id) -> str:
+    return f'{COUNTS_FIELD}.{character_id}'
+
+
+def owned_query(character_id) -> dict:
+    """Filter matching users that own at least one copy of a character"""
+    return {'$or': [{counts_field(character_id): {'$gte': 1}}, {f'{LEGACY_FIELD}.id': character_id}]}
+
+
+# ----- reading -----
+
+def owned_counts(user) -> dict:
+    """{character id: copies} for a user document, migrated or not"""
+    counts = dict(user.get(COUNTS_FIELD) or {})
+    for character in user.get(LEGACY_FIELD) or ():
+        character_id = character.get('id')
+        counts[character_id] = counts.get(character_id, 0) + 1
+    return counts
+
+
+def copies(user, character_id) -> int:
+    count = (user.get(COUNTS_FIELD) or {}).get(character_id, 0)
+    return count + sum(1 for c in user.get(LEGACY_FIELD) or () if c.get('id') == character_id)
+
+
+def has_characters(user) -> bool:
+    return bool(user) and (any((user.get(COUNTS_FIELD) or {}).values()) or bool(user.get(LEGACY_FIELD)))
+
+
+def total_characters(user) -> int:
+    return sum((user.get(COUNTS_FIELD) or {}).values()) + len(user.get(LEGACY_FIELD) or ())
+
+
+async def catalogue_documents(character_ids) -> dict:
+    """id -> catalogue document, from the shared catalogue cache"""
+    return await catalogue.get_many(character_ids)
+
+
+async def get_character(user, character_id):
+    """The catalogue document of a character the user owns, or None"""
+    if not copies(user, character_id):
+        return None
+    documents = await catalogue_documents([character_id])
+    if character_id in documents:
+        return documents[character_id]
+    return next((c for c in user.get(LEGACY_FIELD) or () if c.get('id') == character_id), None)
+
+
+async def hydrate(user, unique=False) -> list:
+    """Every character the user owns as a catalogue document, one entry per copy
+    (or per id with `unique`).
+
+    Entries of the same id share one document, so callers must not mutate them.
+    Legacy copies whose character is gone from the catalogue are kept as stored.
+    """
+    counts = user.get(COUNTS_FIELD) or {}
+    legacy = user.get(LEGACY_FIELD) or []
+    documents = await catalogue_documents(set(counts) | {c.get('id') for c in legacy})
+
+    characters = [documents.get(c.get('id'), c) for c in legacy]
+    for character_id, count in counts.items():
+        character = documents.get(character_id)
+        if character is not None and count > 0:
+            characters.extend([character] * (1 if unique else count))
+    if unique:
+        characters = list({c.get('id'): c for c in characters}.values())
+    return characters
+
+
+# ----- writing -----
+
+async def add_characters(user_id, character_ids, set_fields=None, insert_fields=None):
+    """Give the user one copy per id in `character_ids`, or {id: copies} if it's a mapping.
+
+    With `insert_fields` a missing user is created with those fields.
+    """
+    counts = Counter(character_ids)
+    update = {'$inc': {counts_field(cid): n for cid, n in counts.items()}}
+    if set_fields:
+        update['$set'] = set_fields
+    if insert_fields:
+        update['$setOnInsert'] = insert_fields
+    result = await user_collection.update_one({'id': user_id}, update, upsert=insert_fields is not None)
+    if result.matched_count or result.upserted_id is not None:
+        owner_index.record_many(user_id, counts, first_name=(set_fields or {}).get('first_name'))
+        harem_views.invalidate(user_id)
+    return result
+
+
+async def remove_character(user_id, character_id) -> bool:
+    """Take one copy of a character from the user; False if they had none"""
+    field = counts_field(character_id)
+    removed = bool((await user_collection.update_one(
+        {'id': user_id, field: {'$gt': 1}}, {'$inc': {field: -1}}
+    )).modified_count)
+    if not removed:
+        removed = bool((await user_collection.update_one(
+            {'id': user_id, field: {'$lte': 1}}, {'$unset': {field: ''}}
+        )).modified_count)
+    if not removed:
+        removed = await _remove_legacy_copy(user_id, character_id)
+    if removed:
+        owner_index.record(character_id, user_id, -1)
+        harem_views.invalidate(user_id)
+    return removed
+
+
+async def _remove_legacy_copy(user_id, character_id) -> bool:
+    user = await user_collection.find_one(
+        {'id': user_id, f'{LEGACY_FIELD}.id': character_id}, {f'{LEGACY_FIELD}.id': 1}
+    )
+    if not user:
+        return False
+    index = next(i for i, c in enumerate(user[LEGACY_FIELD]) if c.get('id') == character_id)
+    # Unset-then-pull is the only way to drop a single array element
+    result = await user_collection.update_one(
+        {'id': user_id, f'{LEGACY_FIELD}.{index}.id': character_id},
+        {'$unset': {f'{LEGACY_FIELD}.{index}': 1}}
+    )
+    await user_collection.update_one({'id': user_id}, {'$pull': {LEGACY_FIELD: None}})
+    return bool(result.modified_count)
+
+
+async def give_characters(from_user_id, to_user_id, character_ids, insert_fields=None) -> list:
+    """Move one copy per id from one user to another; returns the ids actually moved"""
+    moved = [cid for cid in character_ids if await remove_character(from_user_id, cid)]
+    if moved:
+        await add_characters(to_user_id, moved, insert_fields=insert_fields)
+    return moved
+
+
+async def swap(user_a, character_a, user_b, character_b) -> bool:
+    """Trade one copy of `character_a` (owned by A) for one of `character_b` (owned by B).
+
+    Returns False, with nothing moved, if either copy is no longer there.
+    """
+    if not await remove_character(user_a, character_a):
+        return False
+    if not await remove_character(user_b, character_b):
+        await add_characters(user_a, [character_a])
+        return False
+    await asyncio.gather(add_characters(user_a, [character_b]), add_characters(user_b, [character_a]))
+    return True
+
+
+async def move_harem(from_user, to_user_id, insert_fields=None) -> int:
+    """Move every copy `from_user` owns to another user, creating them if needed.
+
+    Returns the number of copies moved.
+    """
+    await migrate_user(from_user)
+    from_user = await user_collection.find_one({'_id': from_user['_id']}, {'id': 1, COUNTS_FIELD: 1, LEGACY_FIELD: 1})
+    counts = {cid: n for cid, n in (from_user.get(COUNTS_FIELD) or {}).items() if n > 0}
+    leftovers = from_user.get(LEGACY_FIELD) or []
+    if not counts and not leftovers:
+        return 0
+
+    update = {}
+    if counts:
+        update['$inc'] = {counts_field(cid): n for cid, n in counts.items()}
+    if leftovers:
+        update['$push'] = {LEGACY_FIELD: {'$each': leftovers}}
+    if insert_fields:
+        update['$setOnInsert'] = insert_fields
+    await user_collection.update_one({'id': to_user_id}, update, upsert=True)
+    await user_collection.update_one({'_id': from_user['_id']}, {'$unset': {COUNTS_FIELD: '', LEGACY_FIELD: ''}})
+
+    moved = Counter(counts) + Counter(c.get('id') for c in leftovers)
+    owner_index.record_many(from_user['id'], moved, sign=-1)
+    owner_index.record_many(to_user_id, moved)
+    harem_views.invalidate(from_user['id'])
+    harem_views.invalidate(to_user_id)
+    return sum(moved.values())
+
+
+def removal_update(character_id) -> dict:
+    """The update dropping a character from a harem that owned_query() matched"""
+    return {'$unset': {counts_field(character_id): ''}, '$pull': {LEGACY_FIELD: {'id': character_id}}}
+
+
+async def remove_everywhere(character_id, status=None):
+    """Drop a character from every harem, e.g. after it left the catalogue.
+
+    The owner index and cached views forget it now; the harem writes are a
+    propagation job, since they touch every owner's document; `status` is the
+    message that reports its progress.
+    """
+    from shivu.propagation import propagation, DELETE
+
+    await owner_index.forget(character_id)
+    harem_views.clear()
+    return await propagation.enqueue(DELETE, character_id, status=status)
+
+
+# ----- migration -----
+
+async def migration_update(user):
+    """The UpdateOne folding a user's embedded character copies into COUNTS_FIELD, or None.
+
+    Copies whose character is no longer in the catalogue stay embedded, since
+    they can't be hydrated from anywhere else. The `$size` guard makes a
+    concurrent removal from the legacy array win; the user is picked up again
+    on the next run.
+    """
+    legacy = user.get(LEGACY_FIELD) or []
+    if not legacy:
+        return None
+
+    documents = await catalogue_documents({c.get('id') for c in legacy})
+    counts = Counter()
+    leftovers = []
+    for character in legacy:
+        if character.get('id') in documents:
+            counts[character['id']] += 1
+        else:
+            leftovers.append(character)
+    if not counts:
+        return None
+
+    update = {'$inc': {counts_field(cid): n for cid, n in counts.items()}}
+    if leftovers:
+        update['$set'] = {LEGACY_FIELD: leftovers}
+    else:
+        update['$unset'] = {LEGACY_FIELD: ''}
+    return UpdateOne({'_id': user['_id'], LEGACY_FIELD: {'$size': len(legacy)}}, update)
+
+
+async def migrate_user(user) -> bool:
+    """Migrate one user right away (see migration_update)"""
+    operation = await migration_update(user)
+    if operation is None:
+        return False
+    result = await user_collection.bulk_write([operation])
+    return bool(result.modified_count)
@@ -0,0 +1,340 @@
+from collections import OrderedDict
+
+from shivu import collection, user_collection, HAREM_PAGINATION
+from shivu.spawn_pool import spawn_pool
+
+
+PAGE_SIZE = 15
+MAX_VIEWS = 2000  # users whose harem view is kept
+
+# Rarest first
+RARITY_ORDER = [
+    "Limited Edition",
+    "Star",
+    "Zenith",
+    "Retro",
+    "Mythic",
+    "Legendary",
+    "Epic",
+    "Rare",
+    "Uncommon",
+    "Common",
+]
+RARITY_RANK = {rarity: rank for rank, rarity in enumerate(RARITY_ORDER)}
+
+
+def rarity_rank(character):
+    return RARITY_RANK.get(character.get("rarity", "Common"), len(RARITY_ORDER))
+
+
+def sort_key(sort_preference):
+    """Harem order for a /sorts preference; anime then id by default"""
+    if sort_preference == "rarity":
+        return lambda c: (rarity_rank(c), c["name"])
+    if sort_preference == "name":
+        return lambda c: c["name"]
+    if sort_preference == "limited_time":
+        return lambda c: (
+            0 if c.get("rarity") == "Limited Edition" else 1,
+            rarity_rank(c),
+            c["name"],
+        )
+    return lambda c: (c["anime"], c["id"])
+
+
+class HaremView:
+    """One user's harem as /harem shows it, with their preferences applied.
+
+    `shown` holds one catalogue document per character, filtered and
+    ordered; `characters` every copy the user owns, unfiltered, and `by_id`
+    one document per id owned. Page bodies
+    are rendered once on first view and kept in `pages`.
+    """
+
+    __slots__ = ('version', 'pool_version', 'filter_type', 'filter_value', 'favorite',
+                 'characters', 'by_id', 'counts', 'shown', 'pages')
+
+    def __init__(self, user, characters, counts, version, pool_version):
+        self.version = version
+        self.pool_version = pool_version
+        self.filter_type = user.get("filter_type")
+        self.filter_value = user.get("filter_value")
+        favorites = user.get("favorites")
+        self.favorite = favorites[0] if favorites else None
+        self.characters = characters
+        self.counts = counts
+
+        self.by_id = {c["id"]: c for c in characters}
+
+        shown = self.by_id.values()
+        if self.filter_type == "rarity" and self.filter_value:
+            shown = [c for c in shown if c.get("rarity") == self.filter_value]
+        elif self.filter_type == "character" and self.filter_value:
+            value = self.filter_value.lower()
+            shown = [c for c in shown if value in c["name"].lower()]
+        self.shown = sorted(shown, key=sort_key(user.get("sort_preference", "anime")))
+        self.pages = {}  # page -> rendered body
+
+    @property
+    def total_pages(self):
+        return -(-len(self.shown) // PAGE_SIZE)
+
+    @property
+    def total(self):
+        """Copies owned, duplicates included"""
+        return len(self.characters)
+
+    def page(self, page):
+        return self.shown[page * PAGE_SIZE:(page + 1) * PAGE_SIZE]
+
+    def rendered(self, page, render):
+        """The page body, rendering it with `render(view, page)` the first time"""
+        body = self.pages.get(page)
+        if body is None:
+            body = self.pages[page] = render(self, page)
+        return body
+
+
+class HaremViews:
+    """Most recently viewed harems, so /harem pagination is a dict lookup.
+
+    Anything that changes a harem or the /sorts and /fav preferences calls
+    invalidate(), which bumps the user's version; a view built before the
+    bump (even one still being built) is never served. Catalogue edits bump
+    the spawn pool's version and retire every view.
+    """
+
+    def __init__(self, max_views=MAX_VIEWS):
+        self.max_views = max_views
+        self._views = OrderedDict()  # user_id -> HaremView
+        self._versions = {}  # user_id -> version, for cached users and builds in flight
+        self._building = {}  # user_id -> builds in flight
+
+    def invalidate(self, user_id):
+        if user_id in self._views or user_id in self._building:
+            self._versions[user_id] = self._versions.get(user_id, 0) + 1
+
+    def clear(self):
+        self._views.clear()
+        self._versions = {user_id: self._versions.get(user_id, 0) + 1 for user_id in self._building}
+
+    def _current(self, user_id):
+        view = self._views.get(user_id)
+        if view is None:
+            return None
+        if view.version != self._versions.get(user_id, 0) or view.pool_version != spawn_pool.version:
+            self._drop(user_id)
+            return None
+        self._views.move_to_end(user_id)
+        return view
+
+    def _drop(self, user_id):
+        self._views.pop(user_id, None)
+        if user_id not in self._building:
+            self._versions.pop(user_id, None)
+
+    async def get(self, user_id):
+        """The user's view, built from the database if needed; None if they don't exist"""
+        view = self._current(user_id)
+        if view is not None:
+            return view
+
+        # harem_store imports this module to invalidate views
+        from shivu import harem_store, users
+
+        self._building[user_id] = self._building.get(user_id, 0) + 1
+        try:
+            await spawn_pool.ensure_loaded()
+            version = self._versions.get(user_id, 0)
+            pool_version = spawn_pool.version
+            user = await users.get_harem(user_id, *users.PREF_FIELDS)
+            if not user:
+                return None
+            characters = await harem_store.hydrate(user)
+            view = HaremView(user, characters, harem_store.owned_counts(user), version, pool_version)
+        finally:
+            self._building[user_id] -= 1
+            if not self._building[user_id]:
+                del self._building[user_id]
+
+        if version == self._versions.get(user_id, 0):
+            self._views[user_id] = view
+            self._views.move_to_end(user_id)
+            while len(self._views) > self.max_views:
+                self._drop(next(iter(self._views)))
+        elif user_id not in self._views and user_id not in self._building:
+            self._versions.pop(user_id, None)
+        return view
+
+
+harem_views = HaremViews()
+
+
+# ----- server-side pagination -----
+#
+# With HAREM_PAGINATION=server, MongoDB expands and groups the harem, joins
+# the catalogue, filters, sorts and pages it, and only the page being shown
+# (plus totals) comes back, so a request's memory no longer grows with the
+# size of the harem.
+
+def _owned_stages(user_id):
+    """One document per character owned: {_id: id, count, doc, <user fields>}"""
+    from shivu import harem_store
+
+    return [
+        {"$match": {"id": user_id}},
+        {"$project": {
+            "filter_type": 1,
+            "filter_value": 1,
+            "sort_preference": 1,
+            "favorite": {"$arrayElemAt": [{"$ifNull": ["$favorites", []]}, 0]},
+            "items": {"$concatArrays": [
+                {"$map": {
+                    "input": {"$objectToArray": {"$ifNull": [f"${harem_store.COUNTS_FIELD}", {}]}},
+                    "in": {"id": "$$this.k", "count": "$$this.v", "doc": None},
+                }},
+                {"$map": {
+                    "input": {"$ifNull": [f"${harem_store.LEGACY_FIELD}", []]},
+                    "in": {"id": "$$this.id", "count": 1, "doc": "$$this"},
+                }},
+            ]},
+        }},
+        {"$unwind": "$items"},
+        {"$group": {
+            "_id": "$items.id",
+            "count": {"$sum": "$items.count"},
+            # Embedded copy, kept for characters gone from the catalogue (null sorts lowest)
+            "legacy": {"$max": "$items.doc"},
+            "filter_type": {"$first": "$filter_type"},
+            "filter_value": {"$first": "$filter_value"},
+            "sort_preference": {"$first": "$sort_preference"},
+            "favorite": {"$first": "$favorite"},
+        }},
+        {"$match": {"count": {"$gt": 0}}},
+        {"$lookup": {"from": collection.name, "localField": "_id", "foreignField": "id", "as": "doc"}},
+        {"$set": {"doc": {"$ifNull": [{"$first": "$doc"}, "$legacy"]}}},
+        {"$match": {"doc": {"$ne": None}}},
+    ]
+
+
+_RARITY_RANK = {"$let": {
+    "vars": {"rank": {"$indexOfArray": [RARITY_ORDER, {"$ifNull": ["$doc.rarity", "Common"]}]}},
+    "in": {"$cond": [{"$lt": ["$$rank", 0]}, len(RARITY_ORDER), "$$rank"]},
+}}
+
+# Sort keys k1..k3 per /sorts preference, matching sort_key()
+_SORT_KEYS = {"$switch": {
+    "branches": [
+        {"case": {"$eq": ["$sort_preference", "rarity"]},
+         "then": {"k1": _RARITY_RANK, "k2": "$doc.name", "k3": None}},
+        {"case": {"$eq": ["$sort_preference", "name"]},
+         "then": {"k1": "$doc.name", "k2": None, "k3": None}},
+        {"case": {"$eq": ["$sort_preference", "limited_time"]},
+         "then": {"k1": {"$cond": [{"$eq": ["$doc.rarity", "Limited Edition"]}, 0, 1]},
+                  "k2": _RARITY_RANK, "k3": "$doc.name"}},
+    ],
+    "default": {"k1": "$doc.anime", "k2": "$_id", "k3": None},
+}}
+
+# The /sorts filter, matching HaremView ("" is truthy to MongoDB, unlike Python)
+_HAS_FILTER_VALUE = {"$gt": [{"$strLenCP": {"$ifNull": ["$filter_value", ""]}}, 0]}
+_SHOWN = {"$switch": {
+    "branches": [
+        {"case": {"$and": [{"$eq": ["$filter_type", "rarity"]}, _HAS_FILTER_VALUE]},
+         "then": {"$eq": ["$doc.rarity", "$filter_value"]}},
+        {"case": {"$and": [{"$eq": ["$filter_type", "character"]}, _HAS_FILTER_VALUE]},
+         "then": {"$gte": [{"$indexOfCP": [{"$toLower": "$doc.name"}, {"$toLower": "$filter_value"}]}, 0]}},
+    ],
+    "default": True,
+}}
+
+
+class HaremPage:
+    """One page of a harem as queried from MongoDB; quacks like HaremView for /harem"""
+
+    def __init__(self, number, result):
+        summary = result["summary"][0] if result["summary"] else {}
+        self.number = number
+        self.filter_type = summary.get("filter_type")
+        self.filter_value = summary.get("filter_value")
+        self.favorite = summary.get("favorite")
+        self.total = summary.get("total", 0)
+        shown = result["shown"][0]["n"] if result["shown"] else 0
+        self.total_pages = -(-shown // PAGE_SIZE)
+
+        self.counts = {entry["_id"]: entry["count"] for entry in result["page"]}
+        self.docs = [entry["doc"] for entry in result["page"]]
+        # Favourite and a random pick, for the harem picture
+        self.by_id = {entry["_id"]: entry["doc"] for entry in result["favorite"]}
+        self.characters = [entry["doc"] for entry in result["random"]]
+
+    def page(self, page):
+        return self.docs if page == self.number else []
+
+    def rendered(self, page, render):
+        return render(self, page)
+
+
+async def server_page(user_id, page):
+    """Page `page` of the user's harem (page 0 if out of range), or None if they don't exist"""
+    page = max(page, 0)
+    pipeline = _owned_stages(user_id) + [
+        {"$set": {"shown": _SHOWN, "sort": _SORT_KEYS}},
+        {"$facet": {
+            "summary": [{"$group": {
+                "_id": None,
+                "total": {"$sum": "$count"},
+                "filter_type": {"$first": "$filter_type"},
+                "filter_value": {"$first": "$filter_value"},
+                "favorite": {"$first": "$favorite"},
+            }}],
+            "shown": [{"$match": {"shown": True}}, {"$count": "n"}],
+            "page": [
+                {"$match": {"shown": True}},
+                {"$sort": {"sort.k1": 1, "sort.k2": 1, "sort.k3": 1, "_id": 1}},
+                {"$skip": page * PAGE_SIZE},
+                {"$limit": PAGE_SIZE},
+                {"$project": {"count": 1, "doc": 1}},
+            ],
+            "favorite": [
+                {"$match": {"$expr": {"$eq": ["$_id", "$favorite"]}}},
+                {"$project": {"doc": 1}},
+            ],
+            "random": [{"$sample": {"size": 1}}, {"$project": {"doc": 1}}],
+        }},
+    ]
+    results = await user_collection.aggregate(pipeline).to_list(length=1)
+    result = results[0] if results else None
+    if not result or not result["summary"]:
+        if await user_collection.find_one({"id": user_id}, {"_id": 1}) is None:
+            return None
+        return HaremPage(0, {"summary": [], "shown": [], "page": [], "favorite": [], "random": []})
+
+    view = HaremPage(page, result)
+    if not view.docs and page > 0 and view.total_pages:
+        return await server_page(user_id, 0)
+    return view
+
+
+async def server_collection_page(user_id, search, offset, limit):
+    """Unique characters of a harem for the inline collection view, matching `search`
+    (a compiled regex or None) on name or anime. Returns (docs, has_more).
+    """
+    pipeline = _owned_stages(user_id)
+    if search is not None:
+        pipeline.append({"$match": {"$or": [{"doc.name": search}, {"doc.anime": search}]}})
+    pipeline += [
+        {"$sort": {"_id": 1}},
+        {"$skip": offset},
+        {"$limit": limit + 1},
+        {"$replaceRoot": {"newRoot": "$doc"}},
+    ]
+    docs = await user_collection.aggregate(pipeline).to_list(length=limit + 1)
+    return docs[:limit], len(docs) > limit
+
+
+async def harem_page(user_id, page):
+    """What /harem shows for `page`: the cached HaremView, or a HaremPage in server mode"""
+    if HAREM_PAGINATION == "server":
+        return await server_page(user_id, page)
+    return await harem_views.get(user_id)
@@ -0,0 +1,179 @@
+import asyncio
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from shivu import group_user_totals_collection, top_global_groups_collection, LOGGER
+
+
+FLUSH_INTERVAL = 5  # seconds between write-behind flushes
+
+
+class _Pending:
+    __slots__ = ('delta', 'fields')
+
+    def __init__(self):
+        self.delta = 0
+        self.fields = {}
+
+
+class LeaderboardBuffer:
+    """Coalesces claim counts for /ctop and /TopGroups.
+
+    Claims add to in-memory deltas per (user, group) and per group, together
+    with the latest username/first name/group title. Every FLUSH_INTERVAL
+    seconds (and on shutdown) the deltas go out as one unordered bulk_write
+    per collection. Readers merge the pending deltas into what's stored.
+    """
+
+    def __init__(self):
+        self._users = {}  # (user_id, group_id) -> _Pending
+        self._groups = {}  # group_id -> _Pending
+        self._task = None
+        self._flush_lock = asyncio.Lock()
+
+    def add_claim(self, user_id, username, first_name, group_id, group_name, amount=1):
+        pending = self._users.get((user_id, group_id))
+        if pending is None:
+            pending = self._users[(user_id, group_id)] = _Pending()
+        pending.delta += amount
+        pending.fields['username'] = username
+        pending.fields['first_name'] = first_name
+
+        pending = self._groups.get(group_id)
+        if pending is None:
+            pending = self._groups[group_id] = _Pending()
+        pending.delta += amount
+        pending.fields['group_name'] = group_name
+
+    @staticmethod
+    def _operations(pending, key_filter):
+        operations = []
+        for key, entry in pending.items():
+            update = {'$set': entry.fields}
+            if entry.delta:
+                update['$inc'] = {'count': entry.delta}
+            operations.append(UpdateOne(key_filter(key), update, upsert=True))
+        return operations
+
+    async def flush(self):
+        """Write all pending deltas; returns the number of documents touched"""
+        async with self._flush_lock:
+            if not self._users and not self._groups:
+                return 0
+
+            users, self._users = self._users, {}
+            groups, self._groups = self._groups, {}
+            user_ops = self._operations(users, lambda key: {'user_id': key[0], 'group_id': key[1]})
+            group_ops = self._operations(groups, lambda key: {'group_id': key})
+
+            writes = []
+            if user_ops:
+                writes.append((users, '_users', group_user_totals_collection.bulk_write(user_ops, ordered=False)))
+            if group_ops:
+                writes.append((groups, '_groups', top_global_groups_collection.bulk_write(group_ops, ordered=False)))
+            results = await asyncio.gather(*(write for _, _, write in writes), return_exceptions=True)
+
+            # $inc upserts aren't idempotent: only what provably didn't commit goes
+            # back on the queue, or the next flush could count it twice
+            written = 0
+            for (pending, attribute, _), result in zip(writes, results):
+                if not isinstance(result, BaseException):
+                    written += len(pending)
+                    continue
+                unwritten = self._uncommitted(pending, result)
+                if isinstance(result, BulkWriteError):
+                    LOGGER.error(f"Failed to write {len(unwritten)} of {len(pending)} leaderboard counters, requeued them: {result}")
+                else:
+                    LOGGER.error(f"Failed to flush {len(pending)} leaderboard counters, dropped them: {result}")
+                self._requeue(unwritten, getattr(self, attribute))
+            return written
+
+    @staticmethod
+    def _uncommitted(pending, error):
+        """The entries of `pending` a failed bulk_write is known not to have applied"""
+        if not isinstance(error, BulkWriteError):
+            # A timeout or lost connection may come after the server applied part
+            # of the batch; like the owner index, lose a few ticks rather than double count
+            return {}
+        # An unordered bulk_write applies everything but the operations it reports
+        keys = list(pending)
+        return {keys[e['index']]: pending[keys[e['index']]] for e in error.details.get('writeErrors', [])}
+
+    @staticmethod
+    def _requeue(old, current):
+        for key, entry in old.items():
+            newer = current.get(key)
+            if newer is None:
+                current[key] = entry
+            else:
+                newer.delta += entry.delta
+                newer.fields = {**entry.fields, **newer.fields}
+
+    # ----- read-through -----
+
+    async def _read_through(self, collection, match, key_field, fields, pending, limit):
+        """Stored top `limit` plus the stored rows of pending keys, with the pending deltas applied"""
+        projection = {'_id': 0, key_field: 1, 'count': 1, **{field: 1 for field in fields}}
+
+        # Hold off flushes so a delta can't be both in the snapshot and in what we read
+        async with self._flush_lock:
+            snapshot = {key: (entry.delta, dict(entry.fields)) for key, entry in pending().items()}
+            queries = [collection.find(match, projection).sort('count', -1).limit(limit).to_list(length=limit)]
+            if snapshot:
+                queries.append(collection.find(
+                    {**match, key_field: {'$in': list(snapshot)}}, projection
+                ).to_list(length=None))
+            results = await asyncio.gather(*queries)
+
+        rows = {}
+        for docs in results:
+            for doc in docs:
+                rows[doc.get(key_field)] = doc
+        for key, (delta, entry_fields) in snapshot.items():
+            row = rows.setdefault(key, {key_field: key, 'count': 0})
+            row['count'] = row.get('count', 0) + delta
+            row.update(entry_fields)
+
+        return sorted(rows.values(), key=lambda row: row.get('count', 0), reverse=True)[:limit]
+
+    async def top_group_users(self, group_id, limit=10):
+        """Top users of a group by claims, including unflushed ones"""
+        return await self._read_through(
+            group_user_totals_collection, {'group_id': group_id}, 'user_id', ('username', 'first_name'),
+            lambda: {user_id: entry for (user_id, gid), entry in self._users.items() if gid == group_id},
+            limit
+        )
+
+    async def top_groups(self, limit=10):
+        """Top groups by claims, including unflushed ones"""
+        return await self._read_through(
+            top_global_groups_collection, {}, 'group_id', ('group_name',),
+            lambda: self._groups,
+            limit
+        )
+
+    # ----- lifecycle -----
+
+    async def _run(self, interval):
+        while True:
+            await asyncio.sleep(interval)
+            await self.flush()
+
+    def start(self, interval=FLUSH_INTERVAL):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run(interval))
+
+    async def stop(self):
+        """Stop the flush loop and write out whatever is left"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+
+leaderboard_buffer = LeaderboardBuffer()
@@ -0,0 +1,195 @@
+"""Whether a character (or one of its Custom slots) is a video, and its MIME type.
+
+Worked out once when a URL is uploaded and stored on the record:
+`media_kind` and `mime_type` on catalogue documents, `type` and `mime_type`
+on owner slot records. The display paths read those fields; records written
+before they existed fall back to classifying the URL on the fly until the
+`media_kind` migration has backfilled them.
+"""
+
+VIDEO = 'video'
+IMAGE = 'image'
+
+# Characters uploaded as videos are also marked in their name
+VIDEO_MARKER = '🎬'
+
+VIDEO_TYPES = {
+    '.mp4': 'video/mp4',
+    '.webm': 'video/webm',
+    '.mov': 'video/quicktime',
+    '.avi': 'video/x-msvideo',
+    '.mkv': 'video/x-matroska',
+    '.flv': 'video/x-flv',
+}
+IMAGE_TYPES = {
+    '.jpg': 'image/jpeg',
+    '.jpeg': 'image/jpeg',
+    '.png': 'image/png',
+    '.gif': 'image/gif',
+    '.webp': 'image/webp',
+    '.bmp': 'image/bmp',
+}
+DEFAULT_TYPES = {VIDEO: 'video/mp4', IMAGE: 'image/jpeg'}
+
+
+def _extension_type(url, types):
+    # Anywhere in the URL: CDN links carry the file name before a query string
+    url = (url or '').lower()
+    return next((mime for ext, mime in types.items() if ext in url), None)
+
+
+def classify(url, is_video=False, name='', content_type=None) -> dict:
+    """{'media_kind', 'mime_type'} for a URL.
+
+    `is_video` is what the uploader learned elsewhere and `content_type` what
+    the host said (or sniff() found) when the URL was validated; a video
+    extension or the name marker also make it a video.
+    """
+    content_type = (content_type or '').lower()
+    video_type = content_type if content_type.startswith('video/') else _extension_type(url, VIDEO_TYPES)
+    if is_video or video_type or VIDEO_MARKER in (name or ''):
+        return {'media_kind': VIDEO, 'mime_type': video_type or DEFAULT_TYPES[VIDEO]}
+    image_type = content_type if content_type.startswith('image/') else _extension_type(url, IMAGE_TYPES)
+    return {'media_kind': IMAGE, 'mime_type': image_type or DEFAULT_TYPES[IMAGE]}
+
+
+def slot_record(url, is_video=False, content_type=None) -> dict:
+    """An owner slot record for /customupload"""
+    fields = classify(url, is_video, content_type=content_type)
+    return {'url': url, 'type': fields['media_kind'], 'mime_type': fields['mime_type']}
+
+
+# ISO base media brands that are still images
+_IMAGE_BRANDS = {b'avif': 'image/avif', b'avis': 'image/avif', b'heic': 'image/heic',
+                 b'heix': 'image/heic', b'mif1': 'image/heic', b'msf1': 'image/heic'}
+
+
+def sniff(head: bytes):
+    """The MIME type a file's first bytes give away, for hosts that answer with
+    application/octet-stream or nothing at all. None if it isn't media."""
+    if head.startswith(b'\xff\xd8\xff'):
+        return 'image/jpeg'
+    if head.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'image/png'
+    if head[:6] in (b'GIF87a', b'GIF89a'):
+        return 'image/gif'
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'image/webp'
+    if head[:4] == b'RIFF' and head[8:12] == b'AVI ':
+        return 'video/x-msvideo'
+    if head[:2] == b'BM' and len(head) >= 14:
+        return 'image/bmp'
+    if head[4:8] == b'ftyp':
+        brand = head[8:12]
+        if brand in _IMAGE_BRANDS:
+            return _IMAGE_BRANDS[brand]
+        return 'video/quicktime' if brand == b'qt  ' else 'video/mp4'
+    if head.startswith(b'\x1a\x45\xdf\xa3'):
+        return 'video/webm' if b'webm' in head else 'video/x-matroska'
+    if head.startswith(b'FLV'):
+        return 'video/x-flv'
+    return None
+
+
+def character_fields(character) -> dict:
+    """The stored media fields for a catalogue document, as they should be"""
+    return classify(character.get('img_url'), character.get('media_kind') == VIDEO, character.get('name'))
+
+
+# ----- reading -----
+
+def _active_slot_ref(character, user_id):
+    """(path of the slot record in the document, raw record) for the active Custom slot"""
+    owner_slots = character.get('owner_slots') or {}
+    if user_id and str(user_id) in owner_slots:
+        slots = owner_slots[str(user_id)]
+        if isinstance(slots, dict):
+            active = str(slots.get('_active', 1))
+            if slots.get(active):
+                return f'owner_slots.{user_id}.{active}', slots[active]
+    if 'slots' in character:
+        # Shared slots from before owner_slots
+        active = str(character.get('active_slot', 1))
+        if (character['slots'] or {}).get(active):
+            return f'slots.{active}', character['slots'][active]
+    return None, None
+
+
+def active_slot(character, user_id=None):
+    """The owner's active Custom slot as {'url', 'type', 'mime_type'}, or None"""
+    slot = _active_slot_ref(character, user_id)[1]
+    if isinstance(slot, str):
+        slot = {'url': slot}
+    if not slot or not slot.get('url'):
+        return None
+    if 'type' not in slot or 'mime_type' not in slot:
+        slot = {**slot, **slot_record(slot['url'], slot.get('type') == VIDEO)}
+    return slot
+
+
+def display_url(character, user_id=None) -> str:
+    """The URL to show: the owner's active Custom slot, else the character's image"""
+    slot = active_slot(character, user_id)
+    return slot['url'] if slot else character.get('img_url', '')
+
+
+def _fields(character, user_id):
+    slot = active_slot(character, user_id)
+    if slot is not None:
+        kind, mime = slot['type'], slot['mime_type']
+    elif 'media_kind' in character and 'mime_type' in character:
+        kind, mime = character['media_kind'], character['mime_type']
+    else:
+        fields = character_fields(character)
+        kind, mime = fields['media_kind'], fields['mime_type']
+
+    if kind != VIDEO and VIDEO_MARKER in (character.get('name') or ''):
+        return VIDEO, DEFAULT_TYPES[VIDEO]
+    return kind, mime
+
+
+def is_video(character, user_id=None) -> bool:
+    return bool(character) and _fields(character, user_id)[0] == VIDEO
+
+
+def mime_type(character, user_id=None) -> str:
+    return _fields(character, user_id)[1]
+
+
+# ----- Telegram file_ids -----
+# The first send of a URL that Telegram accepts gives back a file_id for it.
+# It's kept next to the URL (`file_id` on the document or the slot record) and
+# sent instead, so Telegram stops downloading the URL again on every spawn.
+
+def file_id(character, user_id=None):
+    """The file_id to send for what display_url() would show, if known"""
+    slot = active_slot(character, user_id)
+    return (slot or character).get('file_id')
+
+
+def file_id_ref(character, user_id=None):
+    """(path to store a file_id at, {field: value} the stored URL must still match)"""
+    path, slot = _active_slot_ref(character, user_id)
+    if path is None:
+        return 'file_id', {'img_url': character.get('img_url')}
+    if not isinstance(slot, dict) or not slot.get('url'):
+        # Old string slot records have nowhere to keep one
+        return None, None
+    return f'{path}.file_id', {f'{path}.url': slot['url']}
+
+
+def sent_file_id(message, video):
+    """The file_id of what a send_photo/send_video (PTB or Pyrogram) delivered.
+
+    None when Telegram turned it into something else (a video sent as a photo
+    after a failure, a GIF that became an animation), so only a file_id that
+    can be resent the same way is kept.
+    """
+    if video:
+        sent = getattr(message, 'video', None)
+    else:
+        sent = getattr(message, 'photo', None)
+        if isinstance(sent, (list, tuple)):
+            # PTB lists every size, largest last
+            sent = sent[-1] if sent else None
+    return getattr(sent, 'file_id', None)
@@ -0,0 +1,99 @@
+import asyncio
+import time
+from collections import OrderedDict
+
+from pyrogram import enums
+from pyrogram.errors import UserNotParticipant, ChatAdminRequired, PeerIdInvalid
+
+from shivu import shivuu, LOGGER
+
+
+# Main group for membership checking
+MAIN_GROUP = "@CollectorOfficialGroup"
+
+MEMBER_TTL = 6 * 3600  # leaving is normally seen through chat_member updates
+NON_MEMBER_TTL = 60  # so a user who just joined isn't locked out for long
+MAX_USERS = 200000
+
+MEMBER_STATUSES = (
+    enums.ChatMemberStatus.MEMBER,
+    enums.ChatMemberStatus.ADMINISTRATOR,
+    enums.ChatMemberStatus.OWNER,
+)
+
+
+class MembershipCache:
+    """Who is in MAIN_GROUP, for the /harem gate.
+
+    Answers come from memory; a miss or an expired entry costs one
+    get_chat_member round trip, shared by concurrent checks of the same user.
+    chat_member updates for the group overwrite entries as people join and
+    leave. Lookup errors fail closed and aren't cached.
+    """
+
+    def __init__(self, max_users=MAX_USERS):
+        self.max_users = max_users
+        self._entries = OrderedDict()  # user_id -> (is_member, expires at)
+        self._pending = {}  # user_id -> lookup in flight
+        self.hits = 0
+        self.misses = 0
+
+    def set(self, user_id, is_member):
+        ttl = MEMBER_TTL if is_member else NON_MEMBER_TTL
+        self._entries[user_id] = (is_member, time.monotonic() + ttl)
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self.max_users:
+            self._entries.popitem(last=False)
+
+    def cached(self, user_id):
+        """True/False from memory, or None if unknown or expired"""
+        entry = self._entries.get(user_id)
+        if entry is None:
+            return None
+        is_member, expires = entry
+        if expires < time.monotonic():
+            del self._entries[user_id]
+            return None
+        return is_member
+
+    async def is_member(self, user_id) -> bool:
+        is_member = self.cached(user_id)
+        if is_member is not None:
+            self.hits += 1
+            return is_member
+
+        self.misses += 1
+        lookup = self._pending.get(user_id)
+        if lookup is None:
+            lookup = self._pending[user_id] = asyncio.ensure_future(self._lookup(user_id))
+            lookup.add_done_callback(lambda _: self._pending.pop(user_id, None))
+        return await asyncio.shield(lookup)
+
+    async def _lookup(self, user_id) -> bool:
+        try:
+            member = await shivuu.get_chat_member(MAIN_GROUP, user_id)
+            is_member = member.status in MEMBER_STATUSES
+        except (UserNotParticipant, ChatAdminRequired, PeerIdInvalid):
+            is_member = False
+        except Exception as e:
+            # Fail-closed: deny access on any unexpected error
+            LOGGER.error(f"Error checking group membership for user {user_id}: {e}")
+            return False
+        self.set(user_id, is_member)
+        return is_member
+
+    async def warm(self):
+        """Load the members Telegram lets a bot list (recent ones, for big groups)"""
+        count = 0
+        try:
+            async for member in shivuu.get_chat_members(MAIN_GROUP):
+                if member.user and member.status in MEMBER_STATUSES:
+                    self.set(member.user.id, True)
+                    count += 1
+        except Exception as e:
+            LOGGER.error(f"Failed to warm the membership cache: {e}")
+        LOGGER.info(f"Membership cache warmed with {count} members of {MAIN_GROUP}")
+        return count
+
+
+main_group_members = MembershipCache()
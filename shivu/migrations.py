@@ -0,0 +1,408 @@
+"""Versioned, resumable data migrations.
+
+Each migration walks the documents of one collection that still need it, in
+_id order and in batches. Every batch goes out as one unordered bulk_write,
+then the last _id is checkpointed in `migration_state`. An interrupted run
+continues from the checkpoint, and a pause between batches keeps a migration
+on the live database from starving the bot.
+
+    python -m shivu.migrations                  # list migrations and their state
+    python -m shivu.migrations run NAME [...]   # run (use "pending" for all of them)
+    python -m shivu.migrations dry NAME [...]   # count what a run would touch
+    python -m shivu.migrations reset NAME       # forget progress so it runs again
+"""
+import asyncio
+import inspect
+import sys
+from datetime import datetime, timezone
+
+from pymongo import UpdateOne
+
+from shivu import collection, user_collection, migration_state_collection, LOGGER
+from shivu import harem_store, media
+from shivu.spawn_pool import spawn_pool
+
+
+BATCH_SIZE = 200
+BATCH_PAUSE = 0.1  # seconds between batches
+REPORT_EVERY = 10  # batches between progress reports
+
+
+class Migration:
+    """One data reshape.
+
+    `query` selects the documents of `collection` that still need it;
+    `plan(doc)` (sync or async) returns the write operations for one of them,
+    an empty list or None to skip it. `after` runs once the migration is done.
+    `auto` migrations are started in the background on every boot.
+    """
+
+    def __init__(self, version, name, collection, query, plan, projection=None,
+                 batch_size=BATCH_SIZE, after=None, auto=False, description=''):
+        self.version = version
+        self.name = name
+        self.collection = collection
+        self.query = query
+        self.plan = plan
+        self.projection = projection
+        self.batch_size = batch_size
+        self.after = after
+        self.auto = auto
+        self.description = description
+
+
+class Progress:
+    __slots__ = ('name', 'dry_run', 'scanned', 'skipped', 'operations', 'modified', 'batches', 'done')
+
+    def __init__(self, name, dry_run=False, scanned=0, modified=0):
+        self.name = name
+        self.dry_run = dry_run
+        self.scanned = scanned
+        self.skipped = 0
+        self.operations = 0
+        self.modified = modified
+        self.batches = 0
+        self.done = False
+
+    def __str__(self):
+        if self.dry_run:
+            return (f"{self.name} (dry run): {self.scanned} documents to migrate, "
+                    f"{self.operations} writes, {self.skipped} skipped")
+        state = 'done' if self.done else 'running'
+        return (f"{self.name} {state}: {self.scanned} scanned, {self.modified} modified, "
+                f"{self.skipped} skipped")
+
+
+MIGRATIONS = []
+_running = set()
+
+
+def register(migration):
+    if any(m.name == migration.name or m.version == migration.version for m in MIGRATIONS):
+        raise ValueError(f"Duplicate migration {migration.version} {migration.name}")
+    MIGRATIONS.append(migration)
+    MIGRATIONS.sort(key=lambda m: m.version)
+    return migration
+
+
+def get(name):
+    return next((m for m in MIGRATIONS if m.name == name), None)
+
+
+async def state(migration) -> dict:
+    return await migration_state_collection.find_one({'_id': migration.name}) or {}
+
+
+async def pending():
+    """Migrations that haven't finished, in version order"""
+    return [m for m in MIGRATIONS if not (await state(m)).get('done')]
+
+
+async def reset(migration):
+    await migration_state_collection.delete_one({'_id': migration.name})
+
+
+async def _plan(migration, doc):
+    operations = migration.plan(doc)
+    if inspect.isawaitable(operations):
+        operations = await operations
+    if operations is None:
+        return []
+    if not isinstance(operations, list):
+        return [operations]
+    return operations
+
+
+async def _apply(migration, batch, progress):
+    plans = await asyncio.gather(*(_plan(migration, doc) for doc in batch))
+    operations = [op for ops in plans for op in ops]
+    progress.scanned += len(batch)
+    progress.skipped += sum(1 for ops in plans if not ops)
+    progress.operations += len(operations)
+    progress.batches += 1
+    if progress.dry_run:
+        return
+
+    if operations:
+        result = await migration.collection.bulk_write(operations, ordered=False)
+        progress.modified += result.modified_count
+    await migration_state_collection.update_one(
+        {'_id': migration.name},
+        {'$set': {
+            'version': migration.version,
+            'last_id': batch[-1]['_id'],
+            'scanned': progress.scanned,
+            'modified': progress.modified,
+            'updated_at': datetime.now(timezone.utc),
+        }},
+        upsert=True
+    )
+
+
+async def run(migration, dry_run=False, rerun=False, pause=BATCH_PAUSE, report=None,
+              report_every=REPORT_EVERY) -> Progress:
+    """Run (or with `dry_run`, count) a migration from its checkpoint.
+
+    A finished migration is a no-op unless `rerun`, which starts it over; its
+    query only matches what is still left, so that is safe.
+    `report(progress)` is awaited every `report_every` batches and at the end.
+    """
+    if migration.name in _running:
+        raise RuntimeError(f"Migration {migration.name} is already running")
+    _running.add(migration.name)
+    try:
+        saved = {} if dry_run else await state(migration)
+        if saved.get('done') and rerun:
+            await reset(migration)
+            saved = {}
+        progress = Progress(migration.name, dry_run, saved.get('scanned', 0), saved.get('modified', 0))
+        if saved.get('done'):
+            progress.done = True
+            return progress
+
+        query = dict(migration.query)
+        if saved.get('last_id') is not None:
+            query['_id'] = {'$gt': saved['last_id']}
+        cursor = migration.collection.find(query, migration.projection).sort('_id', 1)
+        cursor = cursor.batch_size(migration.batch_size)
+
+        batch = []
+        async for doc in cursor:
+            batch.append(doc)
+            if len(batch) < migration.batch_size:
+                continue
+            await _apply(migration, batch, progress)
+            batch = []
+            if report and progress.batches % report_every == 0:
+                await report(progress)
+            if pause:
+                await asyncio.sleep(pause)
+        if batch:
+            await _apply(migration, batch, progress)
+
+        if not dry_run:
+            await migration_state_collection.update_one(
+                {'_id': migration.name},
+                {'$set': {'version': migration.version, 'done': True, 'finished_at': datetime.now(timezone.utc)}},
+                upsert=True
+            )
+            if migration.after:
+                await migration.after()
+            LOGGER.info(f"Migration {progress}")
+        progress.done = True
+        if report:
+            await report(progress)
+        return progress
+    finally:
+        _running.discard(migration.name)
+
+
+async def run_migrations(message, names, dry_run=False, rerun=False):
+    """Run migrations one after another, keeping a status reply to `message` up to date (for admin commands)"""
+    lines = []
+    status = await message.reply_text(
+        f'<tg-emoji emoji-id="5103051253710063171">🔄</tg-emoji> Starting {", ".join(names)}...',
+        parse_mode='HTML'
+    )
+
+    async def report(progress):
+        try:
+            await status.edit_text('\n'.join(lines + [f'• {progress}']))
+        except Exception as e:
+            # Usually "message is not modified"
+            LOGGER.debug(f"Migration status not updated: {e}")
+
+    for name in names:
+        try:
+            progress = await run(get(name), dry_run=dry_run, rerun=rerun, report=report)
+        except Exception as e:
+            lines.append(f'• {name} stopped: {e}. Run it again to resume.')
+            await _report_final(status, lines)
+            return
+        lines.append(f'• {progress}')
+    await _report_final(status, lines)
+
+
+async def _report_final(status, lines):
+    await status.edit_text(
+        '<tg-emoji emoji-id="5103087490349139576">✅</tg-emoji> <b>Migrations</b>\n\n' + '\n'.join(lines),
+        parse_mode='HTML'
+    )
+
+
+async def _run_auto():
+    for migration in await pending():
+        if not migration.auto:
+            continue
+        try:
+            await run(migration)
+        except Exception as e:
+            LOGGER.error(f"Migration {migration.name} stopped, will resume on next start: {e}")
+
+
+_auto_task = None
+
+
+def start_auto():
+    """Run pending `auto` migrations in the background; restarts resume from their checkpoints"""
+    global _auto_task
+    if _auto_task is None or _auto_task.done():
+        _auto_task = asyncio.create_task(_run_auto())
+
+
+# ----- the migrations -----
+
+RENAMED_RARITIES = {'Celestial': 'Retro', 'Arcane': 'Zenith'}
+
+
+register(Migration(
+    1, 'catalogue_rarities', collection,
+    {'rarity': {'$in': list(RENAMED_RARITIES)}},
+    lambda character: UpdateOne(
+        {'_id': character['_id'], 'rarity': character['rarity']},
+        {'$set': {'rarity': RENAMED_RARITIES[character['rarity']]}}
+    ),
+    projection={'_id': 1, 'rarity': 1},
+    # Rarities moved under the spawn pool - rebuild it
+    after=spawn_pool.load,
+    description='Celestial → Retro, Arcane → Zenith in the catalogue',
+))
+
+
+register(Migration(
+    2, 'harem_rarities', user_collection,
+    {f'{harem_store.LEGACY_FIELD}.rarity': {'$in': list(RENAMED_RARITIES)}},
+    lambda user: UpdateOne(
+        {'_id': user['_id']},
+        {'$set': {
+            f'{harem_store.LEGACY_FIELD}.$[{old.lower()}].rarity': new
+            for old, new in RENAMED_RARITIES.items()
+        }},
+        array_filters=[{f'{old.lower()}.rarity': old} for old in RENAMED_RARITIES]
+    ),
+    projection={'_id': 1},
+    description='The same rename in character copies still embedded in harems',
+))
+
+
+async def _owner_slots(character):
+    """Give the first two owners of an old-style Custom card its shared slots"""
+    char_id = character.get('id')
+    char_id_str = str(char_id)
+    char_id_int = int(char_id) if isinstance(char_id, str) and char_id.isdigit() else char_id
+
+    # Owners may have the id stored as a string or an int
+    owners = await user_collection.find(harem_store.owned_query(char_id_str), {'id': 1}).to_list(None)
+    if not owners:
+        owners = await user_collection.find(harem_store.owned_query(char_id_int), {'id': 1}).to_list(None)
+    owner_ids = list(dict.fromkeys(str(user.get('id')) for user in owners))
+    if not owner_ids:
+        # Skipped until the card is in someone's harem
+        return None
+
+    old_slots = character.get('slots', {})
+    owner_slots = {
+        owner_id: {'1': old_slots.get('1'), '2': old_slots.get('2'), '3': old_slots.get('3'), '_active': 1}
+        for owner_id in owner_ids[:2]
+    }
+    return UpdateOne(
+        {'_id': character['_id']},
+        {'$set': {'owner_slots': owner_slots}, '$unset': {'slots': '', 'active_slot': ''}}
+    )
+
+
+register(Migration(
+    3, 'custom_owner_slots', collection,
+    {'rarity': 'Custom', 'slots': {'$exists': True}},
+    _owner_slots,
+    projection={'_id': 1, 'id': 1, 'slots': 1},
+    description='Shared Custom card slots → per-owner slots',
+))
+
+
+register(Migration(
+    4, 'harem_char_counts', user_collection,
+    {f'{harem_store.LEGACY_FIELD}.0': {'$exists': True}},
+    harem_store.migration_update,
+    projection={'_id': 1, harem_store.LEGACY_FIELD: 1},
+    batch_size=100,
+    auto=True,
+    description='Embedded character copies → {id: copies} counts',
+))
+
+
+def _media_fields(character):
+    """Stored media kind / MIME type for a character and its owner slot records"""
+    fields = {}
+    if 'media_kind' not in character or 'mime_type' not in character:
+        fields.update(media.character_fields(character))
+    for owner_id, slots in (character.get('owner_slots') or {}).items():
+        if not isinstance(slots, dict):
+            continue
+        for slot, record in slots.items():
+            if slot == '_active' or not record:
+                continue
+            if isinstance(record, str):
+                record = {'url': record}
+            if record.get('url') and ('type' not in record or 'mime_type' not in record):
+                fields[f'owner_slots.{owner_id}.{slot}'] = media.slot_record(
+                    record['url'], record.get('type') == media.VIDEO
+                )
+    if not fields:
+        return None
+    return UpdateOne({'_id': character['_id']}, {'$set': fields})
+
+
+register(Migration(
+    5, 'media_kind', collection,
+    {'$or': [
+        {'media_kind': {'$exists': False}},
+        {'mime_type': {'$exists': False}},
+        # Slot records are keyed by owner, so these are checked one by one
+        {'owner_slots': {'$exists': True}},
+    ]},
+    _media_fields,
+    projection={'_id': 1, 'img_url': 1, 'name': 1, 'media_kind': 1, 'mime_type': 1, 'owner_slots': 1},
+    # The spawn pool holds the catalogue - reload it with the new fields
+    after=spawn_pool.load,
+    auto=True,
+    description='Store media kind and MIME type on characters and Custom slots',
+))
+
+
+# ----- command line -----
+
+async def _cli(args):
+    if not args:
+        for migration in MIGRATIONS:
+            saved = await state(migration)
+            status = 'done' if saved.get('done') else f"at {saved['scanned']} documents" if saved else 'pending'
+            print(f"{migration.version:>3}  {migration.name:<22} {status:<20} {migration.description}")
+        return 0
+
+    command, names = args[0], args[1:]
+    if command not in ('run', 'dry', 'reset') or not names:
+        print(__doc__, file=sys.stderr)
+        return 2
+    if names == ['pending']:
+        selected = await pending()
+    else:
+        selected = [get(name) for name in names]
+        if None in selected:
+            print(f"Unknown migration; known: {', '.join(m.name for m in MIGRATIONS)}", file=sys.stderr)
+            return 2
+
+    async def report(progress):
+        print(progress)
+
+    for migration in selected:
+        if command == 'reset':
+            await reset(migration)
+            print(f"{migration.name}: progress forgotten")
+        else:
+            await run(migration, dry_run=command == 'dry', report=report)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(asyncio.run(_cli(sys.argv[1:])))
@@ -5,8 +5,12 @@ from telegram.ext import CommandHandler, CallbackQueryHandler, CallbackContext
 import math
 import asyncio
 
-from shivu import collection, locked_spawns_collection, shivuu, application, user_collection, group_user_totals_collection, banned_users_collection, OWNER_ID
+from shivu import locked_spawns_collection, shivuu, application, user_collection, group_user_totals_collection, banned_users_collection, OWNER_ID
 from shivu.config import Config
+from shivu.spawn_pool import spawn_pool
+from shivu.catalogue import catalogue
+from shivu.ban_registry import ban_registry
+from shivu import users
 from datetime import datetime, timedelta, timezone
 
 @shivuu.on_message(filters.command("lockspawn"))
@@ -33,7 +37,7 @@ async def lockspawn(client, message):
     character_id = message.command[1]
     
     # Check if character exists
-    character = await collection.find_one({'id': character_id})
+    character = await catalogue.get(character_id)
     if not character:
         await message.reply_text(f"<tg-emoji emoji-id='5102962128843704400'>❌</tg-emoji> Character with ID <code>{character_id}</code> not found!",
                 parse_mode='HTML')
@@ -61,6 +65,7 @@ async def lockspawn(client, message):
         'locked_by': sender_id,
         'locked_by_username': message.from_user.username or message.from_user.first_name
     })
+    spawn_pool.lock(character_id)
     
     rarity_emojis = {
         "Common": "<tg-emoji emoji-id='5102863490624784495'>⚪️</tg-emoji>",
@@ -119,6 +124,7 @@ async def unlockspawn(client, message):
     
     # Unlock the character
     await locked_spawns_collection.delete_one({'character_id': character_id})
+    spawn_pool.unlock(character_id)
     
     await message.reply_text(
         f"<tg-emoji emoji-id='5103032978624219059'>🔓</tg-emoji> <b>Spawn Unlocked!</b>\n\n"
@@ -324,7 +330,7 @@ async def lockspawn_ptb(update: Update, context: CallbackContext):
     
     character_id = context.args[0]
     
-    character = await collection.find_one({'id': character_id})
+    character = await catalogue.get(character_id)
     if not character:
         await update.message.reply_text(f"<tg-emoji emoji-id='5102962128843704400'>❌</tg-emoji> Character with ID <code>{character_id}</code> not found!",
                 parse_mode='HTML')
@@ -350,6 +356,7 @@ async def lockspawn_ptb(update: Update, context: CallbackContext):
         'locked_by': sender_id,
         'locked_by_username': update.effective_user.username or update.effective_user.first_name
     })
+    spawn_pool.lock(character_id)
     
     rarity_emojis = {
         "Common": "<tg-emoji emoji-id='5102863490624784495'>⚪️</tg-emoji>", "Uncommon": "<tg-emoji emoji-id='5102906715175651186'>🟢</tg-emoji>", "Rare": "<tg-emoji emoji-id='5102814377673754670'>🔵</tg-emoji>", "Epic": "<tg-emoji emoji-id='5103060513659554158'>🟣</tg-emoji>",
@@ -398,6 +405,7 @@ async def unlockspawn_ptb(update: Update, context: CallbackContext):
         return
     
     await locked_spawns_collection.delete_one({'character_id': character_id})
+    spawn_pool.unlock(character_id)
     
     await update.message.reply_text(
         f"<tg-emoji emoji-id='5103032978624219059'>🔓</tg-emoji> <b>Spawn Unlocked!</b>\n\n"
@@ -615,7 +623,7 @@ async def broadcast(client, message):
     failed_groups = 0
     
     if send_to_users:
-        all_users = await user_collection.find({}).to_list(length=None)
+        all_users = await user_collection.find({}, {'_id': 0, 'id': 1}).to_list(length=None)
         total_users = len(all_users)
         
         for i, user in enumerate(all_users):
@@ -753,7 +761,7 @@ async def broadcast_ptb(update: Update, context: CallbackContext) -> None:
     failed_groups = 0
     
     if send_to_users:
-        all_users = await user_collection.find({}).to_list(length=None)
+        all_users = await user_collection.find({}, {'_id': 0, 'id': 1}).to_list(length=None)
         total_users = len(all_users)
         
         for i, user in enumerate(all_users):
@@ -877,10 +885,9 @@ async def bonk(client, message):
                 parse_mode='HTML')
         return
     
-    existing_ban = await banned_users_collection.find_one({'user_id': target_id})
-    if existing_ban:
-        unban_date = existing_ban.get('unban_date')
-        remaining = unban_date - datetime.now(timezone.utc)
+    await ban_registry.ensure_loaded()
+    remaining = ban_registry.remaining(target_id)
+    if remaining is not None:
         days = remaining.days
         await message.reply_text(
             f"<tg-emoji emoji-id='5102920111178647010'>⚠️</tg-emoji> User is already bonked!\n"
@@ -899,6 +906,7 @@ async def bonk(client, message):
         'unban_date': unban_date,
         'reason': 'Spamming'
     })
+    ban_registry.ban(target_id, unban_date)
     
     target_name = target_user.first_name if target_user else str(target_id)
     
@@ -946,13 +954,14 @@ async def unbonk(client, message):
         )
         return
     
-    existing_ban = await banned_users_collection.find_one({'user_id': target_id})
-    if not existing_ban:
+    await ban_registry.ensure_loaded()
+    if ban_registry.unban_date(target_id) is None:
         await message.reply_text("<tg-emoji emoji-id='5102962128843704400'>❌</tg-emoji> This user is not bonked!",
                 parse_mode='HTML')
         return
     
     await banned_users_collection.delete_one({'user_id': target_id})
+    ban_registry.unban(target_id)
     
     target_name = target_user.first_name if target_user else str(target_id)
     
@@ -1002,10 +1011,9 @@ async def bonk_ptb(update: Update, context: CallbackContext) -> None:
                 parse_mode='HTML')
         return
     
-    existing_ban = await banned_users_collection.find_one({'user_id': target_id})
-    if existing_ban:
-        unban_date = existing_ban.get('unban_date')
-        remaining = unban_date - datetime.now(timezone.utc)
+    await ban_registry.ensure_loaded()
+    remaining = ban_registry.remaining(target_id)
+    if remaining is not None:
         days = remaining.days
         await update.message.reply_text(
             f"<tg-emoji emoji-id='5102920111178647010'>⚠️</tg-emoji> User is already bonked!\n"
@@ -1024,6 +1032,7 @@ async def bonk_ptb(update: Update, context: CallbackContext) -> None:
         'unban_date': unban_date,
         'reason': 'Spamming'
     })
+    ban_registry.ban(target_id, unban_date)
     
     target_name = target_user.first_name if target_user else str(target_id)
     
@@ -1070,13 +1079,14 @@ async def unbonk_ptb(update: Update, context: CallbackContext) -> None:
         )
         return
     
-    existing_ban = await banned_users_collection.find_one({'user_id': target_id})
-    if not existing_ban:
+    await ban_registry.ensure_loaded()
+    if ban_registry.unban_date(target_id) is None:
         await update.message.reply_text("<tg-emoji emoji-id='5102962128843704400'>❌</tg-emoji> This user is not bonked!",
                 parse_mode='HTML')
         return
     
     await banned_users_collection.delete_one({'user_id': target_id})
+    ban_registry.unban(target_id)
     
     target_name = target_user.first_name if target_user else str(target_id)
     
@@ -1091,13 +1101,9 @@ async def unbonk_ptb(update: Update, context: CallbackContext) -> None:
 # Helper function to check if user is banned
 async def check_ban(user_id: int):
     """Check if a user is banned and return ban info if so"""
-    ban = await banned_users_collection.find_one({'user_id': user_id})
-    if ban:
-        unban_date = ban.get('unban_date')
-        if datetime.now(timezone.utc) >= unban_date:
-            await banned_users_collection.delete_one({'user_id': user_id})
-            return None
-        remaining = unban_date - datetime.now(timezone.utc)
+    await ban_registry.ensure_loaded()
+    remaining = ban_registry.remaining(user_id)
+    if remaining is not None:
         days = remaining.days
         hours = remaining.seconds // 3600
         return {'banned': True, 'days': days, 'hours': hours}
@@ -1140,8 +1146,7 @@ async def resetm(client, message):
         )
         return
     
-    user = await user_collection.find_one({'id': target_id})
-    if not user:
+    if not await users.exists(target_id):
         await message.reply_text(f"<tg-emoji emoji-id='5102962128843704400'>❌</tg-emoji> User ID <code>{target_id}</code> not found in database!",
                 parse_mode='HTML')
         return
@@ -1195,8 +1200,7 @@ async def resetm_ptb(update: Update, context: CallbackContext) -> None:
         )
         return
     
-    user = await user_collection.find_one({'id': target_id})
-    if not user:
+    if not await users.exists(target_id):
         await update.message.reply_text(f"<tg-emoji emoji-id='5102962128843704400'>❌</tg-emoji> User ID <code>{target_id}</code> not found in database!",
                 parse_mode='HTML')
         return
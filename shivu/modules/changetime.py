@@ -1,6 +1,8 @@
 from pymongo import  ReturnDocument
 from pyrogram.enums import ChatMemberStatus, ChatType
 from shivu import user_totals_collection, shivuu, sudo_users, application
+from shivu.chat_settings import chat_settings
+from shivu.spam_guard import SpamPolicy, DEFAULT_POLICY, MAX_SPAM_LIMIT
 from pyrogram import Client, filters
 from pyrogram.types import Message
 from telegram import Update
@@ -38,6 +40,7 @@ async def change_time_pyrogram(client: Client, message: Message):
             upsert=True,
             return_document=ReturnDocument.AFTER
         )
+        chat_settings.set_frequency(chat_id, new_frequency)
 
         await message.reply_text(f'Successfully changed {new_frequency}')
     except Exception as e:
@@ -72,6 +75,7 @@ async def change_time(update: Update, context: CallbackContext):
             upsert=True,
             return_document=ReturnDocument.AFTER
         )
+        chat_settings.set_frequency(chat_id, new_frequency)
         
         await update.message.reply_text(f'Successfully changed to {new_frequency} messages')
     except ValueError:
@@ -80,5 +84,63 @@ async def change_time(update: Update, context: CallbackContext):
         await update.message.reply_text(f'Failed to change: {str(e)}')
 
 
+async def spam_config(update: Update, context: CallbackContext):
+    """Show or change this chat's spam policy: /spamconfig LIMIT WINDOW_SECONDS BLOCK_MINUTES | reset"""
+    user_id = update.effective_user.id
+    chat_id = update.effective_chat.id
+
+    if str(user_id) not in sudo_users:
+        await update.message.reply_text('<tg-emoji emoji-id="5102920111178647010">🚫</tg-emoji> This command is only available to bot administrators.',
+                parse_mode='HTML')
+        return
+
+    args = context.args or []
+    try:
+        if not args:
+            policy = chat_settings.spam_policy(chat_id)
+            await update.message.reply_text(
+                f'<b>Spam policy for this chat</b>\n\n'
+                f'More than {policy.limit} messages in {policy.window}s blocks for {round(policy.block_duration / 60)} minutes.\n\n'
+                f'Change it with: <code>/spamconfig LIMIT WINDOW_SECONDS BLOCK_MINUTES</code>\n'
+                f'Back to default: <code>/spamconfig reset</code>',
+                parse_mode='HTML'
+            )
+            return
+
+        if len(args) == 1 and args[0].lower() == 'reset':
+            await user_totals_collection.update_one(
+                {'chat_id': str(chat_id)},
+                {'$unset': {'spam_limit': '', 'spam_window': '', 'spam_block': ''}}
+            )
+            chat_settings.set_spam_policy(chat_id, None)
+            await update.message.reply_text(
+                f'Spam policy reset to default ({DEFAULT_POLICY.limit} messages / {DEFAULT_POLICY.window}s)')
+            return
+
+        if len(args) != 3:
+            await update.message.reply_text('Please use: /spamconfig LIMIT WINDOW_SECONDS BLOCK_MINUTES')
+            return
+
+        policy = SpamPolicy(int(args[0]), int(args[1]), int(args[2]) * 60)
+    except ValueError:
+        await update.message.reply_text(
+            f'Please provide valid numbers (limit 1-{MAX_SPAM_LIMIT}, window and block above 0)')
+        return
+
+    try:
+        await user_totals_collection.update_one(
+            {'chat_id': str(chat_id)},
+            {'$set': {'spam_limit': policy.limit, 'spam_window': policy.window, 'spam_block': policy.block_duration}},
+            upsert=True
+        )
+        chat_settings.set_spam_policy(chat_id, policy)
+        await update.message.reply_text(
+            f'Successfully changed: more than {policy.limit} messages in {policy.window}s '
+            f'blocks for {args[2]} minutes')
+    except Exception as e:
+        await update.message.reply_text(f'Failed to change: {str(e)}')
+
+
 # Register the handler
 application.add_handler(CommandHandler("changetime", change_time, block=False))
+application.add_handler(CommandHandler("spamconfig", spam_config, block=False))
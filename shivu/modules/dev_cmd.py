@@ -0,0 +1,69 @@
+from telegram import Update
+from telegram.ext import CommandHandler, CallbackContext
+
+from shivu import application, sudo_users
+from shivu.chat_state import chat_state
+from shivu.membership import main_group_members
+from shivu.url_validator import url_validator
+from shivu import migrations
+
+
+async def memstats(update: Update, context: CallbackContext) -> None:
+    """Show how much per-chat/per-user state the bot is holding"""
+    if str(update.effective_user.id) not in sudo_users:
+        await update.message.reply_text('<tg-emoji emoji-id="5102920111178647010">🚫</tg-emoji> This command is only available to bot administrators.',
+                parse_mode='HTML')
+        return
+
+    stats = chat_state.stats()
+    await update.message.reply_text(
+        f'<tg-emoji emoji-id="5102802918701008521">📊</tg-emoji> <b>In-memory state</b>\n\n'
+        f'• Chats: {stats["chats"]} ({stats["pending_spawns"]} unclaimed spawns)\n'
+        f'• Users: {stats["users"]} ({stats["blocked_users"]} blocked)\n'
+        f'• Evicted: {stats["evicted_chats"]} chats, {stats["evicted_users"]} users\n'
+        f'• Approx. size: {stats["approx_bytes"] / 1024:.1f} KiB\n'
+        f'• Membership cache: {len(main_group_members._entries)} users, '
+        f'{main_group_members.hits} hits / {main_group_members.misses} misses\n'
+        f'• URL validations: {len(url_validator._valid)} valid / {len(url_validator._invalid)} failed cached, '
+        f'{url_validator.hits} hits / {url_validator.misses} misses',
+        parse_mode='HTML'
+    )
+
+
+async def migrate(update: Update, context: CallbackContext) -> None:
+    """/migrate [dry|reset] [name ...] - list, run, dry-run or reset data migrations"""
+    if str(update.effective_user.id) not in sudo_users:
+        await update.message.reply_text('<tg-emoji emoji-id="5102920111178647010">🚫</tg-emoji> This command is only available to bot administrators.',
+                parse_mode='HTML')
+        return
+
+    args = list(context.args)
+    mode = args.pop(0) if args and args[0] in ('dry', 'reset') else 'run'
+    if not args:
+        lines = []
+        for migration in migrations.MIGRATIONS:
+            saved = await migrations.state(migration)
+            status = 'done' if saved.get('done') else f"at {saved['scanned']}" if saved else 'pending'
+            lines.append(f'{migration.version}. <code>{migration.name}</code> - {status}\n    <i>{migration.description}</i>')
+        await update.message.reply_text(
+            '<tg-emoji emoji-id="5102802918701008521">📊</tg-emoji> <b>Migrations</b>\n\n' + '\n'.join(lines) +
+            '\n\nUsage: <code>/migrate [dry|reset] name ...</code>',
+            parse_mode='HTML'
+        )
+        return
+
+    unknown = [name for name in args if migrations.get(name) is None]
+    if unknown:
+        await update.message.reply_text(f'Unknown migration: {", ".join(unknown)}')
+        return
+
+    if mode == 'reset':
+        for name in args:
+            await migrations.reset(migrations.get(name))
+        await update.message.reply_text(f'Progress of {", ".join(args)} forgotten.')
+        return
+    await migrations.run_migrations(update.message, args, dry_run=mode == 'dry')
+
+
+application.add_handler(CommandHandler("memstats", memstats, block=False))
+application.add_handler(CommandHandler("migrate", migrate, block=False))
@@ -1,6 +1,7 @@
 from telegram import Update
 from telegram.ext import CommandHandler, CallbackContext
 from shivu import application, sudo_users, event_settings_collection, collection
+from shivu.chat_settings import chat_settings
 from datetime import datetime, timezone
 
 async def startevent(update: Update, context: CallbackContext) -> None:
@@ -48,6 +49,7 @@ async def startevent(update: Update, context: CallbackContext) -> None:
         }
         
         await event_settings_collection.insert_one(event_data)
+        chat_settings.set_event(event_data)
         
         await update.message.reply_text(
             '<tg-emoji emoji-id="5103065598900831870">🎄</tg-emoji><tg-emoji emoji-id="5102638339849192814">✨</tg-emoji> <b>CHRISTMAS EVENT STARTED!</b> <tg-emoji emoji-id="5102638339849192814">✨</tg-emoji><tg-emoji emoji-id="5103065598900831870">🎄</tg-emoji>\n\n'
@@ -96,6 +98,7 @@ async def endevent(update: Update, context: CallbackContext) -> None:
                 'ended_by_name': update.effective_user.first_name
             }}
         )
+        chat_settings.set_event(None)
         
         event_type = active_event.get('event_type', 'unknown')
         
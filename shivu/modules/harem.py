@@ -1,21 +1,18 @@
 from telegram import Update
 from itertools import groupby
 from collections import Counter, defaultdict
-import math
 from html import escape
 import random
 
-from telegram.ext import CommandHandler, CallbackContext, CallbackQueryHandler
-from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.ext import CommandHandler, CallbackContext, CallbackQueryHandler, ChatMemberHandler
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup, ChatMember
 from pyrogram import filters, enums
 from pyrogram.types import (
     InlineKeyboardButton as PyroInlineKeyboardButton,
     InlineKeyboardMarkup as PyroInlineKeyboardMarkup,
 )
-from pyrogram.errors import UserNotParticipant, ChatAdminRequired, PeerIdInvalid
 
 from shivu import (
-    collection,
     user_collection,
     application,
     SUPPORT_CHAT,
@@ -24,142 +21,37 @@ from shivu import (
     sudo_users,
 )
 from shivu.config import Config
+from shivu import harem_store, media, users
+from shivu.spawn_pool import spawn_pool
+from shivu.catalogue import catalogue
+from shivu.harem_views import harem_views, harem_page
+from shivu.membership import main_group_members, MAIN_GROUP
 
 
 async def get_character_display_url(character, char_id=None, user_id=None):
     """Get the correct URL to display for a character, respecting owner-specific slots"""
-    user_id_str = str(user_id) if user_id else None
-
     # Always fetch fresh data if char_id is provided to check for custom slots
     if char_id:
-        fresh_char = await collection.find_one({"id": char_id})
-        if fresh_char:
-            # Try owner_slots first (for Custom characters)
-            if (
-                "owner_slots" in fresh_char
-                and user_id_str
-                and user_id_str in fresh_char["owner_slots"]
-            ):
-                owner_slot_data = fresh_char["owner_slots"][user_id_str]
-                if isinstance(owner_slot_data, dict):
-                    active_slot = owner_slot_data.get("_active", 1)
-                    slot_data = owner_slot_data.get(str(active_slot))
-                    if slot_data:
-                        # Handle dict format with 'url' key
-                        if isinstance(slot_data, dict) and "url" in slot_data:
-                            return slot_data["url"]
-                        # Handle old string format
-                        elif isinstance(slot_data, str):
-                            return slot_data
-            # Fallback to old 'slots' format if available
-            if "slots" in fresh_char:
-                active_slot = fresh_char.get("active_slot", 1)
-                slot_data = fresh_char["slots"].get(str(active_slot))
-                if slot_data:
-                    if isinstance(slot_data, dict) and "url" in slot_data:
-                        return slot_data["url"]
-                    elif isinstance(slot_data, str):
-                        return slot_data
-            # Return fresh_char's img_url if custom slots not found
-            return fresh_char.get("img_url", "")
-
-    # Fallback to character object's data
-    if character.get("rarity") == "Custom":
-        # Try owner_slots first
-        if (
-            "owner_slots" in character
-            and user_id_str
-            and user_id_str in character["owner_slots"]
-        ):
-            owner_slot_data = character["owner_slots"][user_id_str]
-            if isinstance(owner_slot_data, dict):
-                active_slot = owner_slot_data.get("_active", 1)
-                slot_data = owner_slot_data.get(str(active_slot))
-                if slot_data:
-                    if isinstance(slot_data, dict) and "url" in slot_data:
-                        return slot_data["url"]
-                    elif isinstance(slot_data, str):
-                        return slot_data
-        # Fallback to old 'slots' format if available
-        if "slots" in character:
-            active_slot = character.get("active_slot", 1)
-            slot_data = character["slots"].get(str(active_slot))
-            if slot_data:
-                if isinstance(slot_data, dict) and "url" in slot_data:
-                    return slot_data["url"]
-                elif isinstance(slot_data, str):
-                    return slot_data
-
-    return character.get("img_url", "")
-
-
-def is_video_url(url):
-    """Check if a URL points to a video file"""
-    if not url:
-        return False
-    return any(
-        ext in url.lower() for ext in [".mp4", ".mov", ".avi", ".mkv", ".webm", ".flv"]
-    )
-
-
-async def is_video_character(character, char_id=None, user_id=None):
-    """Check if a character is a video by URL extension, metadata type, or name marker"""
-    if not character:
-        return False
-
-    # For custom characters, also check the 'type' field in slot metadata
-    user_id_str = str(user_id) if user_id else None
-    if char_id and character.get("rarity") == "Custom":
-        fresh_char = await collection.find_one({"id": char_id})
+        fresh_char = await catalogue.get(char_id)
         if fresh_char:
-            # Check owner_slots metadata
-            if (
-                "owner_slots" in fresh_char
-                and user_id_str
-                and user_id_str in fresh_char["owner_slots"]
-            ):
-                owner_slot_data = fresh_char["owner_slots"][user_id_str]
-                if isinstance(owner_slot_data, dict):
-                    active_slot = owner_slot_data.get("_active", 1)
-                    slot_data = owner_slot_data.get(str(active_slot))
-                    if isinstance(slot_data, dict) and slot_data.get("type") == "video":
-                        return True
-
-    # Get the correct display URL (respecting active_slot for custom characters)
-    url = await get_character_display_url(character, char_id, user_id)
-    if is_video_url(url):
-        return True
-
-    # Check for 🎬 emoji marker in name
-    name = character.get("name", "")
-    if "🎬" in name:
-        return True
-
-    return False
-
-
-# Main group for membership checking
-MAIN_GROUP = "@CollectorOfficialGroup"
+            return media.display_url(fresh_char, user_id)
+    return media.display_url(character, user_id)
 
 
 async def check_group_membership(user_id: int) -> bool:
     """Check if user is a member of the main group"""
-    try:
-        member = await shivuu.get_chat_member(MAIN_GROUP, user_id)
-        # Check if user is member, admin, or creator
-        return member.status in [
-            enums.ChatMemberStatus.MEMBER,
-            enums.ChatMemberStatus.ADMINISTRATOR,
-            enums.ChatMemberStatus.OWNER,
-        ]
-    except (UserNotParticipant, ChatAdminRequired, PeerIdInvalid):
-        return False
-    except Exception as e:
-        # Fail-closed: deny access on any unexpected error
-        from shivu import LOGGER
+    return await main_group_members.is_member(user_id)
 
-        LOGGER.error(f"Error checking group membership for user {user_id}: {e}")
-        return False
+
+async def track_main_group_member(update: Update, context: CallbackContext) -> None:
+    """Keep the membership cache current as people join and leave the main group"""
+    change = update.chat_member
+    if not change or (change.chat.username or "").lower() != MAIN_GROUP.lstrip("@").lower():
+        return
+    member = change.new_chat_member
+    main_group_members.set(
+        member.user.id, member.status in (ChatMember.MEMBER, ChatMember.ADMINISTRATOR, ChatMember.OWNER)
+    )
 
 
 async def sorts(update: Update, context: CallbackContext) -> None:
@@ -197,6 +89,7 @@ async def sorts(update: Update, context: CallbackContext) -> None:
             {"$unset": {"sort_preference": "", "filter_type": "", "filter_value": ""}},
             upsert=True,
         )
+        harem_views.invalidate(user_id)
         await update.message.reply_text(
             "<tg-emoji emoji-id='5103087490349139576'>✅</tg-emoji> Harem filters and sorting have been reset!\n\n"
             "Your /harem will now show all characters sorted by anime. <tg-emoji emoji-id='5102882435725527517'>📋</tg-emoji>",
@@ -262,6 +155,7 @@ async def sorts(update: Update, context: CallbackContext) -> None:
             },
             upsert=True,
         )
+        harem_views.invalidate(user_id)
 
         await update.message.reply_text(
             f"<tg-emoji emoji-id='5103087490349139576'>✅</tg-emoji> Harem filter set to <b>{rarity_filter}</b> rarity only!\n\n"
@@ -281,8 +175,8 @@ async def sorts(update: Update, context: CallbackContext) -> None:
         character_filter = " ".join(args[1:]).title()
 
         # Check if user has this character
-        user = await user_collection.find_one({"id": user_id})
-        if not user or not user.get("characters"):
+        user = await users.get_harem(user_id)
+        if not harem_store.has_characters(user):
             await update.message.reply_text(
                 "<tg-emoji emoji-id='5102962128843704400'>❌</tg-emoji> You don't have any characters yet!",
                 parse_mode="HTML",
@@ -290,9 +184,10 @@ async def sorts(update: Update, context: CallbackContext) -> None:
             return
 
         # Check if character exists in user's collection (partial match)
+        owned = await harem_store.catalogue_documents(harem_store.owned_counts(user))
         character_exists = any(
             character_filter.lower() in char["name"].lower()
-            for char in user["characters"]
+            for char in owned.values()
         )
         if not character_exists:
             await update.message.reply_text(
@@ -313,6 +208,7 @@ async def sorts(update: Update, context: CallbackContext) -> None:
             },
             upsert=True,
         )
+        harem_views.invalidate(user_id)
 
         await update.message.reply_text(
             f"<tg-emoji emoji-id='5103087490349139576'>✅</tg-emoji> Harem filter set to <b>{character_filter}</b> character only!\n\n"
@@ -330,6 +226,7 @@ async def sorts(update: Update, context: CallbackContext) -> None:
             },
             upsert=True,
         )
+        harem_views.invalidate(user_id)
 
         await update.message.reply_text(
             f"<tg-emoji emoji-id='5103087490349139576'>✅</tg-emoji> Harem sorting set to <b>{sort_type}</b>!\n\n"
@@ -351,6 +248,54 @@ async def sorts(update: Update, context: CallbackContext) -> None:
         return
 
 
+def render_harem_page(view, page) -> str:
+    """Body of one /harem page: the page's characters grouped by anime"""
+    body = ""
+
+    # Group characters by anime properly regardless of sort order
+    current_grouped_characters = defaultdict(list)
+    for character in view.page(page):
+        current_grouped_characters[character["anime"]].append(character)
+
+    for anime, characters in current_grouped_characters.items():
+        # Catalogue size of the anime, from the resident pool
+        anime_total = spawn_pool.anime_count(anime)
+
+        # Stylish anime header with count
+        body += f"\n✢ {anime} 「 {len(characters)}/{anime_total} 」\n"
+        body += "⚋⚋⚋⚋⚋⚋⚋⚋⚋⚋⚋⚋⚋⚋⚋\n"
+
+        for character in characters:
+            # Add rarity emoji to make it more beautiful
+            rarity_emojis = {
+                "Common": "<tg-emoji emoji-id='5102863490624784495'>⚪️</tg-emoji>",
+                "Uncommon": "<tg-emoji emoji-id='5102906715175651186'>🟢</tg-emoji>",
+                "Rare": "<tg-emoji emoji-id='5102814377673754670'>🔵</tg-emoji>",
+                "Epic": "<tg-emoji emoji-id='5103060513659554158'>🟣</tg-emoji>",
+                "Legendary": "<tg-emoji emoji-id='5102990767685634240'>🟡</tg-emoji>",
+                "Mythic": "<tg-emoji emoji-id='5102655962100008917'>🏵</tg-emoji>",
+                "Retro": "<tg-emoji emoji-id='5102698301887612539'>🍥</tg-emoji>",
+                "Star": "<tg-emoji emoji-id='5102825501639050967'>⭐</tg-emoji>",
+                "Zenith": "<tg-emoji emoji-id='5103065238123578838'>🪩</tg-emoji>",
+                "Limited Edition": "<tg-emoji emoji-id='5103127253156367234'>🍬</tg-emoji>",
+            }
+            rarity_emoji = rarity_emojis.get(
+                character.get("rarity", "Common"),
+                "<tg-emoji emoji-id='5102638339849192814'>✨</tg-emoji>",
+            )
+            count = view.counts.get(character["id"], 0)
+
+            # Stylish character entry format
+            body += (
+                f"➥ {character['id']}〔{rarity_emoji} 〕{character['name']} x{count}\n"
+            )
+
+        # Add separator after each anime section
+        body += "⚋⚋⚋⚋⚋⚋⚋⚋⚋⚋⚋⚋⚋⚋⚋\n"
+
+    return body
+
+
 async def harem(update: Update, context: CallbackContext, page=0) -> None:
     if not update.effective_user:
         return
@@ -398,8 +343,8 @@ async def harem(update: Update, context: CallbackContext, page=0) -> None:
                 )
             return
 
-    user = await user_collection.find_one({"id": user_id})
-    if not user:
+    view = await harem_page(user_id, page)
+    if not view:
         if update.message:
             await update.message.reply_text("You Have Not Guessed any Characters Yet..")
         elif update.callback_query:
@@ -408,80 +353,7 @@ async def harem(update: Update, context: CallbackContext, page=0) -> None:
             )
         return
 
-    # Get user's filter and sort preferences
-    filter_type = user.get("filter_type")
-    filter_value = user.get("filter_value")
-    sort_preference = user.get(
-        "sort_preference", "anime"
-    )  # Default to anime (current behavior)
-
-    # Apply filters first
-    characters = user["characters"]
-    if filter_type == "rarity" and filter_value:
-        characters = [char for char in characters if char.get("rarity") == filter_value]
-    elif filter_type == "character" and filter_value:
-        characters = [
-            char for char in characters if filter_value.lower() in char["name"].lower()
-        ]
-
-    # Then apply sorting
-    if sort_preference == "rarity":
-        # Sort by rarity (rarest first) then by name
-        rarity_order = [
-            "Limited Edition",
-            "Star",
-            "Zenith",
-            "Retro",
-            "Mythic",
-            "Legendary",
-            "Epic",
-            "Rare",
-            "Uncommon",
-            "Common",
-        ]
-        characters = sorted(
-            characters,
-            key=lambda x: (rarity_order.index(x.get("rarity", "Common")), x["name"]),
-        )
-    elif sort_preference == "name":
-        # Sort by character name alphabetically
-        characters = sorted(characters, key=lambda x: x["name"])
-    elif sort_preference == "limited_time":
-        # Sort by limited time cards first, then by rarity, then by name
-        rarity_order = [
-            "Limited Edition",
-            "Star",
-            "Zenith",
-            "Retro",
-            "Mythic",
-            "Legendary",
-            "Epic",
-            "Rare",
-            "Uncommon",
-            "Common",
-        ]
-        characters = sorted(
-            characters,
-            key=lambda x: (
-                0
-                if x.get("rarity") == "Limited Edition"
-                else 1,  # Limited Edition first
-                rarity_order.index(x.get("rarity", "Common")),
-                x["name"],
-            ),
-        )
-    else:
-        # Default: sort by anime then ID (existing behavior)
-        characters = sorted(characters, key=lambda x: (x["anime"], x["id"]))
-
-    # Use Counter to properly count character occurrences regardless of sort order
-    character_counts = Counter(character["id"] for character in user["characters"])
-
-    unique_characters = list(
-        {character["id"]: character for character in characters}.values()
-    )
-
-    total_pages = math.ceil(len(unique_characters) / 15)
+    total_pages = view.total_pages
 
     if page < 0 or page >= total_pages:
         page = 0
@@ -490,58 +362,15 @@ async def harem(update: Update, context: CallbackContext, page=0) -> None:
 
     # Build harem title with filter info
     title = f"{escape(user_name)}'s Harem"
-    if filter_type == "rarity" and filter_value:
-        title += f" [{filter_value} Only]"
-    elif filter_type == "character" and filter_value:
-        title += f" [{filter_value} Only]"
+    if view.filter_type == "rarity" and view.filter_value:
+        title += f" [{view.filter_value} Only]"
+    elif view.filter_type == "character" and view.filter_value:
+        title += f" [{view.filter_value} Only]"
     title += f" - Page {page + 1}/{total_pages}"
 
-    harem_message = f"<b>{title}</b>\n"
-
-    current_characters = unique_characters[page * 15 : (page + 1) * 15]
+    harem_message = f"<b>{title}</b>\n" + view.rendered(page, render_harem_page)
 
-    # Group characters by anime properly regardless of sort order
-    current_grouped_characters = defaultdict(list)
-    for character in current_characters:
-        current_grouped_characters[character["anime"]].append(character)
-
-    for anime, characters in current_grouped_characters.items():
-        # Get total count of anime characters in database
-        anime_total = await collection.count_documents({"anime": anime})
-
-        # Stylish anime header with count
-        harem_message += f"\n✢ {anime} 「 {len(characters)}/{anime_total} 」\n"
-        harem_message += "⚋⚋⚋⚋⚋⚋⚋⚋⚋⚋⚋⚋⚋⚋⚋\n"
-
-        for character in characters:
-            # Add rarity emoji to make it more beautiful
-            rarity_emojis = {
-                "Common": "<tg-emoji emoji-id='5102863490624784495'>⚪️</tg-emoji>",
-                "Uncommon": "<tg-emoji emoji-id='5102906715175651186'>🟢</tg-emoji>",
-                "Rare": "<tg-emoji emoji-id='5102814377673754670'>🔵</tg-emoji>",
-                "Epic": "<tg-emoji emoji-id='5103060513659554158'>🟣</tg-emoji>",
-                "Legendary": "<tg-emoji emoji-id='5102990767685634240'>🟡</tg-emoji>",
-                "Mythic": "<tg-emoji emoji-id='5102655962100008917'>🏵</tg-emoji>",
-                "Retro": "<tg-emoji emoji-id='5102698301887612539'>🍥</tg-emoji>",
-                "Star": "<tg-emoji emoji-id='5102825501639050967'>⭐</tg-emoji>",
-                "Zenith": "<tg-emoji emoji-id='5103065238123578838'>🪩</tg-emoji>",
-                "Limited Edition": "<tg-emoji emoji-id='5103127253156367234'>🍬</tg-emoji>",
-            }
-            rarity_emoji = rarity_emojis.get(
-                character.get("rarity", "Common"),
-                "<tg-emoji emoji-id='5102638339849192814'>✨</tg-emoji>",
-            )
-            count = character_counts[character["id"]]
-
-            # Stylish character entry format
-            harem_message += (
-                f"➥ {character['id']}〔{rarity_emoji} 〕{character['name']} x{count}\n"
-            )
-
-        # Add separator after each anime section
-        harem_message += "⚋⚋⚋⚋⚋⚋⚋⚋⚋⚋⚋⚋⚋⚋⚋\n"
-
-    total_count = len(user["characters"])
+    total_count = view.total
 
     keyboard = [
         [
@@ -581,11 +410,9 @@ async def harem(update: Update, context: CallbackContext, page=0) -> None:
 
     reply_markup = InlineKeyboardMarkup(keyboard)
 
-    if "favorites" in user and user["favorites"]:
-        fav_character_id = user["favorites"][0]
-        fav_character = next(
-            (c for c in user["characters"] if c["id"] == fav_character_id), None
-        )
+    if view.favorite is not None:
+        fav_character_id = view.favorite
+        fav_character = view.by_id.get(fav_character_id)
 
         if fav_character and "img_url" in fav_character:
             if update.message:
@@ -602,15 +429,18 @@ async def harem(update: Update, context: CallbackContext, page=0) -> None:
                     )
 
                     # Check if it's a video and use appropriate send method
-                    if await is_video_character(
-                        fav_character, fav_character_id, user_id
-                    ):
+                    if media.is_video(fav_character, user_id):
                         try:
-                            await update.message.reply_video(
-                                video=processed_url,
-                                parse_mode="HTML",
-                                caption=harem_message,
-                                reply_markup=reply_markup,
+                            await catalogue.send_media(
+                                fav_character,
+                                lambda file: update.message.reply_video(
+                                    video=file,
+                                    parse_mode="HTML",
+                                    caption=harem_message,
+                                    reply_markup=reply_markup,
+                                ),
+                                processed_url,
+                                user_id,
                             )
                         except Exception as video_error:
                             # Fallback: try as photo if video fails
@@ -635,11 +465,16 @@ async def harem(update: Update, context: CallbackContext, page=0) -> None:
                                     reply_markup=reply_markup,
                                 )
                     else:
-                        await update.message.reply_photo(
-                            photo=processed_url,
-                            parse_mode="HTML",
-                            caption=harem_message,
-                            reply_markup=reply_markup,
+                        await catalogue.send_media(
+                            fav_character,
+                            lambda file: update.message.reply_photo(
+                                photo=file,
+                                parse_mode="HTML",
+                                caption=harem_message,
+                                reply_markup=reply_markup,
+                            ),
+                            processed_url,
+                            user_id,
                         )
                 except Exception as e:
                     # If media fails, send text instead
@@ -662,17 +497,20 @@ async def harem(update: Update, context: CallbackContext, page=0) -> None:
                     )
 
                     # Check if it's a video and use appropriate media type
-                    if await is_video_character(
-                        fav_character, fav_character_id, user_id
-                    ):
+                    if media.is_video(fav_character, user_id):
                         try:
-                            media = InputMediaVideo(
-                                media=processed_url,
-                                caption=harem_message,
-                                parse_mode="HTML",
-                            )
-                            await update.callback_query.edit_message_media(
-                                media=media, reply_markup=reply_markup
+                            await catalogue.send_media(
+                                fav_character,
+                                lambda file: update.callback_query.edit_message_media(
+                                    media=InputMediaVideo(
+                                        media=file,
+                                        caption=harem_message,
+                                        parse_mode="HTML",
+                                    ),
+                                    reply_markup=reply_markup,
+                                ),
+                                processed_url,
+                                user_id,
                             )
                             await update.callback_query.answer()
                         except Exception as video_error:
@@ -681,13 +519,13 @@ async def harem(update: Update, context: CallbackContext, page=0) -> None:
                                 f"Harem callback: Favorite video edit failed, URL: {processed_url[:100]}, Error: {str(video_error)}. Trying as photo."
                             )
                             try:
-                                media = InputMediaPhoto(
+                                input_media = InputMediaPhoto(
                                     media=processed_url,
                                     caption=f"<tg-emoji emoji-id='5103000796434270751'>🎬</tg-emoji> [Video] {harem_message}",
                                     parse_mode="HTML",
                                 )
                                 await update.callback_query.edit_message_media(
-                                    media=media, reply_markup=reply_markup
+                                    media=input_media, reply_markup=reply_markup
                                 )
                                 await update.callback_query.answer()
                             except Exception as photo_error:
@@ -717,13 +555,18 @@ async def harem(update: Update, context: CallbackContext, page=0) -> None:
                                             "Failed to update media"
                                         )
                     else:
-                        media = InputMediaPhoto(
-                            media=processed_url,
-                            caption=harem_message,
-                            parse_mode="HTML",
-                        )
-                        await update.callback_query.edit_message_media(
-                            media=media, reply_markup=reply_markup
+                        await catalogue.send_media(
+                            fav_character,
+                            lambda file: update.callback_query.edit_message_media(
+                                media=InputMediaPhoto(
+                                    media=file,
+                                    caption=harem_message,
+                                    parse_mode="HTML",
+                                ),
+                                reply_markup=reply_markup,
+                            ),
+                            processed_url,
+                            user_id,
                         )
                         await update.callback_query.answer()
                 except Exception:
@@ -746,8 +589,8 @@ async def harem(update: Update, context: CallbackContext, page=0) -> None:
                             await update.callback_query.answer("Failed to update media")
         else:
             # Favorite not found or has no img_url - fall back to random character
-            if user["characters"]:
-                random_character = random.choice(user["characters"])
+            if view.characters:
+                random_character = random.choice(view.characters)
                 if "img_url" in random_character:
                     if update.message:
                         try:
@@ -766,15 +609,18 @@ async def harem(update: Update, context: CallbackContext, page=0) -> None:
                                 )
                             )
 
-                            if await is_video_character(
-                                random_character, random_character.get("id"), user_id
-                            ):
+                            if media.is_video(random_character, user_id):
                                 try:
-                                    await update.message.reply_video(
-                                        video=processed_url,
-                                        parse_mode="HTML",
-                                        caption=harem_message,
-                                        reply_markup=reply_markup,
+                                    await catalogue.send_media(
+                                        random_character,
+                                        lambda file: update.message.reply_video(
+                                            video=file,
+                                            parse_mode="HTML",
+                                            caption=harem_message,
+                                            reply_markup=reply_markup,
+                                        ),
+                                        processed_url,
+                                        user_id,
                                     )
                                 except Exception:
                                     try:
@@ -791,11 +637,16 @@ async def harem(update: Update, context: CallbackContext, page=0) -> None:
                                             reply_markup=reply_markup,
                                         )
                             else:
-                                await update.message.reply_photo(
-                                    photo=processed_url,
-                                    parse_mode="HTML",
-                                    caption=harem_message,
-                                    reply_markup=reply_markup,
+                                await catalogue.send_media(
+                                    random_character,
+                                    lambda file: update.message.reply_photo(
+                                        photo=file,
+                                        parse_mode="HTML",
+                                        caption=harem_message,
+                                        reply_markup=reply_markup,
+                                    ),
+                                    processed_url,
+                                    user_id,
                                 )
                         except Exception:
                             await update.message.reply_text(
@@ -821,28 +672,31 @@ async def harem(update: Update, context: CallbackContext, page=0) -> None:
                                 )
                             )
 
-                            if await is_video_character(
-                                random_character, random_character.get("id"), user_id
-                            ):
+                            if media.is_video(random_character, user_id):
                                 try:
-                                    media = InputMediaVideo(
-                                        media=processed_url,
-                                        caption=harem_message,
-                                        parse_mode="HTML",
-                                    )
-                                    await update.callback_query.edit_message_media(
-                                        media=media, reply_markup=reply_markup
+                                    await catalogue.send_media(
+                                        random_character,
+                                        lambda file: update.callback_query.edit_message_media(
+                                            media=InputMediaVideo(
+                                                media=file,
+                                                caption=harem_message,
+                                                parse_mode="HTML",
+                                            ),
+                                            reply_markup=reply_markup,
+                                        ),
+                                        processed_url,
+                                        user_id,
                                     )
                                     await update.callback_query.answer()
                                 except Exception:
                                     try:
-                                        media = InputMediaPhoto(
+                                        input_media = InputMediaPhoto(
                                             media=processed_url,
                                             caption=harem_message,
                                             parse_mode="HTML",
                                         )
                                         await update.callback_query.edit_message_media(
-                                            media=media, reply_markup=reply_markup
+                                            media=input_media, reply_markup=reply_markup
                                         )
                                         await update.callback_query.answer()
                                     except Exception:
@@ -857,13 +711,18 @@ async def harem(update: Update, context: CallbackContext, page=0) -> None:
                                             )
                                         await update.callback_query.answer()
                             else:
-                                media = InputMediaPhoto(
-                                    media=processed_url,
-                                    caption=harem_message,
-                                    parse_mode="HTML",
-                                )
-                                await update.callback_query.edit_message_media(
-                                    media=media, reply_markup=reply_markup
+                                await catalogue.send_media(
+                                    random_character,
+                                    lambda file: update.callback_query.edit_message_media(
+                                        media=InputMediaPhoto(
+                                            media=file,
+                                            caption=harem_message,
+                                            parse_mode="HTML",
+                                        ),
+                                        reply_markup=reply_markup,
+                                    ),
+                                    processed_url,
+                                    user_id,
                                 )
                                 await update.callback_query.answer()
                         except Exception:
@@ -906,8 +765,8 @@ async def harem(update: Update, context: CallbackContext, page=0) -> None:
                             harem_message, parse_mode="HTML", reply_markup=reply_markup
                         )
     else:
-        if user["characters"]:
-            random_character = random.choice(user["characters"])
+        if view.characters:
+            random_character = random.choice(view.characters)
 
             if "img_url" in random_character:
                 if update.message:
@@ -926,15 +785,18 @@ async def harem(update: Update, context: CallbackContext, page=0) -> None:
                         )
 
                         # Check if it's a video and use appropriate send method
-                        if await is_video_character(
-                            random_character, random_character.get("id"), user_id_no_fav
-                        ):
+                        if media.is_video(random_character, user_id_no_fav):
                             try:
-                                await update.message.reply_video(
-                                    video=processed_url,
-                                    parse_mode="HTML",
-                                    caption=harem_message,
-                                    reply_markup=reply_markup,
+                                await catalogue.send_media(
+                                    random_character,
+                                    lambda file: update.message.reply_video(
+                                        video=file,
+                                        parse_mode="HTML",
+                                        caption=harem_message,
+                                        reply_markup=reply_markup,
+                                    ),
+                                    processed_url,
+                                    user_id_no_fav,
                                 )
                             except Exception as video_error:
                                 # Fallback: try as photo if video fails
@@ -959,11 +821,16 @@ async def harem(update: Update, context: CallbackContext, page=0) -> None:
                                         reply_markup=reply_markup,
                                     )
                         else:
-                            await update.message.reply_photo(
-                                photo=processed_url,
-                                parse_mode="HTML",
-                                caption=harem_message,
-                                reply_markup=reply_markup,
+                            await catalogue.send_media(
+                                random_character,
+                                lambda file: update.message.reply_photo(
+                                    photo=file,
+                                    parse_mode="HTML",
+                                    caption=harem_message,
+                                    reply_markup=reply_markup,
+                                ),
+                                processed_url,
+                                user_id_no_fav,
                             )
                     except Exception as e:
                         # If media fails, send text instead
@@ -988,17 +855,20 @@ async def harem(update: Update, context: CallbackContext, page=0) -> None:
                         )
 
                         # Check if it's a video and use appropriate media type
-                        if await is_video_character(
-                            random_character, random_character.get("id"), user_id_no_fav
-                        ):
+                        if media.is_video(random_character, user_id_no_fav):
                             try:
-                                media = InputMediaVideo(
-                                    media=processed_url,
-                                    caption=harem_message,
-                                    parse_mode="HTML",
-                                )
-                                await update.callback_query.edit_message_media(
-                                    media=media, reply_markup=reply_markup
+                                await catalogue.send_media(
+                                    random_character,
+                                    lambda file: update.callback_query.edit_message_media(
+                                        media=InputMediaVideo(
+                                            media=file,
+                                            caption=harem_message,
+                                            parse_mode="HTML",
+                                        ),
+                                        reply_markup=reply_markup,
+                                    ),
+                                    processed_url,
+                                    user_id_no_fav,
                                 )
                                 await update.callback_query.answer()
                             except Exception as video_error:
@@ -1007,13 +877,13 @@ async def harem(update: Update, context: CallbackContext, page=0) -> None:
                                     f"Harem callback: Random video edit failed, URL: {processed_url[:100]}, Error: {str(video_error)}. Trying as photo."
                                 )
                                 try:
-                                    media = InputMediaPhoto(
+                                    input_media = InputMediaPhoto(
                                         media=processed_url,
                                         caption=f"<tg-emoji emoji-id='5103000796434270751'>🎬</tg-emoji> [Video] {harem_message}",
                                         parse_mode="HTML",
                                     )
                                     await update.callback_query.edit_message_media(
-                                        media=media, reply_markup=reply_markup
+                                        media=input_media, reply_markup=reply_markup
                                     )
                                     await update.callback_query.answer()
                                 except Exception as photo_error:
@@ -1041,13 +911,18 @@ async def harem(update: Update, context: CallbackContext, page=0) -> None:
                                                 "Failed to update media"
                                             )
                         else:
-                            media = InputMediaPhoto(
-                                media=processed_url,
-                                caption=harem_message,
-                                parse_mode="HTML",
-                            )
-                            await update.callback_query.edit_message_media(
-                                media=media, reply_markup=reply_markup
+                            await catalogue.send_media(
+                                random_character,
+                                lambda file: update.callback_query.edit_message_media(
+                                    media=InputMediaPhoto(
+                                        media=file,
+                                        caption=harem_message,
+                                        parse_mode="HTML",
+                                    ),
+                                    reply_markup=reply_markup,
+                                ),
+                                processed_url,
+                                user_id_no_fav,
                             )
                             await update.callback_query.answer()
                     except Exception:
@@ -1145,8 +1020,8 @@ async def fav(client, message):
     character_id = message.command[1]
 
     # Get user's collection
-    user = await user_collection.find_one({"id": user_id})
-    if not user or not user.get("characters"):
+    user = await users.get_owned(user_id, character_id)
+    if not user:
         await message.reply_text(
             "<tg-emoji emoji-id='5102962128843704400'>❌</tg-emoji> You don't have any characters yet!",
             parse_mode="HTML",
@@ -1154,7 +1029,7 @@ async def fav(client, message):
         return
 
     # Find the character
-    character = next((c for c in user["characters"] if c["id"] == character_id), None)
+    character = await harem_store.get_character(user, character_id)
     if not character:
         await message.reply_text(
             f"<tg-emoji emoji-id='5102962128843704400'>❌</tg-emoji> You don't have character ID <code>{character_id}</code> in your collection!",
@@ -1211,13 +1086,18 @@ async def fav(client, message):
             processed_url = await process_image_url(display_url)
 
             # Check if it's a video and use appropriate send method
-            if await is_video_character(character, character.get("id")):
+            if media.is_video(character, user_id_pyrogram):
                 try:
-                    await message.reply_video(
-                        video=processed_url,
-                        caption=caption,
-                        parse_mode=enums.ParseMode.HTML,
-                        reply_markup=keyboard,
+                    await catalogue.send_media(
+                        character,
+                        lambda file: message.reply_video(
+                            video=file,
+                            caption=caption,
+                            parse_mode=enums.ParseMode.HTML,
+                            reply_markup=keyboard,
+                        ),
+                        processed_url,
+                        user_id_pyrogram,
                     )
                 except Exception as video_error:
                     # Fallback: try sending as photo if video fails
@@ -1242,11 +1122,16 @@ async def fav(client, message):
                             reply_markup=keyboard,
                         )
             else:
-                await message.reply_photo(
-                    photo=processed_url,
-                    caption=caption,
-                    parse_mode=enums.ParseMode.HTML,
-                    reply_markup=keyboard,
+                await catalogue.send_media(
+                    character,
+                    lambda file: message.reply_photo(
+                        photo=file,
+                        caption=caption,
+                        parse_mode=enums.ParseMode.HTML,
+                        reply_markup=keyboard,
+                    ),
+                    processed_url,
+                    user_id_pyrogram,
                 )
         else:
             await message.reply_text(
@@ -1276,6 +1161,7 @@ async def fav_callback(client, callback_query):
         await user_collection.update_one(
             {"id": user_id}, {"$set": {"favorites": [character["id"]]}}, upsert=True
         )
+        harem_views.invalidate(user_id)
 
         await callback_query.edit_message_caption(
             caption=f"<tg-emoji emoji-id='5103027133173731788'>💕</tg-emoji> <b>Favorite Set!</b>\n\n🎴 <b>{escape(character['name'])}\n</b><tg-emoji emoji-id='5102990630246680945'>📺</tg-emoji> <b>{escape(character['anime'])}\n</b><tg-emoji emoji-id='5102638339849192814'>✨</tg-emoji> This character is now your favorite!",
@@ -1341,50 +1227,29 @@ async def transfer_harem(update: Update, context: CallbackContext) -> None:
         return
 
     # Find the old user's collection
-    old_user = await user_collection.find_one({"id": old_user_id})
-    if not old_user or not old_user.get("characters"):
+    old_user = await users.get_harem(old_user_id, "username", "first_name")
+    if not harem_store.has_characters(old_user):
         await update.message.reply_text(
             f"<tg-emoji emoji-id='5102962128843704400'>❌</tg-emoji> User {old_user_id} has no characters to transfer!",
             parse_mode="HTML",
         )
         return
 
-    # Get character count for confirmation message
-    character_count = len(old_user["characters"])
     old_username = old_user.get("username", "Unknown")
     old_first_name = old_user.get("first_name", "Unknown")
 
-    # Check if new user exists, if not create their document
-    new_user = await user_collection.find_one({"id": new_user_id})
-    characters_to_transfer = old_user[
-        "characters"
-    ]  # All characters will be transferred
-
-    if not new_user:
-        # Create new user document
-        await user_collection.insert_one(
-            {
-                "id": new_user_id,
-                "first_name": "Unknown",
-                "username": "Unknown",
-                "characters": characters_to_transfer,
-            }
-        )
-    else:
-        # Add all characters to existing user, preserving duplicates
-        existing_characters = new_user.get("characters", [])
-        all_characters = existing_characters + characters_to_transfer
-        await user_collection.update_one(
-            {"id": new_user_id}, {"$set": {"characters": all_characters}}
-        )
-
-    # Clear the old user's characters and favorites to maintain consistency
-    await user_collection.update_one(
-        {"id": old_user_id}, {"$set": {"characters": []}, "$unset": {"favorites": 1}}
+    # Add all characters to the new user (created if needed), preserving duplicates;
+    # the old user's harem is cleared
+    character_count = await harem_store.move_harem(
+        old_user, new_user_id, insert_fields={"first_name": "Unknown", "username": "Unknown"}
     )
 
+    # Clear the old user's favorites to maintain consistency
+    await user_collection.update_one({"id": old_user_id}, {"$unset": {"favorites": 1}})
+    harem_views.invalidate(old_user_id)
+
     # Success message
-    new_user_info = await user_collection.find_one({"id": new_user_id})
+    new_user_info = await users.get_profile(new_user_id)
     new_username = (
         new_user_info.get("username", "Unknown") if new_user_info else "Unknown"
     )
@@ -1419,8 +1284,8 @@ async def fav_ptb(update: Update, context: CallbackContext):
     character_id = context.args[0]
 
     # Get user's collection
-    user = await user_collection.find_one({"id": user_id})
-    if not user or not user.get("characters"):
+    user = await users.get_owned(user_id, character_id)
+    if not user:
         await update.message.reply_text(
             "<tg-emoji emoji-id='5102962128843704400'>❌</tg-emoji> You don't have any characters yet!",
             parse_mode="HTML",
@@ -1428,7 +1293,7 @@ async def fav_ptb(update: Update, context: CallbackContext):
         return
 
     # Find the character
-    character = next((c for c in user["characters"] if c["id"] == character_id), None)
+    character = await harem_store.get_character(user, character_id)
     if not character:
         await update.message.reply_text(
             f"<tg-emoji emoji-id='5102962128843704400'>❌</tg-emoji> You don't have character ID <code>{character_id}</code> in your collection!",
@@ -1497,13 +1362,18 @@ async def fav_ptb(update: Update, context: CallbackContext):
             processed_url = await process_image_url(display_url)
 
             # Check if it's a video
-            if await is_video_character(character, character.get("id")):
+            if media.is_video(character, user_id_ptb):
                 try:
-                    await update.message.reply_video(
-                        video=processed_url,
-                        caption=caption,
-                        parse_mode="HTML",
-                        reply_markup=keyboard,
+                    await catalogue.send_media(
+                        character,
+                        lambda file: update.message.reply_video(
+                            video=file,
+                            caption=caption,
+                            parse_mode="HTML",
+                            reply_markup=keyboard,
+                        ),
+                        processed_url,
+                        user_id_ptb,
                     )
                 except Exception as video_error:
                     LOGGER.warning(f"/fav PTB: Video failed, trying photo")
@@ -1521,11 +1391,16 @@ async def fav_ptb(update: Update, context: CallbackContext):
                             reply_markup=keyboard,
                         )
             else:
-                await update.message.reply_photo(
-                    photo=processed_url,
-                    caption=caption,
-                    parse_mode="HTML",
-                    reply_markup=keyboard,
+                await catalogue.send_media(
+                    character,
+                    lambda file: update.message.reply_photo(
+                        photo=file,
+                        caption=caption,
+                        parse_mode="HTML",
+                        reply_markup=keyboard,
+                    ),
+                    processed_url,
+                    user_id_ptb,
                 )
         else:
             await update.message.reply_text(
@@ -1553,6 +1428,7 @@ async def fav_callback_ptb(update: Update, context: CallbackContext):
         await user_collection.update_one(
             {"id": user_id}, {"$set": {"favorites": [character["id"]]}}, upsert=True
         )
+        harem_views.invalidate(user_id)
 
         try:
             await query.edit_message_caption(
@@ -1591,7 +1467,7 @@ async def all_rarities(update: Update, context: CallbackContext) -> None:
 
     user_id = update.effective_user.id
 
-    user = await user_collection.find_one({"id": user_id})
+    user = await users.get_harem(user_id)
     if not user:
         await update.message.reply_text(
             "<tg-emoji emoji-id='5102962128843704400'>❌</tg-emoji> You haven't started collecting yet!\n\n"
@@ -1600,7 +1476,7 @@ async def all_rarities(update: Update, context: CallbackContext) -> None:
         )
         return
 
-    user_characters = user.get("characters", [])
+    user_characters = await harem_store.hydrate(user)
     if not user_characters:
         await update.message.reply_text(
             "<tg-emoji emoji-id='5102962128843704400'>❌</tg-emoji> You don't have any characters yet!\n\n"
@@ -1619,8 +1495,9 @@ async def all_rarities(update: Update, context: CallbackContext) -> None:
         char.get("rarity", "Common") for char in unique_user_characters
     )
 
-    # Get total counts for each rarity from the collection
-    all_characters = await collection.find().to_list(length=None)
+    # Get total counts for each rarity from the resident catalogue
+    await spawn_pool.ensure_loaded()
+    all_characters = spawn_pool.characters.values()
     total_rarity_counts = Counter(
         char.get("rarity", "Common") for char in all_characters
     )
@@ -1681,6 +1558,7 @@ async def all_rarities(update: Update, context: CallbackContext) -> None:
 
 application.add_handler(CommandHandler(["harem", "collection"], harem, block=False))
 application.add_handler(CommandHandler("sorts", sorts, block=False))
+application.add_handler(ChatMemberHandler(track_main_group_member, ChatMemberHandler.CHAT_MEMBER, block=False))
 application.add_handler(CommandHandler("transfer", transfer_harem, block=False))
 application.add_handler(CommandHandler("fav", fav_ptb, block=False))
 application.add_handler(CommandHandler("all", all_rarities, block=False))
@@ -5,40 +5,13 @@ from cachetools import TTLCache
 from pymongo import MongoClient, ASCENDING
 
 from telegram import Update, InlineQueryResultPhoto, InlineQueryResultVideo
+from telegram import InlineQueryResultCachedPhoto, InlineQueryResultCachedVideo
 from telegram.ext import InlineQueryHandler, CallbackContext, CommandHandler 
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup
 
-from shivu import user_collection, collection, application, db, LOGGER, process_image_url
-from shivu.modules.harem import get_character_display_url
-
-def is_video_url(url):
-    """Check if a URL points to a video file"""
-    if not url:
-        return False
-    return any(ext in url.lower() for ext in ['.mp4', '.mov', '.avi', '.mkv', '.webm', '.flv'])
-
-async def is_video_character(character, char_id=None, user_id=None):
-    """Check if a character is a video by URL extension or name marker"""
-    if not character:
-        return False
-    
-    # Check for 🎬 emoji marker first (fastest check)
-    name = character.get('name', '')
-    if '🎬' in name:
-        return True
-    
-    # Get the correct display URL (respecting active_slot for custom characters)
-    # Only fetch fresh data for custom characters with user_id to avoid expensive lookups
-    if user_id and character.get('rarity') == 'Custom':
-        url = await get_character_display_url(character, char_id, user_id)
-    else:
-        # For non-custom or inline queries without user_id, use simpler lookup
-        url = character.get('img_url', '')
-    
-    if is_video_url(url):
-        return True
-    
-    return False
+from shivu import collection, application, db, LOGGER, process_image_url
+from shivu import harem_store, media, users, HAREM_PAGINATION
+from shivu.harem_views import server_collection_page
 
 # Rarity emojis — plain Unicode only (inline query captions do not support tg-emoji HTML)
 rarity_emojis = {
@@ -57,7 +30,7 @@ rarity_emojis = {
 
 
 # Database indexes will be created automatically by MongoDB when needed
-# Removed manual index creation to avoid async/await issues
+# Indexes are declared in shivu/schema.py and created at startup
 
 all_characters_cache = TTLCache(maxsize=10000, ttl=36000)
 user_collection_cache = TTLCache(maxsize=10000, ttl=60)
@@ -75,6 +48,8 @@ async def inlinequery(update: Update, context: CallbackContext) -> None:
     # Initialize user variable to avoid unbound errors
     user = None
     all_characters = []
+    page_characters = None  # set when MongoDB already paged the results
+    has_more = False
 
     if query.startswith('collection.'):
         # Handle user collection queries
@@ -91,33 +66,41 @@ async def inlinequery(update: Update, context: CallbackContext) -> None:
                 if user_id.isdigit():
                     user_id_int = int(user_id)
                     
-                    # Get user from cache or database
-                    if user_id in user_collection_cache:
-                        user = user_collection_cache[user_id]
+                    if HAREM_PAGINATION == 'server':
+                        # MongoDB pages the harem; only this page's characters come back
+                        search = None
+                        if search_terms.strip():
+                            search = re.compile(re.escape(search_terms.strip()), re.IGNORECASE)
+                        page_characters, has_more = await server_collection_page(user_id_int, search, offset, 50)
+                        LOGGER.info(f"Found {len(page_characters)} characters for user {user_id} at offset {offset}")
                     else:
-                        user = await user_collection.find_one({'id': user_id_int})
-                        if user:
-                            user_collection_cache[user_id] = user
-
-                    if user and 'characters' in user:
-                        # Get unique characters by ID
-                        all_characters = list({v['id']:v for v in user['characters']}.values())
+                        # Get user from cache or database
+                        if user_id in user_collection_cache:
+                            user = user_collection_cache[user_id]
+                        else:
+                            user = await users.get_harem(user_id_int)
+                            if user:
+                                user_collection_cache[user_id] = user
+
+                        if harem_store.has_characters(user):
+                            # Get unique characters by ID
+                            all_characters = await harem_store.hydrate(user, unique=True)
                         
-                        # Apply search filter if provided
-                        if search_terms.strip():
-                            try:
-                                escaped_search = re.escape(search_terms.strip())
-                                regex = re.compile(escaped_search, re.IGNORECASE)
-                                all_characters = [character for character in all_characters 
-                                               if regex.search(character.get('name', '')) or 
-                                                  regex.search(character.get('anime', ''))]
-                            except re.error as e:
-                                LOGGER.error(f"Regex error for search terms '{search_terms}': {str(e)}")
+                            # Apply search filter if provided
+                            if search_terms.strip():
+                                try:
+                                    escaped_search = re.escape(search_terms.strip())
+                                    regex = re.compile(escaped_search, re.IGNORECASE)
+                                    all_characters = [character for character in all_characters 
+                                                   if regex.search(character.get('name', '')) or 
+                                                      regex.search(character.get('anime', ''))]
+                                except re.error as e:
+                                    LOGGER.error(f"Regex error for search terms '{search_terms}': {str(e)}")
                         
-                        LOGGER.info(f"Found {len(all_characters)} characters for user {user_id}")
-                    else:
-                        all_characters = []
-                        LOGGER.info(f"No user found or no characters for user {user_id}")
+                            LOGGER.info(f"Found {len(all_characters)} characters for user {user_id}")
+                        else:
+                            all_characters = []
+                            LOGGER.info(f"No user found or no characters for user {user_id}")
                 else:
                     all_characters = []
                     LOGGER.info(f"Invalid user ID format: {user_id}")
@@ -149,11 +132,15 @@ async def inlinequery(update: Update, context: CallbackContext) -> None:
                 all_characters_cache['all_characters'] = all_characters
 
     # Limit characters per page for better performance
-    characters = all_characters[offset:offset+50]
-    if len(all_characters) > offset + 50:
-        next_offset = str(offset + 50)
+    if page_characters is not None:
+        characters = page_characters
+        next_offset = str(offset + 50) if has_more else ""
     else:
-        next_offset = ""
+        characters = all_characters[offset:offset+50]
+        if len(all_characters) > offset + 50:
+            next_offset = str(offset + 50)
+        else:
+            next_offset = ""
 
     results = []
     for character in characters:
@@ -169,27 +156,34 @@ async def inlinequery(update: Update, context: CallbackContext) -> None:
                 f"({rarity_emoji} 𝙍𝘼𝙍𝙄𝙏𝙔: {character.get('rarity', 'Unknown')})"
             )
             
-            # Get the correct display URL (respecting active_slot for custom characters)
-            # Don't pass user_id for inline queries to skip custom slot lookups
-            display_url = await get_character_display_url(character, character.get('id'), None)
-            processed_url = await process_image_url(display_url)
+            # Sent before: Telegram already has the file, no URL to fetch
+            file_id = media.file_id(character)
+            if file_id and media.is_video(character):
+                results.append(
+                    InlineQueryResultCachedVideo(
+                        id=f"{character['id']}_{time.time()}",
+                        video_file_id=file_id,
+                        title=f"{character['name']} - {character['anime']}",
+                        caption=caption,
+                    )
+                )
+                continue
+            if file_id:
+                results.append(
+                    InlineQueryResultCachedPhoto(
+                        id=f"{character['id']}_{time.time()}",
+                        photo_file_id=file_id,
+                        caption=caption,
+                    )
+                )
+                continue
+            
+            # Inline results don't show owner-specific custom slots
+            processed_url = await process_image_url(media.display_url(character))
             
             # Check if it's a video and use appropriate result type
-            # Don't pass user_id for inline queries to avoid expensive database lookups
-            if await is_video_character(character, character.get('id'), None):
-                # Determine mime type based on file extension
-                if '.webm' in processed_url.lower():
-                    mime_type = 'video/webm'
-                elif '.mov' in processed_url.lower():
-                    mime_type = 'video/quicktime'
-                elif '.avi' in processed_url.lower():
-                    mime_type = 'video/x-msvideo'
-                elif '.mkv' in processed_url.lower():
-                    mime_type = 'video/x-matroska'
-                elif '.flv' in processed_url.lower():
-                    mime_type = 'video/x-flv'
-                else:
-                    mime_type = 'video/mp4'
+            if media.is_video(character):
+                mime_type = media.mime_type(character)
                 
                 try:
                     # Use a placeholder thumbnail (must be JPEG for Telegram API)
@@ -10,16 +10,13 @@ from shivu import (application, PHOTO_URL, OWNER_ID,
                     group_user_totals_collection)
 
 from shivu import sudo_users as SUDO_USERS 
+from shivu.leaderboard_buffer import leaderboard_buffer
 
     
 async def global_leaderboard(update: Update, context: CallbackContext) -> None:
     
-    cursor = top_global_groups_collection.aggregate([
-        {"$project": {"group_name": 1, "count": 1}},
-        {"$sort": {"count": -1}},
-        {"$limit": 10}
-    ])
-    leaderboard_data = await cursor.to_list(length=10)
+    # Read through the write-behind buffer so unflushed claims count
+    leaderboard_data = await leaderboard_buffer.top_groups(limit=10)
 
     leaderboard_message = "<tg-emoji emoji-id='5103046482001397281'>🌐</tg-emoji>  𝗧𝗢𝗣 𝗚𝗿𝗼𝘂𝗽𝘀:\n"
     leaderboard_message += "┏━┅┅┄┄⟞⟦<tg-emoji emoji-id='5103039000168367836'>👥</tg-emoji>⟧⟝┄┄┉┉━┓\n"
@@ -46,13 +43,8 @@ async def global_leaderboard(update: Update, context: CallbackContext) -> None:
 async def ctop(update: Update, context: CallbackContext) -> None:
     chat_id = update.effective_chat.id
 
-    cursor = group_user_totals_collection.aggregate([
-        {"$match": {"group_id": chat_id}},
-        {"$project": {"username": 1, "first_name": 1, "character_count": "$count"}},
-        {"$sort": {"character_count": -1}},
-        {"$limit": 10}
-    ])
-    leaderboard_data = await cursor.to_list(length=10)
+    # Read through the write-behind buffer so unflushed claims count
+    leaderboard_data = await leaderboard_buffer.top_group_users(chat_id, limit=10)
 
     leaderboard_message = "<b>TOP 10 USERS WHO GUESSED CHARACTERS MOST TIME IN THIS GROUP..</b>\n\n"
 
@@ -62,7 +54,7 @@ async def ctop(update: Update, context: CallbackContext) -> None:
 
         if len(first_name) > 10:
             first_name = first_name[:15] + '...'
-        character_count = user['character_count']
+        character_count = user['count']
         leaderboard_message += f'{i}. <a href="https://t.me/{username}"><b>{first_name}</b></a> ➾ <b>{character_count}</b>\n'
     
     photo_url = random.choice(PHOTO_URL)
@@ -72,22 +64,23 @@ async def ctop(update: Update, context: CallbackContext) -> None:
 
 async def leaderboard(update: Update, context: CallbackContext) -> None:
     
+    # Harems are {id: copies} in char_counts; not-yet-migrated users still embed copies in characters
     cursor = user_collection.aggregate([
+        {
+            "$project": {
+                "username": 1,
+                "first_name": 1,
+                "owned": {"$objectToArray": {"$ifNull": ["$char_counts", {}]}},
+                "legacy": {"$ifNull": ["$characters", []]}
+            }
+        },
         {
             "$project": {
                 "username": 1, 
                 "first_name": 1, 
-                "total_characters": {"$size": "$characters"},
+                "total_characters": {"$add": [{"$sum": "$owned.v"}, {"$size": "$legacy"}]},
                 "unique_characters": {
-                    "$size": {
-                        "$setUnion": [
-                            {"$map": {
-                                "input": "$characters",
-                                "as": "char",
-                                "in": "$$char.id"
-                            }}, []
-                        ]
-                    }
+                    "$size": {"$setUnion": ["$owned.k", "$legacy.id"]}
                 }
             }
         },
@@ -141,7 +134,7 @@ async def send_users_document(update: Update, context: CallbackContext) -> None:
     if str(update.effective_user.id) not in SUDO_USERS:
         await update.message.reply_text('only For Sudo users...')
         return
-    cursor = user_collection.find({})
+    cursor = user_collection.find({}, {'_id': 0, 'first_name': 1})
     users = []
     async for document in cursor:
         users.append(document)
@@ -4,7 +4,9 @@ from telegram import InlineKeyboardMarkup, InlineKeyboardButton, Update
 from telegram.ext import CommandHandler, CallbackQueryHandler, CallbackContext
 from html import escape
 
-from shivu import user_collection, shivuu, collection, application
+from shivu import shivuu, application
+from shivu import harem_store, users
+from shivu.catalogue import catalogue
 from shivu.config import Config
 
 pending_trades = {}
@@ -30,20 +32,20 @@ async def trade(client, message):
 
     sender_character_id, receiver_character_id = message.command[1], message.command[2]
 
-    sender = await user_collection.find_one({'id': sender_id})
-    receiver = await user_collection.find_one({'id': receiver_id})
+    sender = await users.get_owned(sender_id, sender_character_id)
+    receiver = await users.get_owned(receiver_id, receiver_character_id)
 
     # Check if users exist and have characters field
-    if not sender or not sender.get('characters'):
+    if not sender:
         await message.reply_text("You don't have any characters to trade!")
         return
         
-    if not receiver or not receiver.get('characters'):
+    if not receiver:
         await message.reply_text("The other user doesn't have any characters to trade!")
         return
 
-    sender_character = next((character for character in sender['characters'] if character['id'] == sender_character_id), None)
-    receiver_character = next((character for character in receiver['characters'] if character['id'] == receiver_character_id), None)
+    sender_character = harem_store.copies(sender, sender_character_id)
+    receiver_character = harem_store.copies(receiver, receiver_character_id)
 
     if not sender_character:
         await message.reply_text("You don't have the character you're trying to trade!")
@@ -92,39 +94,10 @@ async def on_trade_callback_query(client, callback_query):
 
     if callback_query.data == "confirm_trade":
         
-        sender = await user_collection.find_one({'id': sender_id})
-        receiver = await user_collection.find_one({'id': receiver_id})
-
-        # Check if users still exist and have characters
-        if not sender or not sender.get('characters'):
-            await callback_query.answer("Sender no longer has characters!", show_alert=True)
-            return
-            
-        if not receiver or not receiver.get('characters'):
-            await callback_query.answer("Receiver no longer has characters!", show_alert=True)
-            return
-
-        sender_character = next((character for character in sender['characters'] if character['id'] == sender_character_id), None)
-        receiver_character = next((character for character in receiver['characters'] if character['id'] == receiver_character_id), None)
-
-        if not sender_character or not receiver_character:
+        # Both copies move, or neither does
+        if not await harem_store.swap(sender_id, sender_character_id, receiver_id, receiver_character_id):
             await callback_query.answer("One of the characters is no longer available!", show_alert=True)
             return
-        
-        sender['characters'].remove(sender_character)
-        receiver['characters'].remove(receiver_character)
-
-        
-        await user_collection.update_one({'id': sender_id}, {'$set': {'characters': sender['characters']}})
-        await user_collection.update_one({'id': receiver_id}, {'$set': {'characters': receiver['characters']}})
-
-        
-        sender['characters'].append(receiver_character)
-        receiver['characters'].append(sender_character)
-
-        
-        await user_collection.update_one({'id': sender_id}, {'$set': {'characters': sender['characters']}})
-        await user_collection.update_one({'id': receiver_id}, {'$set': {'characters': receiver['characters']}})
 
         
         del pending_trades[(sender_id, receiver_id)]
@@ -171,9 +144,9 @@ async def gift(client, message):
 
     character_ids = message.command[1:]
 
-    sender = await user_collection.find_one({'id': sender_id})
+    sender = await users.get_harem(sender_id)
 
-    if not sender or not sender.get('characters'):
+    if not harem_store.has_characters(sender):
         await message.reply_text("You don't have any characters to gift!")
         return
 
@@ -181,7 +154,7 @@ async def gift(client, message):
     characters = []
     not_found = []
     for cid in character_ids:
-        char = next((c for c in sender['characters'] if c['id'] == cid), None)
+        char = await harem_store.get_character(sender, cid)
         if char:
             characters.append(char)
         else:
@@ -264,40 +237,21 @@ async def on_gift_callback_query(client, callback_query):
         return
 
     if callback_query.data == "confirm_gift":
-        sender = await user_collection.find_one({'id': sender_id})
-        receiver = await user_collection.find_one({'id': receiver_id})
-
-        if not sender or not sender.get('characters'):
-            await callback_query.answer("You no longer have characters to gift!", show_alert=True)
-            return
-
         # Support both old single-character and new multi-character pending gift format
         gift_characters = gift.get('characters') or [gift['character']]
 
-        # Remove all gifted characters from sender
-        for char in gift_characters:
-            try:
-                sender['characters'].remove(char)
-            except ValueError:
-                pass
-        await user_collection.update_one({'id': sender_id}, {'$set': {'characters': sender['characters']}})
-
-        if receiver:
-            await user_collection.update_one(
-                {'id': receiver_id},
-                {'$push': {'characters': {'$each': gift_characters}}}
-            )
-        else:
-            await user_collection.insert_one({
-                'id': receiver_id,
-                'username': gift['receiver_username'],
-                'first_name': gift['receiver_first_name'],
-                'characters': gift_characters,
-            })
+        # Move one copy of each gifted character; ones the sender no longer has are skipped
+        moved = await harem_store.give_characters(
+            sender_id, receiver_id, [char['id'] for char in gift_characters],
+            insert_fields={'username': gift['receiver_username'], 'first_name': gift['receiver_first_name']}
+        )
+        if not moved:
+            await callback_query.answer("You no longer have characters to gift!", show_alert=True)
+            return
 
         del pending_gifts[(sender_id, receiver_id)]
 
-        count = len(gift_characters)
+        count = len(moved)
         success_message = (
             f"<tg-emoji emoji-id='5103087490349139576'>✅</tg-emoji> <b>Gift successful!</b>\n\n"
             f"Gifted <b>{count} character{'s' if count > 1 else ''}</b> to "
@@ -376,8 +330,9 @@ async def give(client, message):
     # Look up all characters
     found = []
     not_found = []
+    characters = await catalogue.get_many(character_ids)
     for cid in character_ids:
-        char = await collection.find_one({'id': cid})
+        char = characters.get(cid)
         if char:
             found.append(char)
         else:
@@ -391,19 +346,10 @@ async def give(client, message):
         return
 
     # Add all found characters to receiver
-    receiver = await user_collection.find_one({'id': receiver_id})
-    if receiver:
-        await user_collection.update_one(
-            {'id': receiver_id},
-            {'$push': {'characters': {'$each': found}}}
-        )
-    else:
-        await user_collection.insert_one({
-            'id': receiver_id,
-            'username': receiver_username,
-            'first_name': receiver_first_name,
-            'characters': found,
-        })
+    await harem_store.add_characters(
+        receiver_id, [c['id'] for c in found],
+        insert_fields={'username': receiver_username, 'first_name': receiver_first_name}
+    )
 
     char_lines = "\n".join(
         f"  🎴 <b>{c['name']}</b> ({c.get('rarity', '?')}) — <code>{c['id']}</code>"
@@ -457,9 +403,9 @@ async def gift_ptb(update: Update, context: CallbackContext):
 
     character_ids = context.args
 
-    sender = await user_collection.find_one({'id': sender_id})
+    sender = await users.get_harem(sender_id)
 
-    if not sender or not sender.get('characters'):
+    if not harem_store.has_characters(sender):
         await update.message.reply_text("You don't have any characters to gift!")
         return
 
@@ -467,7 +413,7 @@ async def gift_ptb(update: Update, context: CallbackContext):
     characters = []
     not_found = []
     for cid in character_ids:
-        char = next((c for c in sender['characters'] if c['id'] == cid), None)
+        char = await harem_store.get_character(sender, cid)
         if char:
             characters.append(char)
         else:
@@ -556,40 +502,21 @@ async def gift_callback_handler(update: Update, context: CallbackContext):
         return
     
     if query.data == "confirm_gift":
-        sender = await user_collection.find_one({'id': sender_id})
-        receiver = await user_collection.find_one({'id': receiver_id})
-
-        if not sender or not sender.get('characters'):
-            await query.answer("You no longer have characters to gift!", show_alert=True)
-            return
-
         # Support both old single-character and new multi-character pending gift format
         gift_characters = gift.get('characters') or [gift['character']]
 
-        # Remove all gifted characters from sender
-        for char in gift_characters:
-            try:
-                sender['characters'].remove(char)
-            except ValueError:
-                pass
-        await user_collection.update_one({'id': sender_id}, {'$set': {'characters': sender['characters']}})
-
-        if receiver:
-            await user_collection.update_one(
-                {'id': receiver_id},
-                {'$push': {'characters': {'$each': gift_characters}}}
-            )
-        else:
-            await user_collection.insert_one({
-                'id': receiver_id,
-                'username': gift['receiver_username'],
-                'first_name': gift['receiver_first_name'],
-                'characters': gift_characters,
-            })
+        # Move one copy of each gifted character; ones the sender no longer has are skipped
+        moved = await harem_store.give_characters(
+            sender_id, receiver_id, [char['id'] for char in gift_characters],
+            insert_fields={'username': gift['receiver_username'], 'first_name': gift['receiver_first_name']}
+        )
+        if not moved:
+            await query.answer("You no longer have characters to gift!", show_alert=True)
+            return
 
         del pending_gifts[gift_key]
 
-        count = len(gift_characters)
+        count = len(moved)
         success_message = (
             f"<tg-emoji emoji-id='5103087490349139576'>✅</tg-emoji> <b>Gift successful!</b>\n\n"
             f"Gifted <b>{count} character{'s' if count > 1 else ''}</b> to "
@@ -643,19 +570,19 @@ async def trade_ptb(update: Update, context: CallbackContext):
 
     sender_character_id, receiver_character_id = context.args[0], context.args[1]
 
-    sender = await user_collection.find_one({'id': sender_id})
-    receiver = await user_collection.find_one({'id': receiver_id})
+    sender = await users.get_owned(sender_id, sender_character_id)
+    receiver = await users.get_owned(receiver_id, receiver_character_id)
 
-    if not sender or not sender.get('characters'):
+    if not sender:
         await update.message.reply_text("You don't have any characters to trade!")
         return
         
-    if not receiver or not receiver.get('characters'):
+    if not receiver:
         await update.message.reply_text("The other user doesn't have any characters to trade!")
         return
 
-    sender_character = next((character for character in sender['characters'] if character['id'] == sender_character_id), None)
-    receiver_character = next((character for character in receiver['characters'] if character['id'] == receiver_character_id), None)
+    sender_character = harem_store.copies(sender, sender_character_id)
+    receiver_character = harem_store.copies(receiver, receiver_character_id)
 
     if not sender_character:
         await update.message.reply_text("You don't have the character you're trying to trade!")
@@ -695,35 +622,10 @@ async def trade_callback_ptb(update: Update, context: CallbackContext):
         return
 
     if query.data == "confirm_trade":
-        sender = await user_collection.find_one({'id': sender_id})
-        receiver = await user_collection.find_one({'id': receiver_id})
-
-        if not sender or not sender.get('characters'):
-            await query.answer("Sender no longer has characters!", show_alert=True)
-            return
-            
-        if not receiver or not receiver.get('characters'):
-            await query.answer("Receiver no longer has characters!", show_alert=True)
-            return
-
-        sender_character = next((character for character in sender['characters'] if character['id'] == sender_character_id), None)
-        receiver_character = next((character for character in receiver['characters'] if character['id'] == receiver_character_id), None)
-
-        if not sender_character or not receiver_character:
+        # Both copies move, or neither does
+        if not await harem_store.swap(sender_id, sender_character_id, receiver_id, receiver_character_id):
             await query.answer("One of the characters is no longer available!", show_alert=True)
             return
-        
-        sender['characters'].remove(sender_character)
-        receiver['characters'].remove(receiver_character)
-
-        await user_collection.update_one({'id': sender_id}, {'$set': {'characters': sender['characters']}})
-        await user_collection.update_one({'id': receiver_id}, {'$set': {'characters': receiver['characters']}})
-
-        sender['characters'].append(receiver_character)
-        receiver['characters'].append(sender_character)
-
-        await user_collection.update_one({'id': sender_id}, {'$set': {'characters': sender['characters']}})
-        await user_collection.update_one({'id': receiver_id}, {'$set': {'characters': receiver['characters']}})
 
         del pending_trades[trade_key]
 
@@ -794,8 +696,9 @@ async def give_ptb(update: Update, context: CallbackContext):
     # Look up all characters
     found = []
     not_found = []
+    characters = await catalogue.get_many(character_ids)
     for cid in character_ids:
-        char = await collection.find_one({'id': cid})
+        char = characters.get(cid)
         if char:
             found.append(char)
         else:
@@ -809,19 +712,10 @@ async def give_ptb(update: Update, context: CallbackContext):
         return
 
     # Add all found characters to receiver
-    receiver = await user_collection.find_one({'id': receiver_id})
-    if receiver:
-        await user_collection.update_one(
-            {'id': receiver_id},
-            {'$push': {'characters': {'$each': found}}}
-        )
-    else:
-        await user_collection.insert_one({
-            'id': receiver_id,
-            'username': receiver_username,
-            'first_name': receiver_first_name,
-            'characters': found,
-        })
+    await harem_store.add_characters(
+        receiver_id, [c['id'] for c in found],
+        insert_fields={'username': receiver_username, 'first_name': receiver_first_name}
+    )
 
     char_lines = "\n".join(
         f"  🎴 <b>{c['name']}</b> ({c.get('rarity', '?')}) — <code>{c['id']}</code>"
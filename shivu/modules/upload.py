@@ -1,14 +1,23 @@
-import urllib.request
-import urllib.parse
-import urllib.error
+import asyncio
+import csv
+import io
+import json
 import re
-from pymongo import ReturnDocument
+from html import escape
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError
 
 from telegram import Update
 from telegram.ext import CommandHandler, CallbackContext
 
-from shivu import application, sudo_users, uploading_users, collection, db, CHARA_CHANNEL_ID, SUPPORT_CHAT, user_collection
-from shivu.modules.harem import get_character_display_url
+from shivu import application, sudo_users, uploading_users, collection, db, CHARA_CHANNEL_ID, SUPPORT_CHAT, user_collection, LOGGER
+from shivu.catalogue import catalogue
+from shivu.url_validator import url_validator, is_discord_cdn_url
+from shivu.channel_posts import channel_posts
+from shivu.propagation import propagation, UPDATE
+from shivu import harem_store, media, migrations, users
+from shivu.owner_index import owner_index
+from shivu.chat_state import chat_state
 
 # Rarity styles for display purposes
 rarity_styles = {
@@ -142,103 +151,6 @@ async def promote(update: Update, context: CallbackContext) -> None:
         await update.message.reply_text(f'Error: {str(e)}')
 
 
-def is_discord_cdn_url(url):
-    """Check if the URL is a Discord CDN link or a local/direct file link"""
-    try:
-        parsed = urllib.parse.urlparse(url)
-        if parsed.scheme not in ['http', 'https']:
-            return False
-        
-        discord_hosts = [
-            'cdn.discordapp.com',
-            'media.discordapp.net',
-            'attachments.discordapp.net',
-            'cdn.discord.com',
-            'media.discord.com'
-        ]
-        
-        # Also support 0.0.0.0 or other direct IP links mentioned by user
-        if parsed.netloc in discord_hosts or parsed.netloc == '0.0.0.0':
-            return True
-            
-        return False
-    except:
-        return False
-
-
-def is_video_url(url):
-    """Check if a URL points to a video file"""
-    if not url:
-        return False
-    return any(ext in url.lower() for ext in ['.mp4', '.mov', '.avi', '.mkv', '.webm', '.flv'])
-
-async def is_video_character(character, char_id=None, user_id=None):
-    """Check if a character is a video by URL extension or name marker"""
-    if not character:
-        return False
-    
-    # Check for 🎬 emoji marker first (fastest check)
-    name = character.get('name', '')
-    if '🎬' in name:
-        return True
-    
-    # Get the correct display URL (respecting active_slot for custom characters)
-    # Only fetch fresh data for custom characters with user_id to avoid expensive lookups
-    if user_id and character.get('rarity') == 'Custom':
-        url = await get_character_display_url(character, char_id, user_id)
-    else:
-        # For non-custom or queries without user_id, use simpler lookup
-        url = character.get('img_url', '')
-    
-    if is_video_url(url):
-        return True
-    
-    return False
-
-
-def validate_url(url):
-    """
-    Validate a URL and return whether it's accessible.
-    Handles Discord CDN links with special logic.
-    """
-    # For Discord or direct file links (like 0.0.0.0/dl/...), bypass full validation and just check structure
-    if is_discord_cdn_url(url):
-        try:
-            parsed = urllib.parse.urlparse(url)
-            # Basic validation for path structure
-            if parsed.path and ('/' in parsed.path[1:]):  # Has meaningful path
-                return True, "Media link (validation bypassed)"
-            else:
-                return False, "Invalid media link structure"
-        except:
-            return False, "Invalid media URL format"
-    
-    # For non-Discord URLs, perform full validation
-    try:
-        # Create request with appropriate headers
-        req = urllib.request.Request(url)
-        req.add_header('User-Agent', 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36')
-        
-        # Try to open the URL
-        with urllib.request.urlopen(req, timeout=10) as response:
-            # Check if it's an image or video by checking content type or URL
-            content_type = response.headers.get('Content-Type', '')
-            if content_type.startswith('image/') or content_type.startswith('video/'):
-                return True, f"Valid {'image' if content_type.startswith('image/') else 'video'} URL"
-            elif any(ext in url.lower() for ext in ['.jpg', '.jpeg', '.png', '.gif', '.webp', '.bmp', '.mp4', '.mov', '.avi', '.mkv']):
-                return True, "Valid media URL"
-            else:
-                return False, "URL does not appear to be an image or video"
-                
-    except urllib.error.HTTPError as e:
-        return False, f"HTTP Error: {e.code}"
-    except urllib.error.URLError as e:
-        return False, f"URL Error: {str(e)}"
-    except Exception as e:
-        return False, f"Validation Error: {str(e)}"
-
-
-
 async def can_upload(user_id):
     """Check if user has upload permissions (sudo_users, uploading_users env var, or dynamic uploading_users)"""
     user_id_str = str(user_id)
@@ -252,16 +164,62 @@ async def can_upload(user_id):
     uploader = await dynamic_uploaders_collection.find_one({'user_id': user_id_str})
     return uploader is not None
 
-async def get_next_sequence_number(sequence_name):
+async def get_next_sequence_number(sequence_name, count=1):
+    """Take the next `count` numbers of a sequence in one $inc; returns the last"""
     sequence_collection = db.sequences
     sequence_document = await sequence_collection.find_one_and_update(
         {'_id': sequence_name}, 
-        {'$inc': {'sequence_value': 1}}, 
+        {'$inc': {'sequence_value': count}}, 
         upsert=True,
         return_document=ReturnDocument.AFTER
     )
     return sequence_document['sequence_value']
 
+
+UPLOAD_RARITIES = {
+    1: "Common", 
+    2: "Uncommon", 
+    3: "Rare", 
+    4: "Epic", 
+    5: "Legendary", 
+    6: "Mythic", 
+    7: "Retro", 
+    8: "Star", 
+    9: "Zenith", 
+    10: "Limited Edition",
+    11: "Custom"
+}
+# Highest rarity number each uploader level may add (level 3: all)
+LEVEL_MAX_RARITY = {1: 6, 2: 9}
+
+
+def clean_name(text):
+    """Character/anime name as stored: separators to spaces, no diacritics, title case"""
+    import unicodedata
+    # Replace common Arabic diacritics and special characters with spaces
+    text = text.replace('ـ', ' ')  # Arabic Tatweel
+    text = text.replace('-', ' ')
+    text = text.replace('_', ' ')
+    # Remove combining marks and normalize Unicode
+    text = ''.join(c for c in unicodedata.normalize('NFKD', text) 
+                   if not unicodedata.combining(c))
+    # Clean up multiple spaces
+    return ' '.join(text.split()).title()
+
+
+def upload_caption(character, user):
+    """Caption of a new character's post in the database channel"""
+    return (
+        f"<tg-emoji emoji-id='5102638339849192814'>✨</tg-emoji> <b>{character['name']}</b> <tg-emoji emoji-id='5102638339849192814'>✨</tg-emoji>\n"
+        f"<tg-emoji emoji-id='5103013135875312074'>🎌</tg-emoji> <i>{character['anime']}</i>\n"
+        f"━━━━━━━━━━━━━━━━\n"
+        f"{rarity_styles.get(character['rarity'], '')} <b>{character['rarity']}</b>\n"
+        f"<tg-emoji emoji-id='5102716405174765315'>🆔</tg-emoji> <b>ID:</b> #{character['id']}\n"
+        f"━━━━━━━━━━━━━━━━\n"
+        f"<tg-emoji emoji-id='5102733670943295663'>📤</tg-emoji> Added by <a href='tg://user?id={user.id}'>{user.first_name}</a>"
+    )
+
+
 async def upload(update: Update, context: CallbackContext) -> None:
     if not update.effective_user or not update.message:
         return
@@ -277,32 +235,11 @@ async def upload(update: Update, context: CallbackContext) -> None:
             await update.message.reply_text(get_format_text(level), parse_mode='HTML')
             return
 
-        # Clean character name: remove special Unicode chars, replace separators with spaces
-        import unicodedata
-        character_name = args[1]
-        # Replace common Arabic diacritics and special characters with spaces
-        character_name = character_name.replace('ـ', ' ')  # Arabic Tatweel
-        character_name = character_name.replace('-', ' ')
-        character_name = character_name.replace('_', ' ')
-        # Remove combining marks and normalize Unicode
-        character_name = ''.join(c for c in unicodedata.normalize('NFKD', character_name) 
-                                 if not unicodedata.combining(c))
-        # Clean up multiple spaces
-        character_name = ' '.join(character_name.split())
-        character_name = character_name.title()
-        
-        # Clean anime name similarly
-        anime = args[2]
-        anime = anime.replace('ـ', ' ')
-        anime = anime.replace('-', ' ')
-        anime = anime.replace('_', ' ')
-        anime = ''.join(c for c in unicodedata.normalize('NFKD', anime) 
-                       if not unicodedata.combining(c))
-        anime = ' '.join(anime.split())
-        anime = anime.title()
+        character_name = clean_name(args[1])
+        anime = clean_name(args[2])
 
         # Validate URL with enhanced Discord CDN support
-        is_valid, validation_message = validate_url(args[0])
+        is_valid, validation_message, content_type = await url_validator.validate(args[0])
         # If the error is "URL does not appear to be an image or video", we check for local links
         if not is_valid and "does not appear to be an image or video" in validation_message:
              if is_discord_cdn_url(args[0]):
@@ -313,27 +250,15 @@ async def upload(update: Update, context: CallbackContext) -> None:
             await update.message.reply_text(f'Invalid URL: {validation_message}')
             return
         
-        # Check if it's a video based on validation message or URL extension
-        is_video = 'video' in validation_message.lower() or any(ext in args[0].lower() for ext in ['.mp4', '.mov', '.avi', '.mkv'])
+        # Check if it's a video based on what the host served or the URL extension
+        media_fields = media.classify(args[0], name=character_name, content_type=content_type)
+        is_video = media_fields['media_kind'] == media.VIDEO
         
         # If it's a Discord CDN link, inform the user
         if is_discord_cdn_url(args[0]):
             await update.message.reply_text('<tg-emoji emoji-id="5103087490349139576">✅</tg-emoji> Discord CDN link detected - processing...', reply_to_message_id=update.message.message_id,
                 parse_mode='HTML')
 
-        rarity_map = {
-            1: "Common", 
-            2: "Uncommon", 
-            3: "Rare", 
-            4: "Epic", 
-            5: "Legendary", 
-            6: "Mythic", 
-            7: "Retro", 
-            8: "Star", 
-            9: "Zenith", 
-            10: "Limited Edition",
-            11: "Custom"
-        }
         try:
             rarity_num = int(args[3])
             # Level restrictions
@@ -346,7 +271,7 @@ async def upload(update: Update, context: CallbackContext) -> None:
                 parse_mode='HTML')
                 return
             
-            rarity = rarity_map[rarity_num]
+            rarity = UPLOAD_RARITIES[rarity_num]
         except (KeyError, ValueError):
             await update.message.reply_text(get_format_text(level), parse_mode='HTML')
             return
@@ -358,23 +283,14 @@ async def upload(update: Update, context: CallbackContext) -> None:
             'name': character_name,
             'anime': anime,
             'rarity': rarity,
-            'id': id
+            'id': id,
+            **media_fields
         }
 
         try:
-            rarity_emoji = rarity_styles.get(rarity, "")
             from shivu import process_image_url
             processed_url = await process_image_url(args[0])
-            # Create neat and pretty caption format
-            caption = (
-                f"<tg-emoji emoji-id='5102638339849192814'>✨</tg-emoji> <b>{character_name}</b> <tg-emoji emoji-id='5102638339849192814'>✨</tg-emoji>\n"
-                f"<tg-emoji emoji-id='5103013135875312074'>🎌</tg-emoji> <i>{anime}</i>\n"
-                f"━━━━━━━━━━━━━━━━\n"
-                f"{rarity_emoji} <b>{rarity}</b>\n"
-                f"<tg-emoji emoji-id='5102716405174765315'>🆔</tg-emoji> <b>ID:</b> #{id}\n"
-                f"━━━━━━━━━━━━━━━━\n"
-                f"<tg-emoji emoji-id='5102733670943295663'>📤</tg-emoji> Added by <a href='tg://user?id={update.effective_user.id}'>{update.effective_user.first_name}</a>"
-            )
+            caption = upload_caption(character, update.effective_user)
             
             if is_video:
                 message = await context.bot.send_video(
@@ -391,16 +307,253 @@ async def upload(update: Update, context: CallbackContext) -> None:
                     parse_mode='HTML'
                 )
             character['message_id'] = message.message_id
+            # The channel post already gave Telegram the file: later sends reuse it
+            file_id = media.sent_file_id(message, is_video)
+            if file_id:
+                character['file_id'] = file_id
             await collection.insert_one(character)
+            catalogue.add(character)
             await update.message.reply_text('CHARACTER ADDED....')
         except:
             await collection.insert_one(character)
+            catalogue.add(character)
             await update.effective_message.reply_text("Character Added but no Database Channel Found, Consider adding one.")
         
     except Exception as e:
         await update.message.reply_text(f'Character Upload Unsuccessful. Error: {str(e)}\nIf you think this is a source error, forward to: {SUPPORT_CHAT}')
 
 
+BULK_MAX_ROWS = 1000
+BULK_MAX_BYTES = 2 * 1024 * 1024
+BULK_FIELDS = ('img_url', 'name', 'anime', 'rarity')
+BULK_INSERT_BATCH = 500
+BULK_REPORT_EVERY = 10  # channel posts between progress edits
+BULK_ERRORS_SHOWN = 30
+
+BULK_USAGE = (
+    "<tg-emoji emoji-id='5102733670943295663'>📤</tg-emoji> <b>Bulk upload</b>\n\n"
+    "Reply to a .csv or .json file with /bulkupload.\n\n"
+    "CSV: a header row with <code>img_url,name,anime,rarity</code>, then one character per row.\n"
+    "JSON: a list of objects with those keys.\n\n"
+    f"Rarity is the /upload number or the rarity name. Up to {BULK_MAX_ROWS} rows per file."
+)
+
+
+def parse_bulk_rows(file_name, data):
+    """[(row number, {field: value})] from a CSV or JSON upload; ValueError if unreadable"""
+    text = data.decode('utf-8-sig')
+    if (file_name or '').lower().endswith('.json') or text.lstrip()[:1] in ('[', '{'):
+        try:
+            entries = json.loads(text)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"Invalid JSON: {e}")
+        if not isinstance(entries, list) or not all(isinstance(entry, dict) for entry in entries):
+            raise ValueError("The JSON must be a list of objects")
+        rows = [(number, entry) for number, entry in enumerate(entries, 1)]
+    else:
+        reader = csv.DictReader(io.StringIO(text))
+        reader.fieldnames = [(field or '').strip().lower() for field in reader.fieldnames or []]
+        missing = [field for field in BULK_FIELDS if field not in reader.fieldnames]
+        if missing:
+            raise ValueError(f"Missing CSV columns: {', '.join(missing)}")
+        # Line 1 is the header
+        rows = [(number, row) for number, row in enumerate(reader, 2)]
+
+    if not rows:
+        raise ValueError("The file has no characters")
+    if len(rows) > BULK_MAX_ROWS:
+        raise ValueError(f"Too many rows ({len(rows)}); the limit is {BULK_MAX_ROWS}")
+    return rows
+
+
+def bulk_rarity(value, level):
+    """(rarity, None) or (None, error) for a row's rarity number or name"""
+    value = str(value or '').strip()
+    if value.isdigit():
+        number = int(value)
+    else:
+        number = next((n for n, rarity in UPLOAD_RARITIES.items() if rarity.lower() == value.lower()), None)
+    if number not in UPLOAD_RARITIES:
+        return None, f"unknown rarity '{value}'"
+    if number > LEVEL_MAX_RARITY.get(level, number):
+        return None, f"level {level} uploaders can only upload up to rarity {LEVEL_MAX_RARITY[level]}"
+    return UPLOAD_RARITIES[number], None
+
+
+async def prepare_bulk_rows(rows, level):
+    """Catalogue records for the rows that pass, and (row number, error) for the rest"""
+    errors = []
+    accepted = []
+    seen_urls = {}
+    for number, row in rows:
+        row = {str(key).strip().lower(): str(value if value is not None else '').strip() for key, value in row.items()}
+        missing = [field for field in BULK_FIELDS if not row.get(field)]
+        if missing:
+            errors.append((number, f"missing {', '.join(missing)}"))
+            continue
+        rarity, error = bulk_rarity(row['rarity'], level)
+        if error:
+            errors.append((number, error))
+            continue
+        if row['img_url'] in seen_urls:
+            errors.append((number, f"same img_url as row {seen_urls[row['img_url']]}"))
+            continue
+        seen_urls[row['img_url']] = number
+        accepted.append((number, {
+            'img_url': row['img_url'],
+            'name': clean_name(row['name']),
+            'anime': clean_name(row['anime']),
+            'rarity': rarity,
+        }))
+
+    # Every URL at once, on the shared validator
+    results = await url_validator.validate_many([character['img_url'] for _, character in accepted])
+    characters = []
+    for (number, character), (is_valid, validation_message, content_type) in zip(accepted, results):
+        if not is_valid:
+            errors.append((number, f"invalid URL: {validation_message}"))
+            continue
+        character.update(media.classify(character['img_url'], name=character['name'], content_type=content_type))
+        characters.append((number, character))
+    errors.sort()
+    return characters, errors
+
+
+async def insert_bulk(characters, errors):
+    """insert_many the records in batches; rows the database refuses move to `errors`"""
+    inserted = []
+    for start in range(0, len(characters), BULK_INSERT_BATCH):
+        batch = characters[start:start + BULK_INSERT_BATCH]
+        try:
+            await collection.insert_many([character for _, character in batch], ordered=False)
+            inserted.extend(batch)
+        except BulkWriteError as e:
+            failed = {error['index']: error.get('errmsg', 'write failed') for error in e.details.get('writeErrors', [])}
+            for index, (number, character) in enumerate(batch):
+                if index in failed:
+                    errors.append((number, f"not saved: {failed[index]}"))
+                else:
+                    inserted.append((number, character))
+    for _, character in inserted:
+        catalogue.add(character)
+    errors.sort()
+    return inserted
+
+
+def bulk_report(title, lines, errors):
+    text = '\n'.join([title, ''] + lines)
+    if errors:
+        text += f"\n\n<tg-emoji emoji-id='5102920111178647010'>⚠️</tg-emoji> <b>{len(errors)} rows skipped:</b>\n"
+        text += '\n'.join(f"• Row {number}: {escape(error)}" for number, error in errors[:BULK_ERRORS_SHOWN])
+        if len(errors) > BULK_ERRORS_SHOWN:
+            text += f"\n• ... and {len(errors) - BULK_ERRORS_SHOWN} more"
+    return text
+
+
+async def bulkupload(update: Update, context: CallbackContext) -> None:
+    """Add many characters from a CSV/JSON file: /bulkupload in reply to the file"""
+    if not update.effective_user or not update.message:
+        return
+
+    level = await get_uploader_level(update.effective_user.id)
+    if level == 0:
+        await update.message.reply_text('Ask My Owner or authorized uploader...')
+        return
+
+    replied = update.message.reply_to_message
+    document = update.message.document or (replied.document if replied else None)
+    if not document:
+        await update.message.reply_text(BULK_USAGE, parse_mode='HTML')
+        return
+    if document.file_size and document.file_size > BULK_MAX_BYTES:
+        await update.message.reply_text(f'<tg-emoji emoji-id="5102962128843704400">❌</tg-emoji> The file is too big (max {BULK_MAX_BYTES // 1024 // 1024} MB).',
+            parse_mode='HTML')
+        return
+
+    try:
+        data = await (await document.get_file()).download_as_bytearray()
+        rows = parse_bulk_rows(document.file_name, bytes(data))
+    except (ValueError, UnicodeDecodeError) as e:
+        await update.message.reply_text(f'<tg-emoji emoji-id="5102962128843704400">❌</tg-emoji> {escape(str(e))}',
+            parse_mode='HTML')
+        return
+
+    status = await update.message.reply_text(
+        f'<tg-emoji emoji-id="5103051253710063171">🔄</tg-emoji> Checking {len(rows)} rows and their URLs...',
+        parse_mode='HTML'
+    )
+
+    async def report(title, lines, errors):
+        try:
+            await status.edit_text(bulk_report(title, lines, errors), parse_mode='HTML')
+        except Exception as e:
+            LOGGER.warning(f"Bulk upload progress edit failed: {e}")
+
+    try:
+        characters, errors = await prepare_bulk_rows(rows, level)
+        if not characters:
+            await report('<tg-emoji emoji-id="5102962128843704400">❌</tg-emoji> <b>Nothing to add</b>', [], errors)
+            return
+
+        # One $inc for the whole block of ids
+        last_id = await get_next_sequence_number('character_id', len(characters))
+        for offset, (_, character) in enumerate(characters):
+            character['id'] = str(last_id - len(characters) + 1 + offset)
+
+        inserted = await insert_bulk(characters, errors)
+        added = f'• Added: {len(inserted)} characters'
+        if inserted:
+            added += f" (#{inserted[0][1]['id']} – #{inserted[-1][1]['id']})"
+        await report(
+            '<tg-emoji emoji-id="5103051253710063171">🔄</tg-emoji> <b>Bulk upload</b>',
+            [added, f'• Posting to the channel: 0/{len(inserted)}'], errors
+        )
+
+        # Channel posts go through the shared rate-limited queue
+        from shivu import process_image_url
+
+        async def post(character):
+            is_video = character['media_kind'] == media.VIDEO
+            message = await channel_posts.post(is_video, await process_image_url(character['img_url']),
+                                               upload_caption(character, update.effective_user))
+            return character, media.sent_file_id(message, is_video), message
+
+        posted = failed = 0
+        updates = []
+        for sent in asyncio.as_completed([post(character) for _, character in inserted]):
+            try:
+                character, file_id, message = await sent
+            except Exception as e:
+                failed += 1
+                LOGGER.warning(f"Bulk upload channel post failed: {e}")
+                continue
+            posted += 1
+            fields = {'message_id': message.message_id}
+            if file_id:
+                fields['file_id'] = file_id
+            # Same document the catalogue holds
+            character.update(fields)
+            updates.append(UpdateOne({'id': character['id']}, {'$set': fields}))
+            if len(updates) >= BULK_REPORT_EVERY:
+                await collection.bulk_write(updates, ordered=False)
+                updates = []
+            if (posted + failed) % BULK_REPORT_EVERY == 0:
+                await report(
+                    '<tg-emoji emoji-id="5103051253710063171">🔄</tg-emoji> <b>Bulk upload</b>',
+                    [added, f'• Posting to the channel: {posted + failed}/{len(inserted)}'], errors
+                )
+        if updates:
+            await collection.bulk_write(updates, ordered=False)
+
+        lines = [added, f'• Posted to the channel: {posted}/{len(inserted)}']
+        if failed:
+            lines.append(f'• Channel posts failed: {failed} (the characters are saved)')
+        await report('<tg-emoji emoji-id="5103087490349139576">✅</tg-emoji> <b>Bulk upload finished</b>', lines, errors)
+    except Exception as e:
+        LOGGER.error(f"Bulk upload failed: {e}")
+        await update.message.reply_text(f'Bulk upload failed: {str(e)}\nIf you think this is a source error, forward to: {SUPPORT_CHAT}')
+
+
 async def update_card(update: Update, context: CallbackContext) -> None:
     if not update.effective_user or not update.message:
         return
@@ -431,12 +584,13 @@ async def update_card(update: Update, context: CallbackContext) -> None:
             return
 
         # Validate URL
-        is_valid, validation_message = validate_url(new_img_url)
+        is_valid, validation_message, content_type = await url_validator.validate(new_img_url)
         if not is_valid:
             await update.message.reply_text(f'Invalid URL: {validation_message}')
             return
         
-        is_video = 'video' in validation_message.lower() or any(ext in new_img_url.lower() for ext in ['.mp4', '.mov', '.avi', '.mkv'])
+        media_fields = media.classify(new_img_url, name=character_name, content_type=content_type)
+        is_video = media_fields['media_kind'] == media.VIDEO
 
         rarity_map = {
             1: "Common", 2: "Uncommon", 3: "Rare", 4: "Epic", 5: "Legendary", 
@@ -484,10 +638,19 @@ async def update_card(update: Update, context: CallbackContext) -> None:
                 'name': character_name,
                 'anime': anime,
                 'rarity': rarity,
-                'message_id': message.message_id
+                'message_id': message.message_id,
+                **media_fields
             }
             
-            await collection.update_one({'id': character_id}, {'$set': update_data})
+            # The new channel post's file replaces the old URL's
+            file_id = media.sent_file_id(message, is_video)
+            if file_id:
+                update_data['file_id'] = file_id
+                changes = {'$set': update_data}
+            else:
+                changes = {'$set': update_data, '$unset': {'file_id': ''}}
+            await collection.update_one({'id': character_id}, changes)
+            await catalogue.invalidate(character_id)
             
             # Try to delete old message if exists
             if 'message_id' in character:
@@ -505,8 +668,10 @@ async def update_card(update: Update, context: CallbackContext) -> None:
                 'img_url': new_img_url,
                 'name': character_name,
                 'anime': anime,
-                'rarity': rarity
-            }})
+                'rarity': rarity,
+                **media_fields
+            }, '$unset': {'file_id': ''}})
+            await catalogue.invalidate(character_id)
             await update.message.reply_text(f'Character updated in DB but failed to update in channel: {str(e)}')
 
     except Exception as e:
@@ -529,18 +694,15 @@ async def delete(update: Update, context: CallbackContext) -> None:
 
         
         character = await collection.find_one_and_delete({'id': args[0]})
+        catalogue.forget(args[0])
 
         if character:
+            status = await update.message.reply_text(f'<tg-emoji emoji-id="5103087490349139576">✅</tg-emoji> Character deleted from database; removing it from user collections in the background.',
+                parse_mode='HTML')
             # Also remove from all user collections
-            from shivu import user_collection
-            user_result = await user_collection.update_many(
-                {'characters.id': args[0]},
-                {'$pull': {'characters': {'id': args[0]}}}
-            )
+            await harem_store.remove_everywhere(args[0], status)
             
             await context.bot.delete_message(chat_id=CHARA_CHANNEL_ID, message_id=character['message_id'])
-            await update.message.reply_text(f'<tg-emoji emoji-id="5103087490349139576">✅</tg-emoji> Character deleted from database and removed from {user_result.modified_count} user collections.',
-                parse_mode='HTML')
         else:
             await update.message.reply_text('Deleted Successfully from db, but character not found In Channel')
     except Exception as e:
@@ -635,16 +797,9 @@ async def summon(update: Update, context: CallbackContext) -> None:
         character = random_character[0]
         chat_id = update.effective_chat.id
         
-        # Store character for marry command to find it
-        from shivu.__main__ import last_characters, first_correct_guesses, manually_summoned
-        last_characters[chat_id] = character
-        
-        # Mark as manually summoned to allow multiple marriages
-        manually_summoned[chat_id] = True
-        
-        # Clear any existing guesses for this chat
-        if chat_id in first_correct_guesses:
-            del first_correct_guesses[chat_id]
+        # Store character for marry command to find it; marked as manually
+        # summoned to allow multiple marriages (this also clears any existing guess)
+        chat_state.chat(chat_id).spawn(character, manual=True)
         
         # Get rarity emoji
         rarity_emoji = rarity_styles.get(character.get('rarity', ''), "")
@@ -703,41 +858,28 @@ async def remove_character_from_user(update: Update, context: CallbackContext) -
             return
 
         # Find the character first to show details
-        character = await collection.find_one({'id': character_id})
+        character = await catalogue.get(character_id)
         if not character:
             await update.message.reply_text(f'<tg-emoji emoji-id="5102962128843704400">❌</tg-emoji> Character with ID #{character_id} not found in database!',
                 parse_mode='HTML')
             return
 
         # Find the user
-        from shivu import user_collection
-        user = await user_collection.find_one({'id': user_id})
+        user = await users.get_profile(user_id)
         if not user:
             await update.message.reply_text(f'<tg-emoji emoji-id="5102962128843704400">❌</tg-emoji> User with ID {user_id} not found!',
                 parse_mode='HTML')
             return
 
         # Check if user has this character
-        user_character_count = sum(1 for c in user.get('characters', []) if c.get('id') == character_id)
+        user_character_count = await users.count_copies(user_id, character_id)
         if user_character_count == 0:
             await update.message.reply_text(f'<tg-emoji emoji-id="5102962128843704400">❌</tg-emoji> User does not have character #{character_id} ({character["name"]}) in their harem!',
                 parse_mode='HTML')
             return
 
-        # Remove one instance of the character
-        # Remove only one instance of the character (two-step process)
-        # First, unset the first matching character to null
-        await user_collection.update_one(
-            {'id': user_id, 'characters.id': character_id},
-            {'$unset': {'characters.$': 1}}
-        )
-        # Then pull the null values
-        result = await user_collection.update_one(
-            {'id': user_id},
-            {'$pull': {'characters': None}}
-        )
-
-        if result.modified_count > 0:
+        # Remove only one instance of the character
+        if await harem_store.remove_character(user_id, character_id):
             remaining_count = user_character_count - 1
             user_name = user.get('first_name', 'User')
             await update.message.reply_text(
@@ -770,7 +912,7 @@ async def find(update: Update, context: CallbackContext) -> None:
         character_id = args[0]
         
         # Search for character by ID
-        character = await collection.find_one({'id': character_id})
+        character = await catalogue.get(character_id)
         
         if not character:
             await update.message.reply_text(f'<tg-emoji emoji-id="5102962128843704400">❌</tg-emoji> No character found with ID #{character_id}',
@@ -780,26 +922,17 @@ async def find(update: Update, context: CallbackContext) -> None:
         # Get rarity emoji
         rarity_emoji = rarity_styles.get(character.get('rarity', ''), "<tg-emoji emoji-id='5102638339849192814'>✨</tg-emoji>")
         
-        # Find global catchers - users who have this character
-        global_catchers = []
-        total_caught = 0
-        
-        users_with_character = user_collection.find({"characters.id": character_id})
-        async for user in users_with_character:
-            user_id = user['id']
-            character_count = sum(1 for c in user.get('characters', []) if c.get('id') == character_id)
-            if character_count > 0:
-                user_name = user.get('first_name', f'User{user_id}')
-                global_catchers.append({
-                    'user_id': user_id,
-                    'name': user_name,
-                    'count': character_count
-                })
-                total_caught += character_count
-        
-        # Sort by count and get top 10
-        global_catchers.sort(key=lambda x: x['count'], reverse=True)
-        top_10 = global_catchers[:10]
+        # Global catchers come precomputed from the owner index
+        owners = await owner_index.summary(character_id)
+        total_caught = owners['total']
+        top_10 = [
+            {
+                'user_id': owner['user_id'],
+                'name': owner.get('first_name') or f"User{owner['user_id']}",
+                'count': owner['count']
+            }
+            for owner in owners['top']
+        ]
         
         # Create new format caption
         caption = f"OwO! Look out this character!\n\n"
@@ -835,13 +968,18 @@ async def find(update: Update, context: CallbackContext) -> None:
         processed_url = await process_image_url(display_url)
         
         # Check if it's a video and use appropriate send method
-        if await is_video_character(character, character_id, user_id):
+        if media.is_video(character, user_id):
             try:
-                await context.bot.send_video(
-                    chat_id=update.effective_chat.id,
-                    video=processed_url,
-                    caption=caption,
-                    parse_mode='HTML'
+                await catalogue.send_media(
+                    character,
+                    lambda file: context.bot.send_video(
+                        chat_id=update.effective_chat.id,
+                        video=file,
+                        caption=caption,
+                        parse_mode='HTML'
+                    ),
+                    processed_url,
+                    user_id,
                 )
             except Exception as video_error:
                 # Fallback: try sending as photo if video fails
@@ -861,11 +999,16 @@ async def find(update: Update, context: CallbackContext) -> None:
                         parse_mode='HTML'
                     )
         else:
-            await context.bot.send_photo(
-                chat_id=update.effective_chat.id,
-                photo=processed_url,
-                caption=caption,
-                parse_mode='HTML'
+            await catalogue.send_media(
+                character,
+                lambda file: context.bot.send_photo(
+                    chat_id=update.effective_chat.id,
+                    photo=file,
+                    caption=caption,
+                    parse_mode='HTML'
+                ),
+                processed_url,
+                user_id,
             )
         
     except Exception as e:
@@ -923,36 +1066,56 @@ async def update(update: Update, context: CallbackContext) -> None:
         else:
             new_value = args[2]
 
-        await collection.find_one_and_update({'id': args[0]}, {'$set': {args[1]: new_value}})
+        update_data = {args[1]: new_value}
+        if args[1] == 'img_url':
+            update_data.update(media.classify(new_value, name=character['name']))
+        elif args[1] == 'name':
+            update_data.update(media.character_fields({**character, 'name': new_value}))
 
-        # Update user collections when character properties change (including img_url)
-        from shivu import user_collection
-        user_update_result = await user_collection.update_many(
-            {'characters.id': args[0]},
-            {'$set': {f'characters.$[elem].{args[1]}': new_value}},
-            array_filters=[{'elem.id': args[0]}]
-        )
-        users_updated = user_update_result.modified_count
+        changes = {'$set': update_data}
+        if 'media_kind' in update_data and (
+                args[1] == 'img_url' or update_data['media_kind'] != character.get('media_kind')):
+            # The stored file_id is of the old URL, or was sent as the other kind
+            changes['$unset'] = {'file_id': ''}
+
+        await collection.find_one_and_update({'id': args[0]}, changes)
+        await catalogue.invalidate(args[0])
 
         if args[1] == 'img_url':
             await context.bot.delete_message(chat_id=CHARA_CHANNEL_ID, message_id=character['message_id'])
             rarity_emoji = rarity_styles.get(character["rarity"], "")
-            message = await context.bot.send_photo(
-                chat_id=CHARA_CHANNEL_ID,
-                photo=new_value,
-                caption=(
-                    f"<tg-emoji emoji-id='5102638339849192814'>✨</tg-emoji> <b>{character['name']}</b> <tg-emoji emoji-id='5102638339849192814'>✨</tg-emoji>\n"
-                    f"<tg-emoji emoji-id='5103013135875312074'>🎌</tg-emoji> <i>{character['anime']}</i>\n"
-                    f"━━━━━━━━━━━━━━━━\n"
-                    f"{rarity_emoji} <b>{character['rarity']}</b>\n"
-                    f"<tg-emoji emoji-id='5102716405174765315'>🆔</tg-emoji> <b>ID:</b> #{character['id']}\n"
-                    f"━━━━━━━━━━━━━━━━\n"
-                    f"📝 Updated by <a href='tg://user?id={update.effective_user.id}'>{update.effective_user.first_name}</a>"
-                ),
-                parse_mode='HTML'
+            caption = (
+                f"<tg-emoji emoji-id='5102638339849192814'>✨</tg-emoji> <b>{character['name']}</b> <tg-emoji emoji-id='5102638339849192814'>✨</tg-emoji>\n"
+                f"<tg-emoji emoji-id='5103013135875312074'>🎌</tg-emoji> <i>{character['anime']}</i>\n"
+                f"━━━━━━━━━━━━━━━━\n"
+                f"{rarity_emoji} <b>{character['rarity']}</b>\n"
+                f"<tg-emoji emoji-id='5102716405174765315'>🆔</tg-emoji> <b>ID:</b> #{character['id']}\n"
+                f"━━━━━━━━━━━━━━━━\n"
+                f"📝 Updated by <a href='tg://user?id={update.effective_user.id}'>{update.effective_user.first_name}</a>"
             )
+            is_video = update_data['media_kind'] == media.VIDEO
+            if is_video:
+                message = await context.bot.send_video(
+                    chat_id=CHARA_CHANNEL_ID,
+                    video=new_value,
+                    caption=caption,
+                    parse_mode='HTML'
+                )
+            else:
+                message = await context.bot.send_photo(
+                    chat_id=CHARA_CHANNEL_ID,
+                    photo=new_value,
+                    caption=caption,
+                    parse_mode='HTML'
+                )
             character['message_id'] = message.message_id
-            await collection.find_one_and_update({'id': args[0]}, {'$set': {'message_id': message.message_id}})
+            post_fields = {'message_id': message.message_id}
+            # The new channel post's file replaces the old URL's
+            file_id = media.sent_file_id(message, is_video)
+            if file_id:
+                post_fields['file_id'] = file_id
+            await collection.find_one_and_update({'id': args[0]}, {'$set': post_fields})
+            await catalogue.invalidate(args[0])
         else:
             # Update character dict with new value for accurate caption
             character[args[1]] = new_value
@@ -977,8 +1140,10 @@ async def update(update: Update, context: CallbackContext) -> None:
                 parse_mode='HTML'
             )
 
-        await update.message.reply_text(f'<tg-emoji emoji-id="5103087490349139576">✅</tg-emoji> Updated Done in Database!\n\n<tg-emoji emoji-id="5102802918701008521">📊</tg-emoji> {users_updated} user collection(s) synced.\n\nNote: Channel caption may take a moment to update.',
+        status = await update.message.reply_text(f'<tg-emoji emoji-id="5103087490349139576">✅</tg-emoji> Updated Done in Database!\n\n<tg-emoji emoji-id="5102802918701008521">📊</tg-emoji> User collections are synced in the background.\n\nNote: Channel caption may take a moment to update.',
                 parse_mode='HTML')
+        # Harems only hold ids, but users not yet migrated still embed character copies
+        await propagation.enqueue(UPDATE, args[0], {args[1]: new_value}, status)
     except Exception as e:
         await update.message.reply_text(f'I guess did not added bot in channel.. or character uploaded Long time ago.. Or character not exits.. orr Wrong id')
 
@@ -992,62 +1157,8 @@ async def migrate_rarities(update: Update, context: CallbackContext) -> None:
         await update.message.reply_text('You do not have permission to use this command.')
         return
 
-    try:
-        await update.message.reply_text('<tg-emoji emoji-id="5103051253710063171">🔄</tg-emoji> Starting rarity migration...\n\nUpdating database to change:\n• Celestial → Retro\n• Arcane → Zenith',
-                parse_mode='HTML')
-        
-        # Update main character collection
-        result_celestial = await collection.update_many(
-            {'rarity': 'Celestial'},
-            {'$set': {'rarity': 'Retro'}}
-        )
-        
-        result_arcane = await collection.update_many(
-            {'rarity': 'Arcane'}, 
-            {'$set': {'rarity': 'Zenith'}}
-        )
-        
-        # Update user collections
-        from shivu import user_collection
-        
-        user_result_celestial = await user_collection.update_many(
-            {'characters.rarity': 'Celestial'},
-            {'$set': {'characters.$[elem].rarity': 'Retro'}},
-            array_filters=[{'elem.rarity': 'Celestial'}]
-        )
-        
-        user_result_arcane = await user_collection.update_many(
-            {'characters.rarity': 'Arcane'},
-            {'$set': {'characters.$[elem].rarity': 'Zenith'}},
-            array_filters=[{'elem.rarity': 'Arcane'}]
-        )
-        
-        # Verify changes
-        celestial_count = await collection.count_documents({'rarity': 'Celestial'})
-        arcane_count = await collection.count_documents({'rarity': 'Arcane'})
-        retro_count = await collection.count_documents({'rarity': 'Retro'})
-        zenith_count = await collection.count_documents({'rarity': 'Zenith'})
-        
-        success_message = (
-            f'<tg-emoji emoji-id="5103087490349139576">✅</tg-emoji> <b>Migration Completed!</b>\n\n'
-            f'<tg-emoji emoji-id="5102802918701008521">📊</tg-emoji> <b>Characters updated:</b>\n'
-            f'• Celestial → Retro: {result_celestial.modified_count}\n'
-            f'• Arcane → Zenith: {result_arcane.modified_count}\n\n'
-            f'<tg-emoji emoji-id="5103039000168367836">👥</tg-emoji> <b>User collections updated:</b>\n'
-            f'• Celestial → Retro: {user_result_celestial.modified_count} users\n'
-            f'• Arcane → Zenith: {user_result_arcane.modified_count} users\n\n'
-            f'<tg-emoji emoji-id="5102650803844286939">🔍</tg-emoji> <b>Current counts:</b>\n'
-            f'• Retro: {retro_count}\n'
-            f'• Zenith: {zenith_count}\n'
-            f'• Old Celestial remaining: {celestial_count}\n'
-            f'• Old Arcane remaining: {arcane_count}'
-        )
-        
-        await update.message.reply_text(success_message, parse_mode='HTML')
-        
-    except Exception as e:
-        await update.message.reply_text(f'<tg-emoji emoji-id="5102962128843704400">❌</tg-emoji> Error during migration: {str(e)}',
-                parse_mode='HTML')
+    # Celestial → Retro, Arcane → Zenith; the catalogue one reloads the spawn pool when done
+    await migrations.run_migrations(update.message, ['catalogue_rarities', 'harem_rarities'], rerun=True)
 
 
 async def adduploader(update: Update, context: CallbackContext) -> None:
@@ -1222,14 +1333,15 @@ async def customupload(update: Update, context: CallbackContext) -> None:
             return
         
         # Validate URL
-        is_valid, validation_message = validate_url(url)
+        is_valid, validation_message, content_type = await url_validator.validate(url)
         if not is_valid:
             await update.message.reply_text(f'<tg-emoji emoji-id="5102962128843704400">❌</tg-emoji> Invalid URL: {validation_message}',
                 parse_mode='HTML')
             return
         
         # Determine URL type (image or video)
-        is_video = 'video' in validation_message.lower() or any(ext in url.lower() for ext in ['.mp4', '.mov', '.avi', '.mkv'])
+        slot_record = media.slot_record(url, content_type=content_type)
+        is_video = slot_record['type'] == media.VIDEO
         
         # Check if slot 2 must be video, slots 1 and 3 must be images
         if slot == 2 and not is_video:
@@ -1259,13 +1371,14 @@ async def customupload(update: Update, context: CallbackContext) -> None:
             custom_char['owner_slots'][owner_id_str] = {'1': None, '2': None, '3': None}
         
         # Update the specific slot for this owner
-        custom_char['owner_slots'][owner_id_str][str(slot)] = {'url': url, 'type': 'video' if is_video else 'image'}
+        custom_char['owner_slots'][owner_id_str][str(slot)] = slot_record
         
         # Update database
         await collection.update_one(
             {'_id': custom_char['_id']},
             {'$set': {'owner_slots': custom_char['owner_slots']}}
         )
+        await catalogue.invalidate(char_id)
         
         slot_type = '<tg-emoji emoji-id="5103000796434270751">🎬</tg-emoji> Video' if is_video else '<tg-emoji emoji-id="5102728190565025765">🖼️</tg-emoji> Image'
         slot_label = ['Mystical', 'Edit', 'Custom Nude'][slot - 1]
@@ -1362,6 +1475,7 @@ async def customchange(update: Update, context: CallbackContext) -> None:
                     {'_id': custom_char['_id']},
                     {'$set': {f'owner_slots.{user_id}._active': new_slot}}
                 )
+                await catalogue.invalidate(char_id)
                 
                 await update.message.reply_text(f'<tg-emoji emoji-id="5103087490349139576">✅</tg-emoji> Your active slot changed to slot {new_slot} for {custom_char["name"]}!',
                 parse_mode='HTML')
@@ -1468,9 +1582,10 @@ async def debug_card(update: Update, context: CallbackContext) -> None:
         char_id_str = str(card_id)
         char_id_int = int(card_id) if isinstance(card_id, str) and card_id.isdigit() else card_id
         
-        users_with_char = await user_collection.find({'characters.id': char_id_str}).to_list(None)
+        owner_fields = {'id': 1, 'first_name': 1}
+        users_with_char = await user_collection.find(harem_store.owned_query(char_id_str), owner_fields).to_list(None)
         if not users_with_char:
-            users_with_char = await user_collection.find({'characters.id': char_id_int}).to_list(None)
+            users_with_char = await user_collection.find(harem_store.owned_query(char_id_int), owner_fields).to_list(None)
         
         msg += f"<tg-emoji emoji-id='5103039000168367836'>👥</tg-emoji> Found {len(users_with_char)} owner(s):\n"
         for user in users_with_char:
@@ -1498,83 +1613,19 @@ async def migrate_slots(update: Update, context: CallbackContext) -> None:
         return
     
     # Check if user is admin/sudo
-    if update.effective_user.id not in sudo_users:
+    if str(update.effective_user.id) not in sudo_users:
         await update.message.reply_text('<tg-emoji emoji-id="5102962128843704400">❌</tg-emoji> Admin only command.',
                 parse_mode='HTML')
         return
     
-    try:
-        # Find all custom characters with old 'slots' format
-        old_format_chars = await collection.find({'rarity': 'Custom', 'slots': {'$exists': True}}).to_list(None)
-        
-        if not old_format_chars:
-            await update.message.reply_text('<tg-emoji emoji-id="5103087490349139576">✅</tg-emoji> No custom characters need migration.',
-                parse_mode='HTML')
-            return
-        
-        migrated_count = 0
-        failed_chars = []
-        
-        for char in old_format_chars:
-            char_id = char.get('id')
-            char_id_str = str(char_id)
-            char_id_int = int(char_id) if isinstance(char_id, str) and char_id.isdigit() else char_id
-            
-            old_slots = char.get('slots', {})
-            
-            # Find owners of this character - try both string and int formats
-            owners = []
-            users_with_char_str = await user_collection.find({'characters.id': char_id_str}).to_list(None)
-            users_with_char_int = await user_collection.find({'characters.id': char_id_int}).to_list(None)
-            users_with_char = users_with_char_str if users_with_char_str else users_with_char_int
-            
-            for user in users_with_char:
-                owner_id = str(user.get('id'))
-                if owner_id not in owners:
-                    owners.append(owner_id)
-            
-            # If owners found, migrate their slots
-            if len(owners) > 0:
-                # Create owner_slots from old slots
-                owner_slots = {}
-                
-                # Give each owner the full set of slots
-                for owner_id in owners[:2]:  # Limit to 2 owners
-                    owner_slots[owner_id] = {
-                        '1': old_slots.get('1'),
-                        '2': old_slots.get('2'),
-                        '3': old_slots.get('3'),
-                        '_active': 1
-                    }
-                
-                # Update character to new format
-                await collection.update_one(
-                    {'_id': char['_id']},
-                    {
-                        '$set': {'owner_slots': owner_slots},
-                        '$unset': {'slots': '', 'active_slot': ''}
-                    }
-                )
-                
-                migrated_count += 1
-            else:
-                failed_chars.append(char_id_str)
-        
-        msg = f'<tg-emoji emoji-id="5103087490349139576">✅</tg-emoji> Migration Complete!\n\n'
-        msg += f'Migrated: {migrated_count} custom character(s)\n'
-        if failed_chars:
-            msg += f'Failed (no owners): {", ".join(failed_chars)}\n'
-            msg += f'\n<tg-emoji emoji-id="5102684287409325796">💡</tg-emoji> Cards with no owners need to be in user harems first.'
-        
-        await update.message.reply_text(msg)
-        
-    except Exception as e:
-        await update.message.reply_text(f'<tg-emoji emoji-id="5102962128843704400">❌</tg-emoji> Migration error: {str(e)}',
-                parse_mode='HTML')
+    # Cards nobody owns yet are skipped and picked up by the next run
+    await migrations.run_migrations(update.message, ['custom_owner_slots'], rerun=True)
 
 
 UPLOAD_HANDLER = CommandHandler('upload', upload, block=False)
 application.add_handler(UPLOAD_HANDLER)
+BULKUPLOAD_HANDLER = CommandHandler('bulkupload', bulkupload, block=False)
+application.add_handler(BULKUPLOAD_HANDLER)
 DELETE_HANDLER = CommandHandler('delete', delete, block=False)
 application.add_handler(DELETE_HANDLER)
 SUMMON_HANDLER = CommandHandler('summon', summon, block=False)
@@ -0,0 +1,254 @@
+import asyncio
+from collections import Counter
+
+from pymongo import UpdateOne
+
+from shivu import character_owners_collection, character_stats_collection, user_collection, LOGGER
+
+
+FLUSH_INTERVAL = 5  # seconds between write-behind flushes
+TOP_OWNERS = 10
+
+
+class OwnerIndex:
+    """Who owns each character, for /find.
+
+    `character_owners` holds one document per (character, owner) with the
+    owner's copy count; `character_stats` holds one document per character
+    with the total number of copies and the top owners. Harem writes record
+    deltas here, which go out in one bulk_write per collection every
+    FLUSH_INTERVAL seconds. The stored top list is refreshed lazily: every
+    flush bumps the character's `version`, and a read that finds
+    `top_version` behind recomputes it from the owners index.
+
+    Characters nobody has asked about yet have no stats document; the first
+    /find builds it by scanning the harems once. Reads merge the unflushed
+    deltas into what's stored rather than flushing first.
+    """
+
+    def __init__(self):
+        self._deltas = {}  # (character_id, user_id) -> copies gained or lost
+        self._names = {}  # user_id -> first name, when the writer knew it
+        self._rebuilding = set()  # characters whose harems are being recounted
+        self._raced = set()  # of those, ones that changed during the recount
+        self._rebuilds = {}  # character_id -> recount in flight
+        self._task = None
+        self._flush_lock = asyncio.Lock()
+
+    def record(self, character_id, user_id, delta, first_name=None):
+        if character_id in self._rebuilding:
+            # The recount may or may not see this change; it is redone instead
+            self._raced.add(character_id)
+            return
+        key = (character_id, user_id)
+        self._deltas[key] = self._deltas.get(key, 0) + delta
+        if first_name is not None:
+            self._names[user_id] = first_name
+
+    def record_many(self, user_id, counts, sign=1, first_name=None):
+        """Record {character_id: copies} gained (sign=1) or lost (sign=-1) by one user"""
+        for character_id, count in counts.items():
+            self.record(character_id, user_id, sign * count, first_name)
+
+    async def flush(self):
+        async with self._flush_lock:
+            await self._flush()
+
+    async def _flush(self):
+        if not self._deltas:
+            return 0
+        deltas, self._deltas = self._deltas, {}
+        names, self._names = self._names, {}
+
+        owner_ops = []
+        totals = Counter()
+        for (character_id, user_id), delta in deltas.items():
+            if not delta:
+                continue
+            update = {'$inc': {'count': delta}}
+            if user_id in names:
+                update['$set'] = {'first_name': names[user_id]}
+            owner_ops.append(UpdateOne({'character_id': character_id, 'user_id': user_id}, update, upsert=True))
+            totals[character_id] += delta
+        stats_ops = [
+            UpdateOne({'_id': character_id}, {'$inc': {'total': delta, 'version': 1}}, upsert=True)
+            for character_id, delta in totals.items()
+        ]
+        if not owner_ops:
+            return 0
+
+        try:
+            await character_owners_collection.bulk_write(owner_ops, ordered=False)
+            if stats_ops:
+                await character_stats_collection.bulk_write(stats_ops, ordered=False)
+            # Owners that traded or gifted away their last copy
+            await character_owners_collection.delete_many(
+                {'character_id': {'$in': list(totals)}, 'count': {'$lte': 0}}
+            )
+        except Exception as e:
+            # Retrying could double count; mark the characters for a rebuild instead
+            LOGGER.error(f"Failed to flush owner index: {e}")
+            await self._invalidate(list({character_id for character_id, _ in deltas}))
+            return 0
+        return len(owner_ops)
+
+    async def _invalidate(self, character_ids):
+        try:
+            await character_stats_collection.update_many(
+                {'_id': {'$in': character_ids}}, {'$set': {'built': False}}
+            )
+        except Exception as e:
+            LOGGER.error(f"Failed to invalidate owner index for {len(character_ids)} characters: {e}")
+
+    # ----- reading -----
+
+    async def summary(self, character_id) -> dict:
+        """{'total': copies owned across all users, 'top': [{'user_id', 'first_name', 'count'}]}"""
+        # Hold off flushes so a delta can't be both in the snapshot and in what we read
+        async with self._flush_lock:
+            pending = {
+                user_id: delta for (cid, user_id), delta in self._deltas.items()
+                if cid == character_id and delta
+            }
+            names = {user_id: self._names[user_id] for user_id in pending if user_id in self._names}
+            stats = await character_stats_collection.find_one({'_id': character_id})
+            if stats is not None and stats.get('built'):
+                top = stats.get('top', [])
+                if stats.get('top_version') != stats.get('version'):
+                    top = await self._refresh_top(character_id, stats.get('version'))
+                stored = await self._owners(character_id, list(pending)) if pending else []
+        if stats is None or not stats.get('built'):
+            return await self.rebuild(character_id)
+        if not pending:
+            return {'total': stats.get('total', 0), 'top': top}
+
+        owners = {owner['user_id']: dict(owner) for owner in stored}
+        for owner in top:
+            owners.setdefault(owner['user_id'], dict(owner))
+        for user_id, delta in pending.items():
+            owner = owners.setdefault(user_id, {'user_id': user_id, 'first_name': None, 'count': 0})
+            owner['count'] += delta
+            if user_id in names:
+                owner['first_name'] = names[user_id]
+        top = sorted(
+            (owner for owner in owners.values() if owner['count'] > 0),
+            key=lambda owner: owner['count'], reverse=True
+        )[:TOP_OWNERS]
+        return {'total': stats.get('total', 0) + sum(pending.values()), 'top': top}
+
+    async def _owners(self, character_id, user_ids):
+        """Stored owner rows of `user_ids` for one character"""
+        return await character_owners_collection.find(
+            {'character_id': character_id, 'user_id': {'$in': user_ids}},
+            {'_id': 0, 'user_id': 1, 'first_name': 1, 'count': 1}
+        ).to_list(length=None)
+
+    async def _top(self, character_id):
+        cursor = character_owners_collection.find(
+            {'character_id': character_id, 'count': {'$gt': 0}},
+            {'_id': 0, 'user_id': 1, 'first_name': 1, 'count': 1}
+        ).sort('count', -1).limit(TOP_OWNERS)
+        return await cursor.to_list(length=TOP_OWNERS)
+
+    async def _refresh_top(self, character_id, version):
+        top = await self._top(character_id)
+        # A flush in the meantime bumps the version and the next read recomputes
+        await character_stats_collection.update_one(
+            {'_id': character_id, 'version': version},
+            {'$set': {'top': top, 'top_version': version}}
+        )
+        return top
+
+    # ----- (re)building -----
+
+    async def rebuild(self, character_id) -> dict:
+        """Recount one character from the harems themselves"""
+        running = self._rebuilds.get(character_id)
+        if running is None:
+            running = self._rebuilds[character_id] = asyncio.ensure_future(self._rebuild(character_id))
+            running.add_done_callback(lambda _: self._rebuilds.pop(character_id, None))
+        return await asyncio.shield(running)
+
+    async def _rebuild(self, character_id):
+        from shivu import harem_store
+
+        # The scan below already sees every pending change for this character,
+        # and changes made until its counts are written are fenced off by record()
+        async with self._flush_lock:
+            self._deltas = {key: d for key, d in self._deltas.items() if key[0] != character_id}
+            self._rebuilding.add(character_id)
+            self._raced.discard(character_id)
+
+        try:
+            # Unlocked: flushes and other reads go on while the harems are scanned
+            owners = []
+            cursor = user_collection.find(
+                harem_store.owned_query(character_id),
+                {'id': 1, 'first_name': 1, harem_store.counts_field(character_id): 1, 'characters.id': 1}
+            )
+            async for user in cursor:
+                count = harem_store.copies(user, character_id)
+                if count > 0:
+                    owners.append({
+                        'character_id': character_id,
+                        'user_id': user['id'],
+                        'first_name': user.get('first_name'),
+                        'count': count,
+                    })
+
+            total = sum(owner['count'] for owner in owners)
+            top = [
+                {key: owner[key] for key in ('user_id', 'first_name', 'count')}
+                for owner in sorted(owners, key=lambda owner: owner['count'], reverse=True)[:TOP_OWNERS]
+            ]
+            async with self._flush_lock:
+                await character_owners_collection.delete_many({'character_id': character_id})
+                if owners:
+                    await character_owners_collection.insert_many(owners, ordered=False)
+
+                # From here changes are buffered again and flushed on top of these counts,
+                # once the lock is released. A harem that changed mid-scan: show this
+                # count, but recount on the next read
+                self._rebuilding.discard(character_id)
+                built = character_id not in self._raced
+                await character_stats_collection.update_one(
+                    {'_id': character_id},
+                    {'$set': {'total': total, 'top': top, 'built': built, 'version': 0, 'top_version': 0}},
+                    upsert=True
+                )
+        finally:
+            self._rebuilding.discard(character_id)
+            self._raced.discard(character_id)
+        return {'total': total, 'top': top}
+
+    async def forget(self, character_id):
+        """Drop a character that left the catalogue"""
+        async with self._flush_lock:
+            self._deltas = {key: d for key, d in self._deltas.items() if key[0] != character_id}
+            await character_owners_collection.delete_many({'character_id': character_id})
+            await character_stats_collection.delete_one({'_id': character_id})
+
+    # ----- lifecycle -----
+
+    async def _run(self, interval):
+        while True:
+            await asyncio.sleep(interval)
+            await self.flush()
+
+    def start(self, interval=FLUSH_INTERVAL):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run(interval))
+
+    async def stop(self):
+        """Stop the flush loop and write out whatever is left"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+
+owner_index = OwnerIndex()
@@ -0,0 +1,164 @@
+import asyncio
+from datetime import datetime, timezone
+from html import escape
+
+from pymongo import UpdateOne
+
+from shivu import application, user_collection, propagation_jobs_collection, LOGGER
+from shivu import harem_store, migrations
+from shivu.harem_views import harem_views
+
+
+BATCH_SIZE = 500
+BATCH_PAUSE = 0.2  # seconds between batches, so live claims keep the database
+REPORT_EVERY = 5  # batches between progress edits
+RETRY_DELAY = 60
+MAX_ATTEMPTS = 5
+
+UPDATE = 'update'
+DELETE = 'delete'
+
+PENDING = 'pending'
+DONE = 'done'
+FAILED = 'failed'
+
+
+def _migration(job):
+    """The harem walk for a job, run and checkpointed like any migration"""
+    character_id = job['character_id']
+    legacy = harem_store.LEGACY_FIELD
+    if job['kind'] == DELETE:
+        query = harem_store.owned_query(character_id)
+        change = harem_store.removal_update(character_id)
+        plan = lambda user: UpdateOne({'_id': user['_id']}, change)
+        description = f'Remove character {character_id} from every harem'
+    else:
+        # Harems only hold ids, but users not yet migrated still embed character copies
+        query = {f'{legacy}.id': character_id}
+        change = {'$set': {f'{legacy}.$[elem].{field}': value for field, value in job['fields'].items()}}
+        plan = lambda user: UpdateOne({'_id': user['_id']}, change, array_filters=[{'elem.id': character_id}])
+        description = f'Copy the edit of character {character_id} into embedded harem copies'
+
+    return migrations.Migration(
+        0, f"propagate-{job['_id']}", user_collection, query, plan,
+        projection={'_id': 1}, batch_size=BATCH_SIZE, description=description,
+    )
+
+
+class Propagation:
+    """Fan-out of catalogue edits and deletions into the harems.
+
+    The command handler writes the catalogue and queues a job here; the job is
+    stored in `propagation_jobs` and a single worker walks user_collection in
+    _id order, BATCH_SIZE users per bulk_write with a pause in between, through
+    the migrations runner, so an interrupted job resumes from its checkpoint
+    on the next start. Jobs run one at a time, oldest first, so successive
+    edits of a character land in order. Progress goes to the admin's status
+    message.
+    """
+
+    def __init__(self):
+        self._task = None
+        self._wakeup = None
+
+    def start(self):
+        """Run queued jobs in the background, including ones a restart interrupted"""
+        if self._wakeup is None:
+            self._wakeup = asyncio.Event()
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        self._wakeup.set()
+
+    async def enqueue(self, kind, character_id, fields=None, status=None) -> dict:
+        """Queue a fan-out; `status` is the message to keep up to date"""
+        job = {
+            'kind': kind,
+            'character_id': character_id,
+            'fields': fields or {},
+            'state': PENDING,
+            'attempts': 0,
+            'created_at': datetime.now(timezone.utc),
+        }
+        if status is not None:
+            job['chat_id'] = status.chat_id
+            job['message_id'] = status.message_id
+            job['status_text'] = status.text_html
+        await propagation_jobs_collection.insert_one(job)
+        self.start()
+        return job
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            try:
+                job = await propagation_jobs_collection.find_one({'state': PENDING}, sort=[('_id', 1)])
+            except Exception as e:
+                # A network blip or failover mustn't end the worker: jobs would pile up unrun
+                LOGGER.error(f"Propagation queue poll failed, retrying in {RETRY_DELAY}s: {e}")
+                await asyncio.sleep(RETRY_DELAY)
+                continue
+            if job is None:
+                await self._wakeup.wait()
+                continue
+            try:
+                await self._process(job)
+            except Exception as e:
+                await self._failed(job, e)
+
+    async def _failed(self, job, error):
+        attempts = job.get('attempts', 0) + 1
+        state = FAILED if attempts >= MAX_ATTEMPTS else PENDING
+        LOGGER.error(f"Propagation job {job['_id']} ({job['kind']} {job['character_id']}) "
+                     f"stopped, attempt {attempts}: {error}")
+        try:
+            await propagation_jobs_collection.update_one(
+                {'_id': job['_id']}, {'$set': {'attempts': attempts, 'state': state, 'error': str(error)}}
+            )
+        except Exception as e:
+            LOGGER.error(f"Couldn't record the failure of propagation job {job['_id']}: {e}")
+        if state == FAILED:
+            await self._report(job, f"<tg-emoji emoji-id='5102962128843704400'>❌</tg-emoji> "
+                                    f"Harem sync failed: {escape(str(error))}")
+        else:
+            await asyncio.sleep(RETRY_DELAY)
+
+    async def _process(self, job):
+        migration = _migration(job)
+
+        async def report(progress):
+            await self._report(job, f"<tg-emoji emoji-id='5103051253710063171'>🔄</tg-emoji> "
+                                    f"Syncing harems: {progress.scanned} checked, {progress.modified} updated")
+
+        progress = await migrations.run(
+            migration, pause=BATCH_PAUSE, report=report, report_every=REPORT_EVERY
+        )
+        await propagation_jobs_collection.update_one(
+            {'_id': job['_id']},
+            {'$set': {
+                'state': DONE,
+                'scanned': progress.scanned,
+                'modified': progress.modified,
+                'finished_at': datetime.now(timezone.utc),
+            }}
+        )
+        await migrations.reset(migration)
+        if job['kind'] == DELETE:
+            # Views built while the walk ran may still hold legacy copies
+            harem_views.clear()
+        await self._report(job, f"<tg-emoji emoji-id='5103087490349139576'>✅</tg-emoji> "
+                                f"Harems synced: {progress.modified} user collection(s) updated.")
+
+    async def _report(self, job, line):
+        """Show `line` under the admin's original status message"""
+        if not job.get('chat_id'):
+            return
+        text = f"{job.get('status_text', '')}\n\n{line}"
+        try:
+            await application.bot.edit_message_text(
+                text, chat_id=job['chat_id'], message_id=job['message_id'], parse_mode='HTML'
+            )
+        except Exception as e:
+            LOGGER.warning(f"Propagation progress edit failed: {e}")
+
+
+propagation = Propagation()
@@ -0,0 +1,157 @@
+"""Indexes the bot relies on, and a check that its hot queries actually use them.
+
+    python -m shivu.schema    # create missing indexes, then fail on any COLLSCAN
+"""
+import asyncio
+import sys
+from collections import namedtuple
+
+from pymongo import ASCENDING, DESCENDING, IndexModel
+
+from shivu import (
+    collection, user_collection, user_totals_collection, group_user_totals_collection,
+    top_global_groups_collection, banned_users_collection, locked_spawns_collection,
+    spawn_counters_collection, character_owners_collection, character_stats_collection,
+    propagation_jobs_collection, LOGGER
+)
+
+
+# Declared per collection; ensure_indexes creates whatever is missing
+INDEXES = {
+    collection: [
+        IndexModel([('id', ASCENDING)], unique=True),
+        IndexModel([('anime', ASCENDING)]),
+    ],
+    user_collection: [
+        IndexModel([('id', ASCENDING)], unique=True),
+        # Harems of users the char_counts migration hasn't reached yet
+        IndexModel([('characters.id', ASCENDING)]),
+        # char_counts keys are character ids, so only a wildcard index can cover them
+        IndexModel([('char_counts.$**', ASCENDING)]),
+    ],
+    user_totals_collection: [
+        IndexModel([('chat_id', ASCENDING)]),
+    ],
+    group_user_totals_collection: [
+        IndexModel([('group_id', ASCENDING), ('user_id', ASCENDING)], unique=True),
+        IndexModel([('group_id', ASCENDING), ('count', DESCENDING)]),
+    ],
+    top_global_groups_collection: [
+        IndexModel([('group_id', ASCENDING)], unique=True),
+        IndexModel([('count', DESCENDING)]),
+    ],
+    banned_users_collection: [
+        IndexModel([('user_id', ASCENDING)]),
+        IndexModel([('unban_date', ASCENDING)]),
+    ],
+    locked_spawns_collection: [
+        IndexModel([('character_id', ASCENDING)]),
+    ],
+    spawn_counters_collection: [
+        IndexModel([('chat_id', ASCENDING)], unique=True),
+    ],
+    character_owners_collection: [
+        IndexModel([('character_id', ASCENDING), ('user_id', ASCENDING)], unique=True),
+        IndexModel([('character_id', ASCENDING), ('count', DESCENDING)]),
+    ],
+    propagation_jobs_collection: [
+        IndexModel([('state', ASCENDING), ('_id', ASCENDING)]),
+    ],
+}
+
+
+HotQuery = namedtuple('HotQuery', 'name collection filter sort')
+
+# Queries on the message and command hot paths; each must be answered from an index
+HOT_QUERIES = [
+    HotQuery('character by id', collection, {'id': '1'}, None),
+    HotQuery('characters of an anime', collection, {'anime': 'x'}, None),
+    HotQuery('user by id', user_collection, {'id': 1}, None),
+    HotQuery('claim with daily limit', user_collection, {'id': 1, 'daily_marriages.x': {'$not': {'$gte': 1}}}, None),
+    HotQuery('owners of a character', user_collection,
+             {'$or': [{'char_counts.1': {'$gte': 1}}, {'characters.id': '1'}]}, None),
+    HotQuery('chat settings', user_totals_collection, {'chat_id': '1'}, None),
+    HotQuery('group member total', group_user_totals_collection, {'user_id': 1, 'group_id': 1}, None),
+    HotQuery('group top users', group_user_totals_collection, {'group_id': 1}, [('count', DESCENDING)]),
+    HotQuery('top groups', top_global_groups_collection, {}, [('count', DESCENDING)]),
+    HotQuery('ban of a user', banned_users_collection, {'user_id': 1}, None),
+    HotQuery('expired bans', banned_users_collection, {'unban_date': {'$lte': 0}}, None),
+    HotQuery('spawn lock', locked_spawns_collection, {'character_id': '1'}, None),
+    HotQuery('spawn counter', spawn_counters_collection, {'chat_id': 1}, None),
+    HotQuery('character top owners', character_owners_collection,
+             {'character_id': '1', 'count': {'$gt': 0}}, [('count', DESCENDING)]),
+    HotQuery('character stats', character_stats_collection, {'_id': '1'}, None),
+]
+
+
+class CollectionScanError(RuntimeError):
+    """A registered hot query is planned as a full collection scan"""
+
+
+async def ensure_indexes():
+    """Create every declared index that doesn't exist yet; safe to run on every start"""
+    async def ensure(coll, models):
+        # One at a time: duplicates left by older racy writes can block a unique
+        # index, and that mustn't keep the collection's other indexes from being built
+        created = []
+        for model in models:
+            try:
+                created += await coll.create_indexes([model])
+            except Exception as e:
+                # Usually an existing index with other options, or duplicates blocking a unique one
+                LOGGER.error(f"Failed to create index {model.document['name']} on {coll.name}: {e}")
+        if created:
+            LOGGER.info(f"Indexes on {coll.name}: {', '.join(created)}")
+
+    await asyncio.gather(*(ensure(coll, models) for coll, models in INDEXES.items()))
+
+
+def _stages(plan):
+    """Every stage name anywhere in an explain() plan"""
+    if isinstance(plan, dict):
+        if 'stage' in plan:
+            yield plan['stage']
+        for value in plan.values():
+            yield from _stages(value)
+    elif isinstance(plan, list):
+        for value in plan:
+            yield from _stages(value)
+
+
+async def check_query_plans(strict=False):
+    """explain() every hot query and report the ones planned as a COLLSCAN.
+
+    Returns the names of the offending queries; with `strict` raises
+    CollectionScanError instead.
+    """
+    scans = []
+    for query in HOT_QUERIES:
+        cursor = query.collection.find(query.filter)
+        if query.sort:
+            cursor = cursor.sort(query.sort)
+        try:
+            explain = await cursor.explain()
+        except Exception as e:
+            LOGGER.error(f"Could not explain hot query '{query.name}': {e}")
+            continue
+        if 'COLLSCAN' in set(_stages(explain.get('queryPlanner', {}).get('winningPlan', {}))):
+            LOGGER.error(f"Hot query '{query.name}' on {query.collection.name} is a COLLSCAN: {query.filter}")
+            scans.append(query.name)
+
+    if scans and strict:
+        raise CollectionScanError(f"{len(scans)} hot queries scan their collection: {', '.join(scans)}")
+    return scans
+
+
+async def _main():
+    await ensure_indexes()
+    await check_query_plans(strict=True)
+    print(f"{len(HOT_QUERIES)} hot queries use an index")
+
+
+if __name__ == '__main__':
+    try:
+        asyncio.run(_main())
+    except CollectionScanError as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
@@ -0,0 +1,96 @@
+import time
+from array import array
+
+from shivu import LOGGER
+from shivu.chat_state import chat_state
+
+
+SPAM_MESSAGE_LIMIT = 7  # Max messages allowed
+SPAM_TIME_WINDOW = 10  # Time window in seconds to check for spam
+BLOCK_DURATION = 720  # Block duration in seconds (12 minutes)
+
+# Upper bound for a per-chat message limit; also the size of every user's ring buffer
+MAX_SPAM_LIMIT = 30
+
+
+class SpamPolicy:
+    """More than `limit` messages within `window` seconds blocks for `block_duration` seconds"""
+
+    __slots__ = ('limit', 'window', 'block_duration')
+
+    def __init__(self, limit=SPAM_MESSAGE_LIMIT, window=SPAM_TIME_WINDOW, block_duration=BLOCK_DURATION):
+        if not 1 <= limit <= MAX_SPAM_LIMIT:
+            raise ValueError(f"limit must be between 1 and {MAX_SPAM_LIMIT}")
+        if window <= 0 or block_duration <= 0:
+            raise ValueError("window and block duration must be positive")
+        self.limit = int(limit)
+        self.window = window
+        self.block_duration = block_duration
+
+    def __eq__(self, other):
+        return (isinstance(other, SpamPolicy)
+                and (self.limit, self.window, self.block_duration) == (other.limit, other.window, other.block_duration))
+
+    def __repr__(self):
+        return f"SpamPolicy(limit={self.limit}, window={self.window}, block_duration={self.block_duration})"
+
+
+DEFAULT_POLICY = SpamPolicy()
+
+
+def record_message(record, now, policy=DEFAULT_POLICY) -> bool:
+    """Log one message in a user's ring buffer; True if it trips the policy.
+
+    The ring holds the last MAX_SPAM_LIMIT timestamps, so "more than `limit`
+    messages in `window`" is a single lookup of the message `limit` places back.
+    """
+    ring = record.ring
+    if ring is None:
+        ring = record.ring = array('d', bytes(8 * MAX_SPAM_LIMIT))
+
+    head = record.head
+    if record.count >= policy.limit:
+        oldest = ring[(head - policy.limit) % MAX_SPAM_LIMIT]
+        if now - oldest <= policy.window:
+            record.blocked_until = now + policy.block_duration
+            record.count = 0  # Clear message history
+            return True
+
+    ring[head] = now
+    record.head = (head + 1) % MAX_SPAM_LIMIT
+    if record.count < MAX_SPAM_LIMIT:
+        record.count += 1
+    return False
+
+
+def detect_spam(user_id: int, policy=DEFAULT_POLICY) -> bool:
+    """Detect if user is sending messages too quickly"""
+    if record_message(chat_state.user(user_id), time.time(), policy):
+        LOGGER.warning(f"User {user_id} blocked for spam (sent more than {policy.limit} messages in {policy.window}s)")
+        return True
+    return False
+
+
+def blocked_for(user_id: int) -> float:
+    """Seconds left on a user's spam block (0 if not blocked)"""
+    record = chat_state.get_user(user_id)
+    if record is None or not record.blocked_until:
+        return 0
+    remaining = record.blocked_until - time.time()
+    if remaining > 0:
+        return remaining
+    # Block expired
+    record.blocked_until = 0.0
+    return 0
+
+
+def is_user_blocked(user_id: int) -> bool:
+    """Check if user is currently blocked"""
+    return blocked_for(user_id) > 0
+
+
+def unblock(user_id: int) -> bool:
+    """Lift a spam block and forget the user's history; True if they were blocked"""
+    was_blocked = is_user_blocked(user_id)
+    chat_state.drop_user(user_id)
+    return was_blocked
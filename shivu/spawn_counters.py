@@ -0,0 +1,135 @@
+import asyncio
+import time
+
+from pymongo import UpdateOne
+
+from shivu import spawn_counters_collection, LOGGER
+
+
+# Counter kinds persisted per chat
+KINDS = ('normal', 'star', 'zenith_event')
+
+FLUSH_INTERVAL = 30  # seconds between write-behind flushes
+IDLE_TTL = 3600  # flushed chats quiet this long are dropped from memory
+
+
+class SpawnCounters:
+    """Per-chat progress toward the next spawn.
+
+    Increments stay in memory; chats touched since the last flush are written
+    back with one bulk_write every FLUSH_INTERVAL seconds and on shutdown.
+    A chat's counts are read back from Mongo the first time it is seen, and
+    again once it has been quiet for IDLE_TTL: flushed chats are dropped then.
+    """
+
+    def __init__(self):
+        self._counts = {}  # chat_id -> {kind: count}
+        self._dirty = set()
+        self._touched = {}  # chat_id -> monotonic time it was last seen
+        self._loading = {}  # chat_id -> Future while its counts are being read
+        self._task = None
+
+    async def ensure_chat(self, chat_id):
+        if chat_id in self._counts:
+            # Seen now, so forget_idle() can't drop it before the increment that follows
+            self._touched[chat_id] = time.monotonic()
+            return
+
+        pending = self._loading.get(chat_id)
+        if pending is not None:
+            await pending
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        self._loading[chat_id] = future
+        try:
+            counts = dict.fromkeys(KINDS, 0)
+            try:
+                doc = await spawn_counters_collection.find_one({'chat_id': chat_id}, {'_id': 0, 'counts': 1})
+                if doc:
+                    for kind, value in (doc.get('counts') or {}).items():
+                        if kind in counts:
+                            counts[kind] = int(value)
+            except Exception as e:
+                LOGGER.error(f"Failed to load spawn counters for chat {chat_id}: {e}")
+            self._counts[chat_id] = counts
+            self._touched[chat_id] = time.monotonic()
+        finally:
+            del self._loading[chat_id]
+            future.set_result(None)
+
+    def increment(self, chat_id, kind) -> int:
+        counts = self._counts.setdefault(chat_id, dict.fromkeys(KINDS, 0))
+        counts[kind] += 1
+        self._dirty.add(chat_id)
+        self._touched[chat_id] = time.monotonic()
+        return counts[kind]
+
+    def reset(self, chat_id, kind):
+        counts = self._counts.setdefault(chat_id, dict.fromkeys(KINDS, 0))
+        counts[kind] = 0
+        self._dirty.add(chat_id)
+        self._touched[chat_id] = time.monotonic()
+
+    def get(self, chat_id, kind) -> int:
+        counts = self._counts.get(chat_id)
+        return counts[kind] if counts else 0
+
+    async def flush(self):
+        """Write every chat changed since the last flush in a single bulk_write"""
+        if not self._dirty:
+            return 0
+
+        dirty, self._dirty = self._dirty, set()
+        operations = [
+            UpdateOne(
+                {'chat_id': chat_id},
+                {'$set': {f'counts.{kind}': value for kind, value in self._counts[chat_id].items()}},
+                upsert=True
+            )
+            for chat_id in dirty
+        ]
+        try:
+            await spawn_counters_collection.bulk_write(operations, ordered=False)
+        except Exception as e:
+            # Keep them dirty so the next flush retries
+            self._dirty |= dirty
+            LOGGER.error(f"Failed to flush spawn counters for {len(dirty)} chats: {e}")
+            return 0
+        return len(operations)
+
+    def forget_idle(self, ttl=IDLE_TTL):
+        """Drop chats that are written back and haven't changed for `ttl` seconds"""
+        cutoff = time.monotonic() - ttl
+        idle = [
+            chat_id for chat_id in self._counts
+            if chat_id not in self._dirty and self._touched.get(chat_id, 0) < cutoff
+        ]
+        for chat_id in idle:
+            del self._counts[chat_id]
+            self._touched.pop(chat_id, None)
+        return len(idle)
+
+    async def _run(self, interval):
+        while True:
+            await asyncio.sleep(interval)
+            await self.flush()
+            self.forget_idle()
+
+    def start(self, interval=FLUSH_INTERVAL):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run(interval))
+
+    async def stop(self):
+        """Stop the flush loop and write out whatever is left"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+
+spawn_counters = SpawnCounters()
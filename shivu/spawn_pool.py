@@ -0,0 +1,311 @@
+import asyncio
+import random
+
+from shivu import collection, locked_spawns_collection, LOGGER
+
+
+# Main GC gets boosted Retro/Zenith rates
+MAIN_GC_ID = -1002961536913
+
+# Higher weight = more likely to spawn
+RARITY_WEIGHTS = {
+    "normal": {
+        "Common": 100,
+        "Uncommon": 80,
+        "Rare": 50,
+        "Epic": 30,
+        "Legendary": 10,
+        "Mythic": 5,
+        "Retro": 5,
+        "Zenith": 1,
+        "Limited Edition": 0.25,
+        "Custom": 0
+    },
+    "main_gc": {
+        "Common": 100,
+        "Uncommon": 80,
+        "Rare": 50,
+        "Epic": 30,
+        "Legendary": 10,
+        "Mythic": 5,
+        "Retro": 20,
+        "Zenith": 10,
+        "Limited Edition": 0.25,
+        "Custom": 0
+    },
+}
+
+# Custom characters never spawn; Star is only reachable through its own spawn
+NEVER_SPAWN_RARITIES = {"Custom"}
+
+# Event tag -> marker that must appear in the character name
+EVENT_MARKERS = {
+    "christmas": "🎄",
+}
+
+
+def weight_profile_for(chat_id) -> str:
+    """Return the rarity weight profile used for a chat"""
+    return "main_gc" if chat_id == MAIN_GC_ID else "normal"
+
+
+def event_tags_for(character) -> tuple:
+    """Return the event tags a character belongs to"""
+    name = character.get('name', '')
+    return tuple(tag for tag, marker in EVENT_MARKERS.items() if marker in name)
+
+
+class AliasTable:
+    """Vose's alias method: O(n) build, O(1) weighted sampling"""
+
+    __slots__ = ('outcomes', 'prob', 'alias')
+
+    def __init__(self, outcomes, weights):
+        n = len(outcomes)
+        total = float(sum(weights))
+        self.outcomes = list(outcomes)
+        self.prob = [0.0] * n
+        self.alias = [0] * n
+
+        scaled = [w * n / total for w in weights]
+        small = [i for i, p in enumerate(scaled) if p < 1.0]
+        large = [i for i, p in enumerate(scaled) if p >= 1.0]
+
+        while small and large:
+            s = small.pop()
+            l = large.pop()
+            self.prob[s] = scaled[s]
+            self.alias[s] = l
+            scaled[l] = (scaled[l] + scaled[s]) - 1.0
+            if scaled[l] < 1.0:
+                small.append(l)
+            else:
+                large.append(l)
+
+        # Whatever is left is 1.0 up to float error
+        for i in large + small:
+            self.prob[i] = 1.0
+
+    def sample(self, rng=random):
+        i = int(rng.random() * len(self.outcomes))
+        if rng.random() < self.prob[i]:
+            return self.outcomes[i]
+        return self.outcomes[self.alias[i]]
+
+
+class _Bucket:
+    """Set of character ids with O(1) add, remove and uniform choice"""
+
+    __slots__ = ('ids', 'positions')
+
+    def __init__(self):
+        self.ids = []
+        self.positions = {}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def add(self, char_id):
+        if char_id in self.positions:
+            return
+        self.positions[char_id] = len(self.ids)
+        self.ids.append(char_id)
+
+    def discard(self, char_id):
+        pos = self.positions.pop(char_id, None)
+        if pos is None:
+            return
+        last = self.ids.pop()
+        if pos < len(self.ids):
+            self.ids[pos] = last
+            self.positions[last] = pos
+
+    def choice(self, recent=(), rng=random, attempts=8):
+        """Pick a uniform id, avoiding ids in `recent` when possible"""
+        if not self.ids:
+            return None
+        if recent:
+            for _ in range(attempts):
+                char_id = self.ids[int(rng.random() * len(self.ids))]
+                if char_id not in recent:
+                    return char_id
+            # Bucket is mostly recent spawns - fall back to an exact filter
+            fresh = [c for c in self.ids if c not in recent]
+            if fresh:
+                return rng.choice(fresh)
+        return self.ids[int(rng.random() * len(self.ids))]
+
+
+class SpawnPool:
+    """Resident catalogue bucketed by (event tag, rarity) with locked ids excluded.
+
+    Also indexes the whole catalogue, locked and unspawnable characters
+    included, by anime for the harem page headers.
+    """
+
+    def __init__(self):
+        self.characters = {}  # id -> catalogue document
+        self.locked = set()
+        self._anime = {}  # anime -> set of character ids
+        self.loaded = False
+        self.version = 0  # bumped on every catalogue change
+        self._buckets = {}  # (event tag or None, rarity) -> _Bucket
+        self._tables = {}  # (profile, event tag or None) -> AliasTable or None
+        self._load_lock = asyncio.Lock()
+
+    async def load(self):
+        """(Re)build the whole pool from the database"""
+        async with self._load_lock:
+            locked_ids = await locked_spawns_collection.distinct('character_id')
+            characters = await collection.find({}).to_list(length=None)
+
+            self.characters = {}
+            self.locked = set(locked_ids)
+            self._anime = {}
+            self._buckets = {}
+            self._tables = {}
+            for character in characters:
+                self._store(character)
+            self.loaded = True
+            self.version += 1
+            LOGGER.info(f"Spawn pool loaded: {len(self.characters)} characters, {len(self.locked)} locked")
+
+    async def ensure_loaded(self):
+        if not self.loaded:
+            await self.load()
+
+    def _bucket_keys(self, character):
+        rarity = character.get('rarity', 'Common')
+        keys = [(None, rarity)]
+        keys.extend((tag, rarity) for tag in event_tags_for(character))
+        return keys
+
+    def _is_spawnable(self, character):
+        return (character.get('rarity', 'Common') not in NEVER_SPAWN_RARITIES
+                and character['id'] not in self.locked)
+
+    def _index(self, character):
+        for key in self._bucket_keys(character):
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = _Bucket()
+            was_empty = not bucket
+            bucket.add(character['id'])
+            if was_empty:
+                self._tables.clear()
+
+    def _unindex(self, character):
+        for key in self._bucket_keys(character):
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                continue
+            bucket.discard(character['id'])
+            if not bucket:
+                del self._buckets[key]
+                self._tables.clear()
+
+    def _store(self, character):
+        self.characters[character['id']] = character
+        self._anime.setdefault(character.get('anime'), set()).add(character['id'])
+        if self._is_spawnable(character):
+            self._index(character)
+
+    # ----- incremental maintenance -----
+
+    def add_character(self, character):
+        """Insert or replace a catalogue document"""
+        if not self.loaded or not character or 'id' not in character:
+            return
+        self.remove_character(character['id'])
+        self._store(character)
+        self.version += 1
+
+    def remove_character(self, char_id):
+        if not self.loaded:
+            return
+        old = self.characters.pop(char_id, None)
+        if old is not None:
+            self.version += 1
+            self._unindex(old)
+            ids = self._anime.get(old.get('anime'))
+            if ids is not None:
+                ids.discard(char_id)
+                if not ids:
+                    del self._anime[old.get('anime')]
+
+    async def refresh_character(self, char_id):
+        """Re-read one character after an edit"""
+        if not self.loaded:
+            return
+        character = await collection.find_one({'id': char_id})
+        if character:
+            self.add_character(character)
+        else:
+            self.remove_character(char_id)
+
+    def lock(self, char_id):
+        if char_id in self.locked:
+            return
+        self.locked.add(char_id)
+        character = self.characters.get(char_id)
+        if character is not None:
+            self._unindex(character)
+
+    def unlock(self, char_id):
+        if char_id not in self.locked:
+            return
+        self.locked.discard(char_id)
+        character = self.characters.get(char_id)
+        if character is not None and self._is_spawnable(character):
+            self._index(character)
+
+    # ----- selection -----
+
+    def _table(self, profile, event):
+        key = (profile, event)
+        if key in self._tables:
+            return self._tables[key]
+
+        weights = RARITY_WEIGHTS[profile]
+        rarities = []
+        rarity_weights = []
+        for (tag, rarity), bucket in self._buckets.items():
+            weight = weights.get(rarity, 0)
+            if tag == event and bucket and weight > 0:
+                rarities.append(rarity)
+                rarity_weights.append(weight)
+
+        table = AliasTable(rarities, rarity_weights) if rarities else None
+        self._tables[key] = table
+        return table
+
+    def pick(self, profile="normal", event=None, recent=()):
+        """Weighted rarity via alias table, then a uniform character of that rarity"""
+        table = self._table(profile, event)
+        if table is None:
+            return None
+        rarity = table.sample()
+        return self.pick_from(rarity, event, recent)
+
+    def pick_from(self, rarity, event=None, recent=()):
+        """Uniform character of one rarity (respecting the event filter)"""
+        bucket = self._buckets.get((event, rarity))
+        if not bucket:
+            return None
+        return self.characters[bucket.choice(recent)]
+
+    def count(self, rarity, event=None):
+        bucket = self._buckets.get((event, rarity))
+        return len(bucket) if bucket else 0
+
+    # ----- per anime -----
+
+    def anime_count(self, anime) -> int:
+        """How many catalogue characters belong to an anime"""
+        return len(self._anime.get(anime, ()))
+
+    def anime_ids(self, anime) -> frozenset:
+        return frozenset(self._anime.get(anime, ()))
+
+
+spawn_pool = SpawnPool()
@@ -0,0 +1,153 @@
+import asyncio
+import urllib.parse
+from typing import NamedTuple
+
+import aiohttp
+from cachetools import TTLCache
+
+from shivu import media
+
+
+TIMEOUT = aiohttp.ClientTimeout(total=10, sock_connect=5)
+MAX_CONNECTIONS = 32
+MAX_PER_HOST = 4
+SNIFF_BYTES = 64  # enough for every signature media.sniff() knows
+VALID_TTL = 3600
+INVALID_TTL = 60  # a host that was down gets another chance soon
+MAX_CACHED = 4096
+
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+
+DISCORD_HOSTS = (
+    'cdn.discordapp.com',
+    'media.discordapp.net',
+    'attachments.discordapp.net',
+    'cdn.discord.com',
+    'media.discord.com',
+)
+
+MEDIA_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.webp', '.bmp', '.mp4', '.mov', '.avi', '.mkv')
+
+
+def is_discord_cdn_url(url):
+    """Check if the URL is a Discord CDN link or a local/direct file link"""
+    try:
+        parsed = urllib.parse.urlparse(url)
+        if parsed.scheme not in ['http', 'https']:
+            return False
+        # Also support 0.0.0.0 or other direct IP links mentioned by user
+        return parsed.netloc in DISCORD_HOSTS or parsed.netloc == '0.0.0.0'
+    except Exception:
+        return False
+
+
+class Validation(NamedTuple):
+    ok: bool
+    message: str
+    mime_type: str = None  # what the host said or the first bytes showed, if media
+
+
+def _media_type(content_type):
+    if content_type.startswith('image/') or content_type.startswith('video/'):
+        return content_type
+    return None
+
+
+class UrlValidator:
+    """Checks that a media URL answers with an image or a video.
+
+    Runs on one pooled aiohttp session, so a slow host only holds up the
+    upload that named it. A HEAD request settles most URLs; hosts that refuse
+    HEAD or don't say what they serve get a ranged GET for the first
+    SNIFF_BYTES, sniffed for a media signature. Results are kept per URL
+    (failures briefly) and concurrent checks of one URL share a request.
+    """
+
+    def __init__(self):
+        self._session = None
+        self._valid = TTLCache(MAX_CACHED, VALID_TTL)
+        self._invalid = TTLCache(MAX_CACHED, INVALID_TTL)
+        self._pending = {}  # url -> check in flight
+        self.hits = 0
+        self.misses = 0
+
+    def session(self):
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=MAX_CONNECTIONS, limit_per_host=MAX_PER_HOST, ttl_dns_cache=300),
+                timeout=TIMEOUT,
+                headers={'User-Agent': USER_AGENT},
+            )
+        return self._session
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+
+    async def validate(self, url) -> Validation:
+        result = self._valid.get(url) or self._invalid.get(url)
+        if result is not None:
+            self.hits += 1
+            return result
+
+        self.misses += 1
+        check = self._pending.get(url)
+        if check is None:
+            check = self._pending[url] = asyncio.ensure_future(self._check(url))
+            check.add_done_callback(lambda _: self._pending.pop(url, None))
+        return await asyncio.shield(check)
+
+    async def validate_many(self, urls) -> list:
+        """validate() for each URL, all at once"""
+        return await asyncio.gather(*(self.validate(url) for url in urls))
+
+    async def _check(self, url) -> Validation:
+        try:
+            result = await self._fetch(url)
+        except asyncio.TimeoutError:
+            result = Validation(False, "URL Error: timed out")
+        except aiohttp.ClientResponseError as e:
+            result = Validation(False, f"HTTP Error: {e.status}")
+        except aiohttp.ClientError as e:
+            result = Validation(False, f"URL Error: {str(e)}")
+        except Exception as e:
+            result = Validation(False, f"Validation Error: {str(e)}")
+        (self._valid if result.ok else self._invalid)[url] = result
+        return result
+
+    async def _fetch(self, url) -> Validation:
+        # For Discord or direct file links (like 0.0.0.0/dl/...), bypass full validation and just check structure
+        if is_discord_cdn_url(url):
+            parsed = urllib.parse.urlparse(url)
+            if parsed.path and ('/' in parsed.path[1:]):
+                return Validation(True, "Media link (validation bypassed)")
+            return Validation(False, "Invalid media link structure")
+
+        session = self.session()
+        async with session.head(url, allow_redirects=True) as response:
+            status = response.status
+            mime_type = _media_type(response.content_type)
+        if mime_type:
+            return self._valid_media(mime_type)
+        if status >= 400 and status not in (403, 405, 501):
+            return Validation(False, f"HTTP Error: {status}")
+
+        # HEAD refused or unhelpful (octet-stream, text/plain): look at the first bytes
+        async with session.get(url, headers={'Range': f'bytes=0-{SNIFF_BYTES - 1}'}) as response:
+            if response.status >= 400:
+                return Validation(False, f"HTTP Error: {response.status}")
+            mime_type = _media_type(response.content_type) or media.sniff(await response.content.read(SNIFF_BYTES))
+        if mime_type:
+            return self._valid_media(mime_type)
+
+        if any(ext in url.lower() for ext in MEDIA_EXTENSIONS):
+            return Validation(True, "Valid media URL")
+        return Validation(False, "URL does not appear to be an image or video")
+
+    @staticmethod
+    def _valid_media(mime_type):
+        kind = 'image' if mime_type.startswith('image/') else 'video'
+        return Validation(True, f"Valid {kind} URL", mime_type)
+
+
+url_validator = UrlValidator()
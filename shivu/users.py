@@ -0,0 +1,66 @@
+from shivu import user_collection
+from shivu.harem_store import COUNTS_FIELD, LEGACY_FIELD, counts_field
+
+
+# Accessors for user documents, each fetching only what its caller reads.
+# Legacy users still embed every character they own, so a bare
+# find_one({'id': ...}) can pull megabytes for a one-field answer.
+
+PROFILE_FIELDS = ('id', 'username', 'first_name')
+PREF_FIELDS = ('filter_type', 'filter_value', 'sort_preference', 'favorites')
+HAREM_FIELDS = ('id', COUNTS_FIELD, LEGACY_FIELD)
+
+
+def _projection(fields):
+    projection = {'_id': 1}
+    for field in fields:
+        # Only the first favourite is ever shown
+        projection[field] = {'$slice': 1} if field == 'favorites' else 1
+    return projection
+
+
+async def get_user(user_id, *fields):
+    """The user's document limited to `fields`, or None if they don't exist"""
+    return await user_collection.find_one({'id': user_id}, _projection(fields or ('id',)))
+
+
+async def exists(user_id) -> bool:
+    return await user_collection.find_one({'id': user_id}, {'_id': 1}) is not None
+
+
+async def get_profile(user_id):
+    """id, username and first name"""
+    return await get_user(user_id, *PROFILE_FIELDS)
+
+
+async def get_harem(user_id, *fields):
+    """Everything the user owns (see harem_store) plus any extra `fields`"""
+    return await get_user(user_id, *HAREM_FIELDS, *fields)
+
+
+async def get_owned(user_id, character_id, *fields):
+    """The user limited to their copies of one character, for harem_store.get_character.
+
+    Legacy copies come back through $elemMatch, so at most one of them.
+    """
+    projection = _projection(('id', *fields))
+    projection[counts_field(character_id)] = 1
+    projection[LEGACY_FIELD] = {'$elemMatch': {'id': character_id}}
+    return await user_collection.find_one({'id': user_id}, projection)
+
+
+async def count_copies(user_id, character_id) -> int:
+    """How many copies of a character the user owns, counted by the server"""
+    cursor = user_collection.aggregate([
+        {'$match': {'id': user_id}},
+        {'$project': {
+            '_id': 0,
+            'counted': {'$ifNull': [f'${counts_field(character_id)}', 0]},
+            'legacy': {'$size': {'$filter': {
+                'input': {'$ifNull': [f'${LEGACY_FIELD}', []]},
+                'cond': {'$eq': ['$$this.id', character_id]},
+            }}},
+        }},
+    ])
+    docs = await cursor.to_list(length=1)
+    return docs[0]['counted'] + docs[0]['legacy'] if docs else 0